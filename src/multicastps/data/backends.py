@@ -0,0 +1,248 @@
+#embedded databases for MulticastDB: the MySQL statements of the package are translated to SQLite or DuckDB when they run
+import datetime as dt
+import functools
+import logging
+import os
+import re
+import zlib
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+#   mysql       the central server, see the DB_* environment variables
+#   sqlite      a database file, no dependency beyond python
+#   duckdb      a columnar database file, fastest for the scans of the coverage queries, requires duckdb_engine
+BACKENDS = ['mysql', 'sqlite', 'duckdb']
+EMBEDDED = ['sqlite', 'duckdb']
+DEFAULT_DIR = os.path.join('data', 'db')   #directory of the database file if DB_PATH is not set
+
+_QUOTED = re.compile(r"'(?:[^'\\]|\\.|'')*'|\"[^\"]*\"|`[^`]*`")
+_PLACEHOLDER = re.compile(r'\x00(\d+)\x00')
+
+def default_path(backend):
+    return os.path.join(DEFAULT_DIR, f"multicast.{backend}")
+
+def embedded_url(backend, path):
+    return f"{backend}:///{path}"
+
+def _protect(sql):
+    #replace string literals and quoted names by placeholders, so that rewrites only see SQL. Backticks become double quotes
+    quoted = []
+    def keep(m):
+        s = m.group(0)
+        quoted.append('"' + s[1:-1] + '"' if s[0] == '`' else s)
+        return f"\x00{len(quoted) - 1}\x00"
+    return _QUOTED.sub(keep, sql), quoted
+
+def _restore(sql, quoted):
+    return _PLACEHOLDER.sub(lambda m: quoted[int(m.group(1))], sql)
+
+def _calls(sql, name, rewrite):
+    """Replace the calls name(arg, ...) in sql by rewrite([arg, ...]), innermost calls first"""
+    pattern = re.compile(rf'\b{name}\s*\(', re.IGNORECASE)
+    out, pos = [], 0
+    for m in pattern.finditer(sql):
+        if m.start() < pos: #nested in a call already rewritten
+            continue
+        depth, i, start, args = 1, m.end(), m.end(), []
+        while depth:
+            if sql[i] == '(':
+                depth += 1
+            elif sql[i] == ')':
+                depth -= 1
+            elif sql[i] == ',' and depth == 1:
+                args.append(sql[start:i])
+                start = i + 1
+            i += 1
+        args.append(sql[start:i - 1])
+        out.append(sql[pos:m.start()])
+        out.append(rewrite([_calls(a, name, rewrite).strip() for a in args]))
+        pos = i
+    out.append(sql[pos:])
+    return ''.join(out)
+
+def _days(arg):
+    #number of days of an 'INTERVAL n DAY' argument of DATE_ADD/DATE_SUB, the only unit used by the package
+    m = re.fullmatch(r'INTERVAL\s+(.+)\s+DAY', arg, re.IGNORECASE | re.DOTALL)
+    if m is None:
+        raise ValueError(f"Only intervals in days can be translated: {arg}")
+    return m.group(1)
+
+def _date_shift(dialect, sign):
+    def rewrite(args):
+        if dialect == 'sqlite':
+            return f"DATE({args[0]}, '{sign}' || ({_days(args[1])}) || ' days')"
+        return f"(CAST({args[0]} AS DATE) {sign} CAST({_days(args[1])} AS INTEGER))"
+    return rewrite
+
+def _keys(sql):
+    """(start, end, unique, name, parts) of the KEY and UNIQUE KEY clauses of a CREATE TABLE statement, from the comma 
+    before the clause to its closing parenthesis, in sql with quoted names protected (see _protect). Parts can hold
+    expressions in parentheses"""
+    ret = []
+    for m in re.finditer(r',\s*(UNIQUE\s+)?KEY\s+(\x00\d+\x00|\w+)\s*\(', sql, re.IGNORECASE):
+        depth, i = 1, m.end()
+        while depth:
+            depth += {'(': 1, ')': -1}.get(sql[i], 0)
+            i += 1
+        ret.append((m.start(), i, m.group(1) is not None, m.group(2), sql[m.end():i - 1]))
+    return ret
+
+def _ddl(sql, dialect):
+    #CREATE TABLE statements: table options, display widths and KEYs, declared separately (see index_statements), are dropped
+    sql = re.sub(r'\bENGINE\s*=\s*\w+', '', sql, flags=re.IGNORECASE)
+    sql = re.sub(r'\bON\s+UPDATE\s+CURRENT_TIMESTAMP\b', '', sql, flags=re.IGNORECASE)
+    for start, end, unique, name, parts in reversed(_keys(sql)):
+        sql = sql[:start] + sql[end:]
+    sql = re.sub(r'\b(\w*int)\s*\(\d+\)', r'\1', sql, flags=re.IGNORECASE) #display widths
+    if dialect == 'duckdb':
+        #only virtual generated columns, no unsigned or medium integers
+        sql = re.sub(r'\bAS\s*(\(.*?\))\s*STORED\b', r'GENERATED ALWAYS AS \1 VIRTUAL', sql, flags=re.IGNORECASE | re.DOTALL)
+        sql = re.sub(r'\b(tiny|small|big)?int\s*(?:\(\d+\))?\s+unsigned\b',
+                     lambda m: {'tiny': 'UTINYINT', 'small': 'USMALLINT', 'big': 'UBIGINT'}.get((m.group(1) or '').lower(), 'UINTEGER'),
+                     sql, flags=re.IGNORECASE)
+        sql = re.sub(r'\bmediumint\b', 'INTEGER', sql, flags=re.IGNORECASE)
+    return sql
+
+@functools.lru_cache(maxsize=1024)
+def translate(sql, dialect, paramstyle = 'qmark'):
+    """Statement sql written for MySQL in the dialect of an embedded database ('sqlite' or 'duckdb'). Covers what the
+    package uses: quoting, CREATE TABLE options and keys, REPLACE/INSERT IGNORE/ON DUPLICATE KEY UPDATE, <=>, %s parameters,
+    DATE_ADD/DATE_SUB in days and, for DuckDB, DATE(), CRC32 and the REGEXP functions (SQLite gets them as user functions,
+    see sqlite_functions). Statements already in the dialect are returned unchanged"""
+    if dialect not in EMBEDDED:
+        return sql
+    sql, quoted = _protect(sql)
+    if re.match(r'\s*CREATE\s+TABLE\b', sql, re.IGNORECASE):
+        sql = _ddl(sql, dialect)
+    sql = re.sub(r'\bREPLACE\s+INTO\b', 'INSERT OR REPLACE INTO', sql, flags=re.IGNORECASE)
+    sql = re.sub(r'\bINSERT\s+IGNORE\s+INTO\b', 'INSERT OR IGNORE INTO', sql, flags=re.IGNORECASE)
+    m = re.search(r'\bON\s+DUPLICATE\s+KEY\s+UPDATE\b', sql, re.IGNORECASE)
+    if m: #the tables have a single unique key, the conflict target can be left out
+        update = re.sub(r'\bVALUES\s*\(\s*([^)]*?)\s*\)', r'excluded.\1', sql[m.end():], flags=re.IGNORECASE)
+        sql = sql[:m.start()] + 'ON CONFLICT DO UPDATE SET' + update
+    sql = sql.replace('<=>', 'IS' if dialect == 'sqlite' else 'IS NOT DISTINCT FROM')
+    if dialect == 'duckdb':
+        sql = _calls(sql, 'DATE', lambda args: f"CAST({args[0]} AS DATE)")
+        sql = re.sub(r'\bCRC32\s*\(', 'hash(', sql, flags=re.IGNORECASE)
+        sql = re.sub(r'\bREGEXP_SUBSTR\s*\(', 'regexp_extract(', sql, flags=re.IGNORECASE)
+        sql = re.sub(r'\bREGEXP_LIKE\s*\(', 'regexp_matches(', sql, flags=re.IGNORECASE)
+        sql = re.sub(r'\bDATABASE\s*\(\s*\)', 'current_schema()', sql, flags=re.IGNORECASE)
+    sql = _calls(sql, 'DATE_ADD', _date_shift(dialect, '+'))
+    sql = _calls(sql, 'DATE_SUB', _date_shift(dialect, '-'))
+    if paramstyle == 'qmark':
+        sql = sql.replace('%s', '?')
+    elif paramstyle == 'numeric_dollar':
+        n = iter(range(1, sql.count('%s') + 1))
+        sql = re.sub(r'%s', lambda m: f"${next(n)}", sql)
+    return _restore(sql, quoted)
+
+def index_statements(ddl):
+    """CREATE INDEX statements of the KEYs and UNIQUE KEYs of a MySQL CREATE TABLE statement, which embedded databases
+    declare separately, without prefix lengths. Index names are prefixed with the table, they are unique in the whole
+    database"""
+    sql, quoted = _protect(ddl)
+    table = _restore(re.search(r'CREATE\s+TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?(\S+)', sql, re.IGNORECASE).group(1), quoted)
+    table = table.strip('`"')
+    ret = []
+    for start, end, unique, name, parts in _keys(sql):
+        name = _restore(name, quoted).strip('`"')
+        parts = _restore(re.sub(r'(\x00\d+\x00)\s*\(\d+\)', r'\1', parts), quoted) #prefix lengths
+        ret.append(f"CREATE {'UNIQUE ' if unique else ''}INDEX IF NOT EXISTS `{table}_{name}` ON `{table}` ({parts})")
+    return ret
+
+def file_watermark(path):
+    """Modification time and size of a database file and of its write-ahead log, which change with every commit"""
+    ret = []
+    for p in [path, path + '-wal', path + '.wal']:
+        if os.path.exists(p):
+            st = os.stat(p)
+            ret.append([st.st_mtime_ns, st.st_size])
+    return ret
+
+
+#MySQL functions used by the package, missing in SQLite
+def _regexp_like(value, pattern):
+    return None if value is None or pattern is None else re.search(pattern, value) is not None
+
+def _regexp_substr(value, pattern):
+    if value is None or pattern is None:
+        return None
+    m = re.search(pattern, value)
+    return m.group(0) if m else None
+
+def _crc32(value):
+    return None if value is None else zlib.crc32(str(value).encode('utf-8'))
+
+def _concat_ws(sep, *values):
+    return sep.join(str(v) for v in values if v is not None)
+
+def _hour(value):
+    #hour of a timestamp stored as text, see _timestamp
+    return None if value is None else int(str(value)[11:13])
+
+
+class _BitXor:
+    def __init__(self) -> None:
+        self.value = 0
+
+    def step(self, value):
+        if value is not None:
+            self.value ^= int(value)
+
+    def finalize(self):
+        return self.value
+
+
+class _BitOr(_BitXor):
+    def step(self, value):
+        if value is not None:
+            self.value |= int(value)
+
+
+def _timestamp(value):
+    #stored as SQLAlchemy stores datetimes in SQLite, so that values inserted by pandas and by insert_pd compare equal
+    return value.strftime('%Y-%m-%d %H:%M:%S.%f') if isinstance(value, dt.datetime) else value
+
+def _sqlite_parameters(parameters, executemany):
+    #datetimes (and pd.Timestamp) of the parameters of a statement as _timestamp, without changing the adapters of the
+    #sqlite3 module, which apply to every connection of the process
+    def row(params):
+        if isinstance(params, dict):
+            return {k: _timestamp(v) for k, v in params.items()}
+        return tuple(map(_timestamp, params))
+    return [row(p) for p in parameters] if executemany else row(parameters)
+
+def sqlite_functions(dbapi_connection, connection_record = None):
+    """Register the MySQL functions used by the package on a new SQLite connection, with write-ahead logging so that
+    the concurrent queries of the report do not wait for each other. The driver does not begin transactions itself, 
+    see _begin"""
+    dbapi_connection.isolation_level = None
+    dbapi_connection.create_function('REGEXP_LIKE', 2, _regexp_like, deterministic=True)
+    dbapi_connection.create_function('REGEXP_SUBSTR', 2, _regexp_substr, deterministic=True)
+    dbapi_connection.create_function('CRC32', 1, _crc32, deterministic=True)
+    dbapi_connection.create_function('CONCAT_WS', -1, _concat_ws, deterministic=True)
+    dbapi_connection.create_function('HOUR', 1, _hour, deterministic=True)
+    dbapi_connection.create_aggregate('BIT_XOR', 1, _BitXor)
+    dbapi_connection.create_aggregate('BIT_OR', 1, _BitOr)
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode = WAL")
+    cursor.execute("PRAGMA synchronous = NORMAL")
+    cursor.close()
+
+def _begin(conn):
+    #the driver only begins a transaction before DML, so a SAVEPOINT coming first started its own transaction, committed
+    #when the savepoint was released: the transaction is begun explicitly instead
+    conn.exec_driver_sql("BEGIN")
+
+def install(engine, backend):
+    """Translate the statements run on engine to the dialect of backend, see translate"""
+    if backend == 'sqlite':
+        event.listen(engine, 'connect', sqlite_functions)
+        event.listen(engine, 'begin', _begin)
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if backend == 'sqlite':
+            parameters = _sqlite_parameters(parameters, executemany)
+        return translate(statement, backend, conn.dialect.paramstyle), parameters
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute, retval=True)
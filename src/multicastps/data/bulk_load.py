@@ -0,0 +1,176 @@
+#bulk insert strategies used by MulticastDB.insert_pd
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+METHODS = ['executemany', 'load_data', 'to_sql']
+#what happens to a row whose natural key is already in the table: kept (ignore), overwritten by the new row (update), 
+#or the insert fails (error)
+ON_DUPLICATE = ['ignore', 'update', 'error']
+
+def to_wallclock(df):
+    """Return a copy of df where timezone aware datetime columns are converted to naive local time.
+    This is what DataFrame.to_sql sends to mysqlconnector, so all strategies store the same values"""
+    df = df.copy()
+    for col in df.columns:
+        if isinstance(df[col].dtype, pd.DatetimeTZDtype):
+            df[col] = df[col].dt.tz_localize(None)
+    return df
+
+def key_columns(keys):
+    #column names of a natural key, without index prefix lengths as in 'PACKAGE_NAME(191)' and without the expressions
+    return [k.split('(')[0] for k in keys if not k.startswith('(')]
+
+def key_parts(keys):
+    #parts of a natural key as SQL: quoted columns without index prefix lengths, and the expressions
+    return [k if k.startswith('(') else f"`{k.split('(')[0]}`" for k in keys]
+
+def insert_statement(table, columns, verb = 'INSERT', on_duplicate = 'error', keys = ()):
+    """INSERT statement with %s parameters. With on_duplicate 'update' the columns of the row not in keys are
+    overwritten when the natural key exists, with 'ignore' the row is skipped"""
+    cols = ', '.join(f'`{c}`' for c in columns)
+    vals = ', '.join(['%s'] * len(columns))
+    keys = {k.upper() for k in key_columns(keys)}
+    update = [c for c in columns if c.upper() not in keys]
+    if on_duplicate == 'ignore' or (on_duplicate == 'update' and not update):
+        verb = f"{verb} IGNORE"
+    stmt = f"{verb} INTO `{table}` ({cols}) VALUES ({vals})"
+    if on_duplicate == 'update' and update:
+        stmt += " ON DUPLICATE KEY UPDATE " + ', '.join(f'`{c}` = VALUES(`{c}`)' for c in update)
+    return stmt
+
+def iter_row_batches(df, batch_size):
+    """Yield lists of tuples of python objects (NaN/NaT as None) of at most batch_size rows"""
+    for start in range(0, len(df), batch_size):
+        chunk = df.iloc[start:start + batch_size]
+        chunk = chunk.astype(object).where(chunk.notna(), None)
+        yield list(chunk.itertuples(index=False, name=None))
+
+def insert_executemany(connection, df, table, batch_size, on_duplicate = 'error', keys = ()):
+    """Insert df with one multi-row INSERT per batch. mysqlconnector rewrites executemany on INSERT
+    into a single INSERT ... VALUES (...), (...) statement, also with IGNORE and ON DUPLICATE KEY UPDATE"""
+    df = to_wallclock(df)
+    stmt = insert_statement(table, df.columns, on_duplicate=on_duplicate, keys=keys)
+    for rows in iter_row_batches(df, batch_size):
+        connection.exec_driver_sql(stmt, rows)
+
+def insert_deduplicated(connection, df, table, on_duplicate = 'ignore', keys = ()):
+    """Insert df in one statement from a temporary copy with the columns of table, leaving out the rows whose natural 
+    key is in table or earlier in df. With on_duplicate 'update' the columns of the rows of table with the key of a row 
+    of df not in keys are overwritten by those of the last such row. For DuckDB, which does not see the conflicts of 
+    INSERT OR IGNORE with a unique index on columns holding NULL, e.g. the values of a row_hash"""
+    df = to_wallclock(df)
+    cols = ', '.join(f'`{c}`' for c in df.columns)
+    parts = key_parts(keys)
+    match = ' AND '.join(re.sub(r'`(\w+)`', rf'`{table}`.`\1`', p) + ' = ' + re.sub(r'`(\w+)`', r'i.`\1`', p) for p in parts)
+    order = 'DESC' if on_duplicate == 'update' else 'ASC'
+    incoming = f"""(SELECT * FROM (SELECT *, ROW_NUMBER() OVER (PARTITION BY {', '.join(parts)} ORDER BY rowid {order}) AS _n 
+                                   FROM `_incoming`) WHERE _n = 1) i"""
+    raw = connection.connection.dbapi_connection
+    raw.register('_df', df)
+    try:
+        connection.exec_driver_sql(f"CREATE OR REPLACE TEMP TABLE `_incoming` AS SELECT * FROM `{table}` LIMIT 0")
+        connection.exec_driver_sql(f"INSERT INTO `_incoming` ({cols}) SELECT {cols} FROM `_df`")
+        keys = {k.upper() for k in key_columns(keys)}
+        update = [c for c in df.columns if c.upper() not in keys]
+        if on_duplicate == 'update' and update:
+            connection.exec_driver_sql(f"UPDATE `{table}` SET " + ', '.join(f'`{c}` = i.`{c}`' for c in update) 
+                                       + f" FROM {incoming} WHERE {match}")
+        connection.exec_driver_sql(f"""INSERT INTO `{table}` ({cols}) SELECT {', '.join(f'i.`{c}`' for c in df.columns)} 
+                                       FROM {incoming} WHERE NOT EXISTS (SELECT 1 FROM `{table}` WHERE {match})""")
+        connection.exec_driver_sql("DROP TABLE `_incoming`")
+    finally:
+        raw.unregister('_df')
+
+def _mysql_text(col):
+    #render one column in the text format expected by LOAD DATA, NULL values as \N
+    isnull = col.isna()
+    if pd.api.types.is_datetime64_any_dtype(col):
+        txt = col.dt.strftime('%Y-%m-%d %H:%M:%S.%f')
+    elif pd.api.types.is_bool_dtype(col) or (col.dtype == object and (~isnull).any() 
+                                               and col[~isnull].map(pd.api.types.is_bool).all()):
+        #booleans, also with missing values (object column), as 1/0: 'True' would be stored as 0 in a TINYINT column
+        txt = col.astype(object).where(~isnull, False).astype(bool).astype(int).astype(str)
+    else:
+        txt = col.astype(str)
+        if not pd.api.types.is_numeric_dtype(col):
+            txt = (txt.str.replace('\\', '\\\\', regex=False)
+                      .str.replace('\t', '\\t', regex=False)
+                      .str.replace('\n', '\\n', regex=False)
+                      .str.replace('\r', '\\r', regex=False))
+    return txt.where(~isnull, '\\N')
+
+def write_load_file(df, path):
+    """Write df as a tab separated file readable by LOAD DATA INFILE with default escaping"""
+    cols = [_mysql_text(df[c]) for c in df.columns]
+    lines = cols[0].str.cat(cols[1:], sep='\t') if len(cols) > 1 else cols[0]
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        for line in lines:
+            f.write(line)
+            f.write('\n')
+
+def insert_load_data(connection, df, table, on_duplicate = 'error'):
+    """Insert df by streaming a temporary TSV file through LOAD DATA LOCAL INFILE.
+    Needs local_infile enabled on the server and allow_local_infile on the client connection.
+    Rows with an existing natural key are skipped unless on_duplicate is 'update', in which case they replace
+    the existing row. With LOCAL the server can't abort the transfer, so 'error' behaves as 'ignore'"""
+    df = to_wallclock(df)
+    fd, path = tempfile.mkstemp(suffix='.tsv', prefix=f'{table}_')
+    os.close(fd)
+    try:
+        write_load_file(df, path)
+        cols = ', '.join(f'`{c}`' for c in df.columns)
+        connection.exec_driver_sql(f"""LOAD DATA LOCAL INFILE '{path}' {'REPLACE' if on_duplicate == 'update' else 'IGNORE'} INTO TABLE `{table}`
+                                    CHARACTER SET utf8mb4
+                                    FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\'
+                                    LINES TERMINATED BY '\\n'
+                                    ({cols})""")
+    finally:
+        os.remove(path)
+
+
+class LoadStats:
+    """Accumulates rows and seconds spent inserting, per strategy and table. Can be shared by writer threads"""
+    def __init__(self) -> None:
+        self.stats = dict() #(method, table) -> [rows, seconds, calls]
+        self.lock = threading.Lock()
+
+    def add(self, method, table, rows, seconds):
+        with self.lock:
+            entry = self.stats.setdefault((method, table), [0, 0.0, 0])
+            entry[0] += rows
+            entry[1] += seconds
+            entry[2] += 1
+
+    def timed(self, method, table, rows):
+        return _Timer(self, method, table, rows)
+
+    def summary(self):
+        """Returns a pandas table with rows, seconds, calls and rows_per_sec per method and table"""
+        ret = pd.DataFrame([(m, t, *v) for (m, t), v in self.stats.items()],
+                           columns=['method', 'table', 'rows', 'seconds', 'calls'])
+        ret['rows_per_sec'] = (ret['rows'] / ret['seconds']).round(1)
+        return ret.sort_values(['method', 'table']).reset_index(drop=True)
+
+
+class _Timer:
+    def __init__(self, stats, method, table, rows):
+        self.stats, self.method, self.table, self.rows = stats, method, table, rows
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is None:
+            elapsed = time.perf_counter() - self.start
+            self.stats.add(self.method, self.table, self.rows, elapsed)
+            logger.debug(f"Inserted {self.rows} rows in {self.table} with {self.method}: "
+                         f"{elapsed:.2f}s ({self.rows / max(elapsed, 1e-9):.0f} rows/s)")
+        return False
@@ -0,0 +1,149 @@
+#cache of query results, invalidated when the tables a query reads change, see MulticastDB.query
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+from collections import OrderedDict
+
+try: #optional, needed to enable the cache
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BYTES = 256 * 2**20
+
+def normalize_sql(sql):
+    #whitespace and case of keywords don't change a query, the values of string literals do, so only whitespace is collapsed
+    return re.sub(r'\s+', ' ', sql).strip().rstrip(';').strip()
+
+def is_read_only(sql):
+    return re.match(r'\s*(SELECT|WITH)\b', sql, re.IGNORECASE) is not None
+
+def tables_of(sql, table_names):
+    """Tables of table_names that appear as words in sql. Names are matched wherever they are, e.g. also in a column
+    alias, which at worst invalidates a cached result more often than needed"""
+    words = {w.lower() for w in re.findall(r'[A-Za-z_][A-Za-z0-9_]*', sql)}
+    return sorted(t for t in table_names if t.lower() in words)
+
+def cache_key(sql, params = None):
+    text = normalize_sql(sql) + '\n' + json.dumps(params or {}, sort_keys=True, default=str)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+def result_rows(columns, values):
+    """Rows of a result as tuples with the column names in _fields, like the rows returned by SQLAlchemy,
+    so that pd.DataFrame(rows) names the columns"""
+    row = type('CachedRow', (tuple,), {'_fields': tuple(columns), '__slots__': ()})
+    return [row(r) for r in zip(*values)] if values else []
+
+def to_arrow(columns, rows):
+    #arrow table of a result, None if a column can't be converted (e.g. values of mixed types)
+    try:
+        arrays = [pa.array([r[i] for r in rows]) for i in range(len(columns))]
+    except (pa.ArrowInvalid, pa.ArrowTypeError, TypeError):
+        return None
+    return pa.Table.from_arrays(arrays, names=list(columns))
+
+def from_arrow(table):
+    return result_rows(table.column_names, [c.to_pylist() for c in table.columns])
+
+
+class QueryCache:
+    """Results of read only queries, keyed by their normalized SQL and parameters. Each result is stored with the
+    watermarks of the tables it read when it was computed, and is only returned while they are unchanged.
+    Results are kept in memory, least recently used first out beyond max_bytes, and if cache_dir is set as arrow files
+    that outlive the session. Files of invalidated results are replaced when the query runs again"""
+
+    def __init__(self, cache_dir = None, max_bytes = DEFAULT_BYTES) -> None:
+        if pa is None:
+            raise ImportError("pyarrow is needed for the query cache")
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.memory = OrderedDict()     #key -> (arrow table, watermarks)
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def _paths(self, key):
+        return os.path.join(self.cache_dir, key + '.arrow'), os.path.join(self.cache_dir, key + '.json')
+
+    def get(self, key, watermarks):
+        """Rows of the cached result of key if it was computed with the same watermarks, else None"""
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None:
+                self.memory.move_to_end(key)
+        if entry is None and self.cache_dir is not None:
+            entry = self._load(key)
+            if entry is not None:
+                self._remember(key, *entry)
+        with self.lock:
+            if entry is None or entry[1] != watermarks:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return from_arrow(entry[0])
+
+    def put(self, key, sql, columns, rows, watermarks):
+        table = to_arrow(columns, rows)
+        if table is None:
+            logger.debug(f"Result not cached, its columns can't be stored: {normalize_sql(sql)[:200]}")
+            return
+        self._remember(key, table, watermarks)
+        if self.cache_dir is not None:
+            self._store(key, sql, table, watermarks)
+
+    def _remember(self, key, table, watermarks):
+        with self.lock:
+            if key in self.memory:
+                self.bytes -= self.memory.pop(key)[0].nbytes
+            if table.nbytes > self.max_bytes:
+                return
+            self.memory[key] = (table, watermarks)
+            self.bytes += table.nbytes
+            while self.bytes > self.max_bytes:
+                _, (old, _) = self.memory.popitem(last=False)
+                self.bytes -= old.nbytes
+
+    def _store(self, key, sql, table, watermarks):
+        #written to temporary files and renamed, an entry is never half written
+        data_path, meta_path = self._paths(key)
+        with pa.OSFile(data_path + '.tmp', 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(data_path + '.tmp', data_path)
+        with open(meta_path + '.tmp', 'w') as f:
+            json.dump({'sql': normalize_sql(sql), 'watermarks': watermarks}, f, indent=1)
+        os.replace(meta_path + '.tmp', meta_path)
+
+    def _load(self, key):
+        data_path, meta_path = self._paths(key)
+        try:
+            with open(meta_path) as f:
+                watermarks = json.load(f)['watermarks']
+            with pa.memory_map(data_path) as source:
+                table = pa.ipc.open_file(source).read_all()
+        except (FileNotFoundError, ValueError, pa.ArrowInvalid):
+            return None
+        return table, watermarks
+
+    def clear(self):
+        """Forget all results, also those stored in cache_dir"""
+        with self.lock:
+            self.memory.clear()
+            self.bytes = 0
+        if self.cache_dir is not None:
+            for file in os.listdir(self.cache_dir):
+                if file.endswith('.arrow') or file.endswith('.json'):
+                    os.remove(os.path.join(self.cache_dir, file))
+
+    def stats(self):
+        """Hits, misses and size of the cache"""
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self.memory), 'bytes': self.bytes}
@@ -0,0 +1,147 @@
+#connection management of MulticastDB: pool settings, statistics of the pool, and retries of the operations that fail
+#with a transient error (lost connection, deadlock, lock wait timeout, database file locked by another writer)
+import logging
+import random
+import threading
+import time
+from sqlalchemy import event
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.pool import QueuePool
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_OVERFLOW = 10   #connections opened beyond pool_size when all are in use, closed once returned
+DEFAULT_TIMEOUT = 30        #seconds a checkout waits for a connection when pool_size + max_overflow are in use
+DEFAULT_RECYCLE = 3600      #seconds after which a connection is replaced, below the wait_timeout of the server (8 hours)
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 0.5       #seconds before the first retry, doubled for each next one
+
+#MySQL errors that do not depend on the statement: too many connections, lock wait timeout, deadlock, can't connect,
+#server has gone away, lost connection
+TRANSIENT_ERRORS = {1040, 1205, 1213, 2003, 2006, 2013, 2055}
+#the same errors of SQLite and DuckDB, which have no error numbers
+TRANSIENT_MESSAGES = ['database is locked', 'database table is locked', 'could not set lock', 'write-write conflict']
+
+def error_code(error):
+    #number of the driver error wrapped by error: errno for mysql-connector, the first argument for other drivers
+    orig = getattr(error, 'orig', None)
+    code = getattr(orig, 'errno', None)
+    if code is None and orig is not None and orig.args and isinstance(orig.args[0], int):
+        code = orig.args[0]
+    return code
+
+def is_transient(error):
+    """Whether error may not happen again if the operation is retried, on a new connection if the connection broke"""
+    if not isinstance(error, DBAPIError):
+        return False
+    if error.connection_invalidated:
+        return True
+    if error_code(error) in TRANSIENT_ERRORS:
+        return True
+    message = str(error.orig).lower()
+    return any(m in message for m in TRANSIENT_MESSAGES)
+
+def with_retries(fn, retries = DEFAULT_RETRIES, backoff = DEFAULT_BACKOFF, stats = None, what = 'operation'):
+    """Return fn(), calling it again at most retries times while it fails with a transient error. The n-th retry waits
+    backoff * 2**(n-1) seconds, up to 50% longer at random so that threads failing together don't retry together.
+    fn must be safe to call again after a failure, e.g. a whole transaction, which was rolled back"""
+    for attempt in range(retries + 1):
+        try:
+            return fn()
+        except DBAPIError as e:
+            if attempt == retries or not is_transient(e):
+                raise
+            wait = backoff * 2 ** attempt * random.uniform(1, 1.5)
+            logger.warning(f"Transient error during {what}, retry {attempt + 1}/{retries} in {wait:.1f}s: {e.orig}")
+            if stats is not None:
+                stats.retried()
+            time.sleep(wait)
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that adds the time each checkout waits for a connection to stats, see PoolStats.track"""
+    stats = None
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            if self.stats is not None:
+                self.stats.waited(time.perf_counter() - start)
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.stats = self.stats
+        return pool
+
+
+class PoolStats:
+    """Counts of the connection pool of an engine: connections checked out now and at most at once, checkouts and the
+    seconds they waited for a connection, connections opened, reconnects (connections replaced after they broke, failed
+    the pre-ping or were recycled), invalidations and retries of failed operations. Can be shared by threads"""
+    def __init__(self) -> None:
+        self.checked_out = 0
+        self.max_checked_out = 0
+        self.checkouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.connects = 0
+        self.reconnects = 0
+        self.invalidated = 0
+        self.retries = 0
+        self.engine = None
+        self.lock = threading.Lock()
+
+    def track(self, engine):
+        """Count the events of the pool of engine, created with poolclass=TimedQueuePool to measure wait times"""
+        self.engine = engine
+        if isinstance(engine.pool, TimedQueuePool):
+            engine.pool.stats = self
+        event.listen(engine, 'connect', self._connect)
+        event.listen(engine, 'checkout', self._checkout)
+        event.listen(engine, 'checkin', self._checkin)
+        event.listen(engine, 'invalidate', self._invalidate)
+
+    def _connect(self, dbapi_connection, connection_record):
+        #record_info outlives the connections of a record, a record connecting again replaces its connection
+        with self.lock:
+            self.connects += 1
+            if connection_record.record_info.get('connected'):
+                self.reconnects += 1
+        connection_record.record_info['connected'] = True
+
+    def _checkout(self, dbapi_connection, connection_record, connection_proxy):
+        with self.lock:
+            self.checkouts += 1
+            self.checked_out += 1
+            self.max_checked_out = max(self.max_checked_out, self.checked_out)
+
+    def _checkin(self, dbapi_connection, connection_record):
+        with self.lock:
+            self.checked_out -= 1
+
+    def _invalidate(self, dbapi_connection, connection_record, exception):
+        with self.lock:
+            self.invalidated += 1
+
+    def waited(self, seconds):
+        with self.lock:
+            self.wait_seconds += seconds
+            self.max_wait_seconds = max(self.max_wait_seconds, seconds)
+
+    def retried(self):
+        with self.lock:
+            self.retries += 1
+
+    def summary(self):
+        """Returns a dictionary of the counts, with the size and overflow of the pool"""
+        with self.lock:
+            ret = {'checked_out': self.checked_out, 'max_checked_out': self.max_checked_out, 'checkouts': self.checkouts,
+                   'wait_seconds': round(self.wait_seconds, 3), 'max_wait_seconds': round(self.max_wait_seconds, 3),
+                   'connects': self.connects, 'reconnects': self.reconnects, 'invalidated': self.invalidated,
+                   'retries': self.retries}
+        pool = self.engine.pool if self.engine is not None else None #replaced when the engine is disposed
+        if isinstance(pool, QueuePool):
+            ret.update({'pool_size': pool.size(), 'overflow': pool.overflow()})
+        return ret
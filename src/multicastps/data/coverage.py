@@ -0,0 +1,209 @@
+#index of the days and hours with records of each participant and stream, loaded from DAILY_COVERAGE into numpy arrays,
+#so that coverage questions (days without passive sensing, continuous windows...) are answered without scanning tables
+import hashlib
+import logging
+import os
+import threading
+import zipfile
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'multicastps')
+OVERLAP = pd.Timedelta(hours=1)     #days recounted this long before the last refresh are read again, see refresh
+HOURS = np.arange(24, dtype=np.uint32)
+
+def hour_bits(masks):
+    """(..., 24) bool array of the hours set in masks, bit h of a mask being hour h"""
+    return ((np.asarray(masks, dtype=np.uint32)[..., None] >> HOURS) & 1).astype(bool)
+
+def _dates(days):
+    #datetime.date of datetime64[D] values, as the driver returns DATE columns
+    return np.asarray(days, dtype='datetime64[D]').astype(object)
+
+
+class CoverageIndex:
+    """Days with records of each participant and stream as a bool array (participant, stream, day), and the hours with
+    records of these days as 24 bit masks in a uint32 array of the same shape. Loaded from DAILY_COVERAGE on the first
+    refresh, then updated with the days recounted since, and kept in a file of cache_dir (None to disable) between
+    sessions. Participants and streams unknown to the index have no records"""
+
+    def __init__(self, engine, cache_dir = None) -> None:
+        self.engine = engine
+        self.users, self.streams = [], []       #labels of the first two axes
+        self.user_pos, self.stream_pos = dict(), dict()
+        self.origin = None                      #date of day 0 of the third axis
+        self.days = np.zeros((0, 0, 0), dtype=bool)
+        self.hours = np.zeros((0, 0, 0), dtype=np.uint32)
+        self.n_rows = 0                         #rows of DAILY_COVERAGE and latest UPDATED_AT when last refreshed
+        self.updated_at = None
+        self.loaded = False
+        self.lock = threading.RLock()
+        self.cache_path = None
+        if cache_dir is not None:
+            key = hashlib.sha1(engine.url.render_as_string(hide_password=True).encode('utf-8')).hexdigest()
+            self.cache_path = os.path.join(cache_dir, f"coverage-{key}.npz")
+
+    def refresh(self):
+        """Bring the index up to date with DAILY_COVERAGE. Nothing is read if its row count and latest recount are
+        unchanged, else the days recounted since the last refresh (OVERLAP earlier, for transactions committed late),
+        and the whole table if the days of the index then don't match its row count (e.g. after rebuild_coverage).
+        Returns the index"""
+        with self.lock:
+            if not self.loaded:
+                self._load()
+                self.loaded = True
+            with self.engine.connect() as connection:
+                n_rows, updated_at = connection.execute(text("SELECT COUNT(*), MAX(UPDATED_AT) FROM `DAILY_COVERAGE`")
+                                                        ).fetchone()
+                n_rows, updated_at = int(n_rows), None if updated_at is None else str(updated_at)
+                if n_rows == self.n_rows and updated_at == self.updated_at:
+                    return self
+                full = self.updated_at is None or n_rows < self.n_rows
+                if not full:
+                    since = f"{pd.Timestamp(self.updated_at) - OVERLAP:%Y-%m-%d %H:%M:%S}"
+                    self._set(connection.execute(text("""SELECT USER_ID, STREAM, DAY, HOURS FROM `DAILY_COVERAGE`
+                                                         WHERE UPDATED_AT >= :since"""), {'since': since}).fetchall())
+                    full = int(self.days.sum()) != n_rows
+                if full:
+                    self._clear()
+                    self._set(connection.execute(text("SELECT USER_ID, STREAM, DAY, HOURS FROM `DAILY_COVERAGE`")).fetchall())
+            logger.debug(f"Coverage index {'loaded' if full else 'updated'}: {len(self.users)} participants, "
+                         f"{len(self.streams)} streams, {self.days.shape[2]} days")
+            self.n_rows, self.updated_at = n_rows, updated_at
+            self._save()
+        return self
+
+    def _clear(self):
+        self.users, self.streams = [], []
+        self.user_pos, self.stream_pos = dict(), dict()
+        self.origin = None
+        self.days = np.zeros((0, 0, 0), dtype=bool)
+        self.hours = np.zeros((0, 0, 0), dtype=np.uint32)
+
+    def _set(self, rows):
+        #set the days of rows (USER_ID, STREAM, DAY, HOURS), growing the arrays for new participants, streams and days
+        if not rows:
+            return
+        df = pd.DataFrame(rows, columns=['user', 'stream', 'day', 'hours'])
+        for labels, pos, values in [(self.users, self.user_pos, df['user']), (self.streams, self.stream_pos, df['stream'])]:
+            for value in values.unique():
+                if value not in pos:
+                    pos[value] = len(labels)
+                    labels.append(value)
+        day = pd.to_datetime(df['day']).to_numpy().astype('datetime64[D]')
+        self._grow(day.min(), day.max())
+        u = df['user'].map(self.user_pos).to_numpy()
+        s = df['stream'].map(self.stream_pos).to_numpy()
+        d = (day - self.origin).astype(np.int64)
+        self.days[u, s, d] = True
+        self.hours[u, s, d] = df['hours'].fillna(0).to_numpy(dtype=np.uint32)
+
+    def _grow(self, first, last):
+        #reallocate the arrays for the participants and streams labelled, and the days from first to last
+        n_users, n_streams, n_days = self.days.shape
+        origin = first if self.origin is None else min(self.origin, first)
+        end = last if self.origin is None else max(self.origin + n_days - 1, last)
+        shape = (len(self.users), len(self.streams), int((end - origin).astype(np.int64)) + 1)
+        if shape == self.days.shape and origin == self.origin:
+            return
+        offset = 0 if self.origin is None else int((self.origin - origin).astype(np.int64))
+        days, hours = np.zeros(shape, dtype=bool), np.zeros(shape, dtype=np.uint32)
+        days[:n_users, :n_streams, offset:offset + n_days] = self.days
+        hours[:n_users, :n_streams, offset:offset + n_days] = self.hours
+        self.origin, self.days, self.hours = origin, days, hours
+
+    def _union(self, streams):
+        #(participant, day) bool array of the days with records of any of streams
+        idx = [self.stream_pos[s] for s in streams if s in self.stream_pos]
+        return self.days[:, idx, :].any(axis=1)
+
+    def windows(self, stream):
+        """(user, first day, last day) of the continuous runs of days with records of stream, ordered by participant and
+        day, as get_sensing_timespan(exact=True)"""
+        with self.lock:
+            covered = self._union([stream])
+            edges = np.diff(np.pad(covered, ((0, 0), (1, 1))).astype(np.int8), axis=1)
+            u, first = np.nonzero(edges == 1)
+            last = np.nonzero(edges == -1)[1] - 1 #runs of a participant start and end in the same order
+            if len(u) == 0:
+                return []
+            users = [self.users[i] for i in u]
+            first, last = _dates(self.origin + first), _dates(self.origin + last)
+        return sorted(zip(users, first, last))
+
+    def count_days(self, streams):
+        """(user, days) number of days with records of any of streams, for the participants with some, as
+        get_count_ps_days"""
+        with self.lock:
+            counts = self._union(streams).sum(axis=1)
+            return sorted((user, int(n)) for user, n in zip(self.users, counts) if n)
+
+    def missing_days(self, starts, streams, length = 28):
+        """(user, date, position) of the days without records of any of streams in the windows of length days of
+        starts, (user, start date) pairs, position 1 being the start date, ordered by participant and date, as
+        get_no_ps_dates. A window without start date gives (user, None, 1)"""
+        starts = list(starts)
+        dated = [(user, start) for user, start in starts if start is not None]
+        ret = [(user, None, 1) for user, start in starts if start is None]
+        if dated:
+            with self.lock:
+                covered = self._union(streams)
+                origin = self.origin if self.origin is not None else np.datetime64(0, 'D')
+                first = np.array([np.datetime64(pd.Timestamp(start).date(), 'D') for user, start in dated])
+                u = np.array([self.user_pos.get(user, -1) for user, start in dated])
+                d = (first - origin).astype(np.int64)[:, None] + np.arange(length)
+                u = np.broadcast_to(u[:, None], d.shape)
+                inside = (u >= 0) & (d >= 0) & (d < covered.shape[1])
+                hit = np.zeros(d.shape, dtype=bool)
+                hit[inside] = covered[u[inside], d[inside]]
+            w, pos = np.nonzero(~hit)
+            ret += zip([dated[i][0] for i in w], _dates(first[w] + pos), (pos + 1).tolist())
+        return sorted(ret, key=lambda r: (r[0], r[1] is not None, r[1] or 0))
+
+    def hours_covered(self, user, streams, start, end):
+        """Dates from start to end (included) and a (day, 24) bool array of the hours of these days with records
+        of any of streams of user"""
+        dates = np.arange(np.datetime64(start, 'D'), np.datetime64(end, 'D') + 1)
+        masks = np.zeros(len(dates), dtype=np.uint32)
+        with self.lock:
+            idx = [self.stream_pos[s] for s in streams if s in self.stream_pos]
+            if user in self.user_pos and idx:
+                d = (dates - self.origin).astype(np.int64)
+                inside = (d >= 0) & (d < self.days.shape[2])
+                masks[inside] = np.bitwise_or.reduce(self.hours[self.user_pos[user]][np.ix_(idx, d[inside])], axis=0)
+        return _dates(dates), hour_bits(masks)
+
+    def _load(self):
+        #arrays of the cache file, if any
+        if self.cache_path is None:
+            return
+        try:
+            with np.load(self.cache_path, allow_pickle=False) as f:
+                users, streams = f['users'].tolist(), f['streams'].tolist()
+                origin, days, hours = f['origin'][0], f['days'], f['hours']
+                n_rows, updated_at = int(f['n_rows']), str(f['updated_at'])
+        except (OSError, ValueError, KeyError, IndexError, zipfile.BadZipFile):
+            return
+        self.users, self.streams = users, streams
+        self.user_pos = {user: i for i, user in enumerate(users)}
+        self.stream_pos = {stream: i for i, stream in enumerate(streams)}
+        self.origin = origin if len(users) else None
+        self.days, self.hours = days, hours
+        self.n_rows, self.updated_at = n_rows, updated_at or None
+
+    def _save(self):
+        #arrays to the cache file, written to a temporary file and renamed
+        if self.cache_path is None:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+            with open(self.cache_path + '.tmp', 'wb') as f:
+                np.savez_compressed(f, users=np.array(self.users, dtype=str), streams=np.array(self.streams, dtype=str),
+                                    origin=np.array([self.origin if self.origin is not None else 0], dtype='datetime64[D]'),
+                                    days=self.days, hours=self.hours, n_rows=self.n_rows, updated_at=self.updated_at or '')
+            os.replace(self.cache_path + '.tmp', self.cache_path)
+        except OSError as e:
+            logger.warning(f"Coverage index not written to {self.cache_path}: {e}")
@@ -0,0 +1,135 @@
+#streaming reader of the EMA and MobileCoach csv exports with declared column types
+import logging
+import os
+import pandas as pd
+
+try: #optional, faster csv reader
+    import pyarrow as pa
+    import pyarrow.csv as pacsv
+except ImportError:
+    pacsv = None
+
+logger = logging.getLogger('make_db')
+
+STRING = 'string'
+INT = 'Int64'           #nullable integer
+FLOAT = 'float64'
+BOOL = 'boolean'
+DATETIME = 'datetime'
+INFER = 'infer'         #type inferred once from the first rows of the files of the table, then fixed
+
+#declared column types per table, with the type of the columns that are not declared under the key None.
+#MobileCoach exports are text, their values are strings whatever they look like.
+#Limesurvey exports have a few standard columns and one column per question, inferred
+SCHEMAS = {
+    'EMA': {
+        'id': INT,
+        'submitdate': DATETIME,
+        'lastpage': INT,
+        'startlanguage': STRING,
+        'seed': STRING,
+        'startdate': DATETIME,
+        'datestamp': DATETIME,
+        'participantCode': STRING,
+        None: INFER,
+    },
+    'Participant': {'_id': STRING, 'nickname': STRING, None: STRING},
+    'ParticipantVariableWithValue': {'participant': STRING, 'name': STRING, 'value': STRING,
+                                     'formerVariableValues': STRING, None: STRING},
+    'DialogMessage': {None: STRING},
+    'DialogOption': {None: STRING},
+    'Intervention': {None: STRING},
+    'InterventionVariableWithValue': {None: STRING},
+}
+DEFAULT_SCHEMA = {None: STRING}
+CSV_EXPANSION = 5       #parsed dataframes take roughly this many times the bytes of the csv text
+MIN_CHUNK_ROWS = 1000
+SAMPLE_ROWS = 10000
+
+def read_header(path):
+    return list(pd.read_csv(path, nrows=0).columns)
+
+def infer_types(paths, columns):
+    """Stable type of each of columns, from the first SAMPLE_ROWS rows of each file. Numbers are read as floats,
+    so that missing values and decimals in later rows do not change the type"""
+    sample = pd.concat([pd.read_csv(p, nrows=SAMPLE_ROWS) for p in paths], ignore_index=True)
+    ret = dict()
+    for col in columns:
+        if col not in sample.columns or sample[col].isna().all():
+            ret[col] = STRING
+        elif pd.api.types.is_bool_dtype(sample[col]):
+            ret[col] = BOOL
+        elif pd.api.types.is_numeric_dtype(sample[col]):
+            ret[col] = FLOAT
+        else:
+            ret[col] = STRING
+    return ret
+
+def resolve_schema(table, paths, columns):
+    """Type of each of columns of table, read from paths"""
+    schema = SCHEMAS.get(table, DEFAULT_SCHEMA)
+    ret = {c: schema.get(c, schema[None]) for c in columns}
+    to_infer = [c for c, t in ret.items() if t == INFER]
+    if to_infer:
+        ret.update(infer_types(paths, to_infer))
+    return ret
+
+def cast_column(col, dtype):
+    #convert a column of strings; values that can't be converted are set to null and counted
+    if dtype == STRING:
+        return col.astype(STRING), 0
+    if dtype == DATETIME:
+        ret = pd.to_datetime(col, errors='coerce').astype('datetime64[us]') #the resolution inferred depends on the values
+    elif dtype == BOOL:
+        ret = col.str.lower().map({'true': True, 'false': False, '1': True, '0': False}).astype(BOOL)
+    else:
+        ret = pd.to_numeric(col, errors='coerce')
+        if dtype == INT:
+            whole = ret.isna() | (ret == ret.round())
+            ret = ret.where(whole).astype(INT)
+        else:
+            ret = ret.astype(FLOAT)
+    return ret, int((ret.isna() & col.notna()).sum())
+
+def apply_schema(df, schema, path):
+    """Return df (all strings) with the columns of schema, in its order, converted to their type"""
+    df = df.reindex(columns=list(schema))
+    for col, dtype in schema.items():
+        df[col], n_bad = cast_column(df[col], dtype)
+        if n_bad:
+            logger.warning(f"{n_bad} values of column {col} in {path} are not of type {dtype}, set to null")
+    return df
+
+def chunk_rows(path, budget):
+    """Number of rows of path that fit in budget bytes once parsed"""
+    with open(path, 'rb') as f:
+        head = f.read(2**20)
+    n_lines = max(1, head.count(b'\n'))
+    return max(MIN_CHUNK_ROWS, budget // (CSV_EXPANSION * max(1, len(head) // n_lines)))
+
+def _read_strings(path, columns, budget):
+    #yield dataframes of strings of the rows of path, each fitting in budget
+    if pacsv is not None:
+        reader = pacsv.open_csv(path,
+                                read_options=pacsv.ReadOptions(column_names=columns, skip_rows=1,
+                                                               block_size=int(max(2**20, min(budget // CSV_EXPANSION, 2**30)))),
+                                parse_options=pacsv.ParseOptions(newlines_in_values=True),
+                                convert_options=pacsv.ConvertOptions(column_types={c: pa.string() for c in columns},
+                                                                     strings_can_be_null=True))
+        for batch in reader:
+            yield batch.to_pandas()
+    else:
+        with pd.read_csv(path, dtype=str, names=columns, header=0, chunksize=chunk_rows(path, budget)) as reader:
+            for chunk in reader:
+                yield chunk
+
+def read_csv_chunks(table, paths, budget):
+    """Yield the rows of the csv files paths of table as dataframes with the same columns and types in every chunk:
+    the union of the columns of the files, typed as in SCHEMAS. Each chunk fits in budget bytes"""
+    paths = [p for p in paths if os.path.getsize(p)]
+    headers = [read_header(p) for p in paths]
+    columns = list(dict.fromkeys(c for header in headers for c in header)) #union, in order of appearance
+    schema = resolve_schema(table, paths, columns)
+    for path, header in zip(paths, headers):
+        for chunk in _read_strings(path, header, budget):
+            yield apply_schema(chunk, schema, path)
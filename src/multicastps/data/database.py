@@ -1,10 +1,26 @@
 import os
 import logging
+import time
+import datetime as dt
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 from dotenv import load_dotenv
-from multicastps.data.queries_mc import TABLES
+from multicastps.data.queries_mc import (TABLES, NATURAL_KEYS, INDEXES, TIME_COLUMNS, DAY_TABLES, PARTITIONED_TABLES,
+                                        PS_DAY_STREAMS, OVERVIEW_TABLES, FILTER_COLUMNS)
+from multicastps.data.partitions import (FUTURE, MONTHS_AHEAD, DEFAULT_HISTORY, month_start, add_months, months_between,
+                                        partition_month, partition_defs, partition_clause)
+from multicastps.data.bulk_load import (METHODS, ON_DUPLICATE, LoadStats, insert_executemany, insert_load_data, insert_statement, 
+                                       insert_deduplicated, to_wallclock)
+from multicastps.data.export import FORMATS, DEFAULT_CHUNK_ROWS, write_chunks, apply_types
+from multicastps.data.cache import QueryCache, DEFAULT_BYTES as CACHE_BYTES, cache_key, is_read_only, tables_of
+from multicastps.data.backends import (BACKENDS, EMBEDDED, default_path, embedded_url, install, file_watermark, 
+                                      index_statements)
+from multicastps.data.schema import SchemaManager, natural_key_current, rebuild_natural_key
+from multicastps.data.coverage import CoverageIndex, DEFAULT_CACHE_DIR as COVERAGE_CACHE_DIR
+from multicastps.data.connections import (DEFAULT_MAX_OVERFLOW, DEFAULT_TIMEOUT, DEFAULT_RECYCLE, DEFAULT_RETRIES, 
+                                          TimedQueuePool, PoolStats, with_retries)
 from multicastps.utils.logging_setup import setup_logging
-from sqlalchemy import create_engine, text, inspect, MetaData, Table
+from sqlalchemy import create_engine, text, inspect, bindparam
 from sqlalchemy.engine import URL
 from sqlalchemy.exc import IntegrityError, DataError
 
@@ -17,58 +33,416 @@ else:
 
 
 class MulticastDB:
-    def __init__(self) -> None:
-        try: 
+    def __init__(self, insert_method = 'executemany', batch_size = 10000, on_duplicate = 'ignore', coverage = True, 
+                 query_workers = 4, cache = False, cache_dir = None, cache_mb = CACHE_BYTES // 2**20, 
+                 backend = None, path = None, coverage_cache = COVERAGE_CACHE_DIR, 
+                 pool_size = None, max_overflow = DEFAULT_MAX_OVERFLOW, pool_timeout = DEFAULT_TIMEOUT, 
+                 pool_recycle = DEFAULT_RECYCLE, retries = DEFAULT_RETRIES) -> None:
+        """
+        :insert_method: strategy used by insert_pd, one of 'executemany' (multi-row INSERT batches),
+                        'load_data' (LOAD DATA LOCAL INFILE from a temporary file, requires local_infile on the server) 
+                        or 'to_sql' (pandas default, row by row)
+        :batch_size: number of rows per INSERT statement with 'executemany'
+        :on_duplicate: rows whose natural key (see queries_mc.NATURAL_KEYS) is already in the table are skipped ('ignore'),
+                       overwrite the existing row ('update') or make the insert fail ('error')
+        :coverage: keep the DAILY_COVERAGE summary up to date when inserting into sensor tables, see update_coverage
+        :query_workers: number of queries make_participant_report runs at the same time, the connection pool keeps 
+                        as many connections open
+        :cache: cache the results of query() until the tables they read change, see QueryCache. Results are kept in 
+                memory up to cache_mb MB, and also in cache_dir if set, to be reused by later sessions (requires pyarrow)
+        :backend: 'mysql', the server of the DB_* environment variables, or an embedded database in the file path: 'sqlite',
+                  or 'duckdb' (columnar, faster for the coverage queries, requires duckdb_engine). Defaults to DB_BACKEND and 
+                  DB_PATH, or mysql. The MySQL statements of the class are translated to the embedded dialect, see backends.py.
+                  Embedded databases are not partitioned and can't be loaded with 'load_data'
+        :coverage_cache: directory of the coverage index, see coverage_index, None to load it from DAILY_COVERAGE 
+                         in every session
+        :pool_size: connections kept open, defaults to query_workers + 1 (at least 5). Up to max_overflow more are 
+                    opened when all are in use, a checkout waits at most pool_timeout seconds for one. Connections are 
+                    checked with a ping before use and replaced after pool_recycle seconds, see pool_stats
+        :retries: number of times query() and insert_pd (in its own transaction) are run again after a transient error,
+                  e.g. a lost connection or a deadlock, waiting longer before each retry, see connections.with_retries
+        Missing tables are created by the migrations of schema.py newer than the schema version of the database.
+        Tables of queries_mc.PARTITIONED_TABLES are created with one partition per month from DB_PARTITION_START ('YYYY-MM',
+        defaults to two years ago) to a few months ahead, see maintain_partitions
+        """
+        if insert_method not in METHODS:
+            raise ValueError(f"Unknown insert method '{insert_method}', choose one of {METHODS}")
+        if on_duplicate not in ON_DUPLICATE:
+            raise ValueError(f"Unknown on_duplicate '{on_duplicate}', choose one of {ON_DUPLICATE}")
+        backend = backend or os.environ.get('DB_BACKEND') or 'mysql'
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown backend '{backend}', choose one of {BACKENDS}")
+        if backend in EMBEDDED and insert_method == 'load_data':
+            raise ValueError(f"Insert method 'load_data' is only available with MySQL")
+        self.backend = backend
+        self.path = path or os.environ.get('DB_PATH') or default_path(backend) if backend in EMBEDDED else None
+        self.insert_method = insert_method
+        self.batch_size = batch_size
+        self.on_duplicate = on_duplicate
+        self.coverage = coverage
+        self.query_workers = query_workers
+        self.cache = QueryCache(cache_dir, cache_mb * 2**20) if cache else None
+        self.load_stats = LoadStats() #rows/sec per insert strategy and table
+        self.retries = retries
+        self.pool_stats = PoolStats() #checkouts, wait time and reconnects of the connection pool
+        start = os.environ.get('DB_PARTITION_START')
+        self.partition_start = (dt.date.fromisoformat(start + '-01') if start 
+                                else add_months(month_start(dt.date.today()), -DEFAULT_HISTORY))
+        pool_args = dict(poolclass = TimedQueuePool, pool_size = pool_size or max(5, query_workers + 1), 
+                         max_overflow = max_overflow, pool_timeout = pool_timeout, pool_recycle = pool_recycle, 
+                         pool_pre_ping = True)
+        if backend in EMBEDDED:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self.engine = create_engine(embedded_url(backend, self.path), **pool_args)
+            install(self.engine, backend)
+        else:
+            port = os.environ.get('DB_PORT')
             self.engine = create_engine(URL.create(
                             drivername = "mysql+mysqlconnector",
                             username=os.environ.get('DB_USER'),
                             password=os.environ.get('DB_PW'),  
                             host=os.environ.get('DB_HOST'),
+                            port=int(port) if port else None,
                             database=os.environ.get('DB_NAME'),
-                            ))
-            logger.info(f"Connection to DB established")
-        except:
+                            ),
+                            connect_args = {'allow_local_infile': True} if insert_method == 'load_data' else {},
+                            **pool_args)
+        self.pool_stats.track(self.engine)
+        try: #first connection, the server may be restarting
+            self.schema = self._with_retries(lambda: SchemaManager(self.engine, backend, self.partition_start),
+                                             'connection') #one inspection
+        except Exception:
             logger.exception(f"Connection to DB failed")
-    
-        def table_exists(engine, table_name):
-            inspector = inspect(engine)
-            return table_name in inspector.get_table_names()
-
-        with self.engine.connect() as connection:
-            for table_name, query in TABLES.items():
-                if not table_exists(self.engine, table_name):
-                    try:
-                        connection.execute(text(query))
-                    except Exception as e:
-                        logger.exception(f"Error creating table {table_name}: {e}")
+            raise
+        logger.info(f"Connection to DB established" + (f" ({backend}, {self.path})" if backend in EMBEDDED else ""))
+        created = [t for t in self.schema.migrate() if t in INDEXES]
+        if created:
+            self.create_indexes(created) #empty tables, instant
+        self.metadata = self.schema.metadata #reflected on first use of each table, see schema.table
+        #days and hours with records per participant and stream, read by the coverage methods with summary=True
+        self.coverage_index = CoverageIndex(self.engine, coverage_cache)
 
-        self.metadata = MetaData(bind = self.engine)
-        self.metadata.reflect() #self.metadata.tables , info on table/column structure, must be refreshed with reflect()
+    def _with_retries(self, fn, what):
+        return with_retries(fn, self.retries, stats = self.pool_stats, what = what)
 
     def get_table_names(self):
         inspector = inspect(self.engine)
         return inspector.get_table_names()
     
-    def query(self, query):
+    def query(self, query, params = None):
         """
-        Execute a SQL query 
+        Execute a SQL query, with optional :name parameters.
+        With the cache enabled, the result of a SELECT reading tables of the database is returned from the cache 
+        as long as those tables did not change, see watermarks. Hits and misses are counted in cache_stats()
         """
+        key, marks = None, None
+        if self.cache is not None and is_read_only(query) and 'information_schema' not in query.lower():
+            tables = tables_of(query, self.get_table_names())
+            if tables:
+                key, marks = cache_key(query, params), self.watermarks(tables)
+                rows = self.cache.get(key, marks)
+                if rows is not None:
+                    return rows
+        def run():
+            with self.engine.connect() as connection:
+                res = connection.execute(text(query), params or {})
+                return list(res.keys()), res.fetchall()
+        try:
+            columns, rows = self._with_retries(run, 'query')
+        except:
+            logger.exception(f"Error executing query")
+            return None
+        if key is not None:
+            self.cache.put(key, query, columns, rows, marks)
+        return rows
+
+    def watermarks(self, tables):
+        """Creation time, last modification time and approximate row count of tables, from information_schema.
+        A table changes watermark when rows are committed, or when it is rebuilt (e.g. PartOverview). The modification 
+        time has a precision of one second and is reset when the server restarts, which only invalidates the cache.
+        Embedded databases have no such statistics, all tables share the watermark of the database file"""
+        if self.backend in EMBEDDED:
+            marks = file_watermark(self.path)
+            return {t: marks for t in sorted(tables)}
         with self.engine.connect() as connection:
-            try:
-                res = connection.execute(text(query))
-                return res.fetchall()
-            except:
-                logger.exception(f"Error executing query")
+            try: #statistics of information_schema.tables are cached for a day by default since MySQL 8
+                connection.execute(text("SET SESSION information_schema_stats_expiry = 0"))
+            except Exception:
+                pass
+            rows = connection.execute(text("""SELECT table_name, create_time, update_time, table_rows 
+                                             FROM information_schema.tables 
+                                             WHERE table_schema = DATABASE() AND table_name IN :tables""")
+                                      .bindparams(bindparam('tables', expanding=True)), {'tables': list(tables)}).fetchall()
+        return {r[0]: [str(r[1]), str(r[2]), r[3]] for r in sorted(rows)}
+
+    def cache_stats(self):
+        """Hits, misses, entries and bytes in memory of the query cache, None if it is disabled"""
+        return self.cache.stats() if self.cache is not None else None
 
-    def insert_pd(self,df,table):
+    def transaction(self):
         """
-        Upload to database a pandas dataframe to specified table, appending to existing data
+        Context manager returning a connection whose statements are committed together on exit, or rolled back on error.
+        Pass it to insert_pd to make several inserts atomic
         """
-        df.to_sql(name = table,
-                con = self.engine,
-                if_exists = "append",
-                index = False
-                )
+        return self.engine.begin()
+
+    def insert_pd(self,df,table,connection=None):
+        """
+        Upload to database a pandas dataframe to specified table, appending to existing data.
+        The whole dataframe is inserted in one transaction using the strategy set in insert_method, 
+        or as part of the transaction of connection if provided (see transaction()).
+        Rows already in the table, by natural key, are handled as set in on_duplicate, so uploading the same data 
+        again does not duplicate it. Tables that do not exist yet are created by pandas from the dataframe dtypes. 
+        In its own transaction, the insert is run again after a transient error (see retries), in the transaction 
+        of connection it is up to the owner of the transaction.
+        """
+        if connection is None:
+            def run():
+                with self.transaction() as connection:
+                    return self.insert_pd(df, table, connection)
+            return self._with_retries(run, f"insert into {table}")
+        method = self.insert_method
+        known = table in self.schema.names #tables that can be bulk loaded without being created first
+        if not known and method != 'to_sql':
+            method = 'to_sql' #let pandas create the table
+        keys = NATURAL_KEYS.get(table, ())
+        #without a key there is no duplicate, and DuckDB refuses INSERT OR IGNORE
+        on_duplicate = self.on_duplicate if keys or self.backend == 'mysql' else 'error'
+        if self.backend == 'duckdb' and known and on_duplicate != 'error':
+            method = 'deduplicated' #INSERT OR IGNORE misses the conflicts on columns holding NULL, see insert_deduplicated
+        with self.load_stats.timed(method, table, len(df)):
+            if method == 'to_sql':
+                if known and on_duplicate != 'error':
+                    to_sql_method = self._to_sql_on_duplicate(keys)
+                else:
+                    to_sql_method = None if self.insert_method == 'to_sql' else 'multi'
+                df.to_sql(name = table,
+                        con = connection,
+                        if_exists = "append",
+                        index = False,
+                        chunksize = None if self.insert_method == 'to_sql' else self.batch_size,
+                        method = to_sql_method
+                        )
+                self.schema.created(table)
+            elif len(df) == 0:
+                return
+            elif method == 'deduplicated':
+                insert_deduplicated(connection, df, table, on_duplicate, keys)
+            elif method == 'executemany':
+                insert_executemany(connection, df, table, self.batch_size, on_duplicate, keys)
+            else:
+                insert_load_data(connection, df, table, self.on_duplicate)
+        if self.coverage:
+            self.update_coverage(connection, table, df)
+
+    def _day(self, table):
+        #date of the time column of table for the per-day queries: its DAY column, or DATE(<time>) on the MySQL tables 
+        #created before DAY was declared, until add_day_columns adds it
+        if self.backend in EMBEDDED or table not in self.schema.names or 'DAY' in self.schema.table(table).c:
+            return '`DAY`'
+        return f"DATE(`{TIME_COLUMNS[table]}`)"
+
+    def update_coverage(self, connection, table, df):
+        """Recount in DAILY_COVERAGE the rows of table on the days of each participant in df, as part of the transaction 
+        of connection. Days are counted from the table rather than from df, so that rows skipped as duplicates are not 
+        counted twice. The natural_key (USER_ID, time) serves the recount, also while the user_day index is dropped"""
+        if table not in DAY_TABLES or len(df) == 0:
+            return
+        cols = {str(c).upper(): c for c in df.columns}
+        user_col, time_col = cols.get('USER_ID'), cols.get(TIME_COLUMNS[table])
+        if user_col is None or time_col is None:
+            return
+        times = to_wallclock(df[[user_col, time_col]])
+        times[time_col] = pd.to_datetime(times[time_col])
+        bounds = times.groupby(user_col)[time_col].agg(['min', 'max']).dropna()
+        rows = [(user, f"{lo.normalize():%Y-%m-%d %H:%M:%S}", f"{hi.normalize() + pd.Timedelta(days=1):%Y-%m-%d %H:%M:%S}")
+                for user, (lo, hi) in bounds.iterrows()]
+        if rows:
+            timecol, day = TIME_COLUMNS[table], self._day(table)
+            connection.exec_driver_sql(f"""REPLACE INTO `DAILY_COVERAGE` (USER_ID, STREAM, DAY, N_ROWS, FIRST_TS, LAST_TS, HOURS, UPDATED_AT)
+                                         SELECT USER_ID, '{table}', {day}, COUNT(*), MIN(`{timecol}`), MAX(`{timecol}`),
+                                                BIT_OR(1 << HOUR(`{timecol}`)), CURRENT_TIMESTAMP FROM `{table}`
+                                         WHERE USER_ID = %s AND `{timecol}` >= %s AND `{timecol}` < %s
+                                         GROUP BY USER_ID, {day}""", rows)
+
+    def rebuild_coverage(self, tables = None):
+        """Recount DAILY_COVERAGE from the whole sensor tables, e.g. for data inserted before the summary existed 
+        or deleted since. Scans each table once"""
+        existing = set(self.get_table_names())
+        for table in tables or DAY_TABLES:
+            if table not in existing:
+                continue
+            timecol, day = TIME_COLUMNS[table], self._day(table)
+            with self.engine.begin() as connection:
+                connection.execute(text(f"DELETE FROM `DAILY_COVERAGE` WHERE STREAM = '{table}'"))
+                n = connection.execute(text(f"""INSERT INTO `DAILY_COVERAGE` (USER_ID, STREAM, DAY, N_ROWS, FIRST_TS, LAST_TS, HOURS, UPDATED_AT)
+                                               SELECT USER_ID, '{table}', {day}, COUNT(*), MIN(`{timecol}`), MAX(`{timecol}`),
+                                                      BIT_OR(1 << HOUR(`{timecol}`)), CURRENT_TIMESTAMP
+                                               FROM `{table}` GROUP BY USER_ID, {day}""")).rowcount
+            logger.info(f"Coverage of table {table} recounted, {n} participant days")
+
+    def _to_sql_on_duplicate(self, keys):
+        #insert method for DataFrame.to_sql skipping or overwriting rows with an existing natural key
+        def insert(pd_table, conn, columns, data_iter):
+            stmt = insert_statement(pd_table.name, columns, on_duplicate=self.on_duplicate, keys=keys)
+            conn.exec_driver_sql(stmt, list(data_iter))
+        return insert
+
+    def add_natural_keys(self, tables = None):
+        """Give the sensor tables created before their natural_key was declared as in queries_mc.NATURAL_KEYS the 
+        natural_key unique index, removing duplicated rows, see schema.rebuild_natural_key. This needs disk space and 
+        time proportional to the table size. Tables that already have the index are left untouched"""
+        existing = set(self.get_table_names())
+        for table in tables or NATURAL_KEYS.keys():
+            if table not in existing:
+                continue
+            with self.engine.connect() as connection:
+                if natural_key_current(self.backend, connection, table):
+                    continue
+            logger.info(f"Adding natural key to table {table}")
+            with self.engine.begin() as connection:
+                n = rebuild_natural_key(self.backend, connection, table)
+            self.schema.changed(table)
+            logger.info(f"Table {table} deduplicated, {n} rows kept")
+
+    def _column_names(self, table):
+        #columns of table in order
+        if self.backend in EMBEDDED:
+            return [c for c, t in self._column_types(table)]
+        return [r[0] for r in self.query(f"""SELECT column_name FROM information_schema.columns 
+                                           WHERE table_schema = DATABASE() AND table_name = '{table}' 
+                                           ORDER BY ordinal_position""")]
+
+    def _index_names(self, table):
+        return {r[0] for r in self.query(f"""SELECT DISTINCT index_name FROM information_schema.statistics 
+                                           WHERE table_schema = DATABASE() AND table_name = '{table}'""")}
+
+    def create_indexes(self, tables = None):
+        """Build the secondary indexes of the sensor tables (see queries_mc.INDEXES) that are missing, with one 
+        ALTER TABLE per table. Tables created before the `DAY` column was declared get it first.
+        Building an index on a loaded table is much faster than maintaining it row by row during a bulk import, 
+        see drop_indexes. Embedded databases name the indexes <table>_<name>, index names are global there"""
+        existing = set(self.get_table_names())
+        for table in tables or INDEXES.keys():
+            if table not in existing:
+                continue
+            if self.backend in EMBEDDED: #tables always have `DAY`
+                stmts = [f"CREATE INDEX IF NOT EXISTS `{table}_{name}` ON `{table}` (" + ', '.join(f"`{c}`" for c in cols) + ")"
+                         for name, cols in INDEXES[table].items()]
+            else:
+                clauses = []
+                if table in DAY_TABLES and 'DAY' not in self._column_names(table):
+                    clauses.append(f"ADD COLUMN `DAY` DATE AS (DATE(`{TIME_COLUMNS[table]}`)) STORED")
+                present = self._index_names(table)
+                for name, cols in INDEXES[table].items():
+                    if name not in present:
+                        clauses.append(f"ADD INDEX `{name}` (" + ', '.join(f"`{c}`" for c in cols) + ")")
+                if not clauses:
+                    continue
+                stmts = [f"ALTER TABLE `{table}` " + ', '.join(clauses)]
+            start = time.perf_counter()
+            with self.engine.begin() as connection:
+                for stmt in stmts:
+                    connection.execute(text(stmt))
+            self.schema.changed(table)
+            logger.info(f"Indexes of table {table} built in {time.perf_counter() - start:.1f}s")
+
+    def add_day_columns(self, tables = None):
+        """Add the generated `DAY` column and its user_day index to the MySQL sensor tables created before they were 
+        declared, with create_indexes. Each ALTER TABLE rebuilds the table, which takes time proportional to its size, 
+        the per-day coverage queries group on DATE(<time>) until then. Embedded tables always have the column"""
+        if self.backend in EMBEDDED:
+            return
+        existing = set(self.get_table_names())
+        missing = [t for t in tables or DAY_TABLES if t in existing and 'DAY' not in self._column_names(t)]
+        for i, table in enumerate(missing):
+            logger.info(f"Adding the DAY column to table {table} ({i + 1}/{len(missing)}), this rebuilds the table")
+            self.create_indexes([table])
+
+    def drop_indexes(self, tables = None):
+        """Drop the secondary indexes of the sensor tables before a bulk import, rebuild them with create_indexes.
+        The natural_key is kept, inserts need it to skip duplicates"""
+        existing = set(self.get_table_names())
+        for table in tables or INDEXES.keys():
+            if table not in existing:
+                continue
+            if self.backend in EMBEDDED:
+                with self.engine.begin() as connection:
+                    for name in INDEXES[table]:
+                        connection.execute(text(f"DROP INDEX IF EXISTS `{table}_{name}`"))
+                self.schema.changed(table)
+                continue
+            present = self._index_names(table)
+            drop = [f"DROP INDEX `{name}`" for name in INDEXES[table] if name in present]
+            if drop:
+                with self.engine.begin() as connection:
+                    connection.execute(text(f"ALTER TABLE `{table}` " + ', '.join(drop)))
+                self.schema.changed(table)
+
+    def _partitions(self, table):
+        #names of the partitions of table in order, empty if the table is not partitioned
+        if self.backend in EMBEDDED:
+            return []
+        return [r[0] for r in self.query(f"""SELECT partition_name FROM information_schema.partitions 
+                                           WHERE table_schema = DATABASE() AND table_name = '{table}' AND partition_name IS NOT NULL
+                                           ORDER BY partition_ordinal_position""")]
+
+    def partition_tables(self, tables = None):
+        """Partition by month the tables of queries_mc.PARTITIONED_TABLES created before they were partitioned.
+        The table is rebuilt, which needs time and disk space proportional to its size. Embedded databases are not partitioned"""
+        if self.backend in EMBEDDED:
+            return
+        existing = set(self.get_table_names())
+        for table in tables or PARTITIONED_TABLES:
+            if table not in existing or self._partitions(table):
+                continue
+            logger.info(f"Partitioning table {table} by month")
+            with self.engine.begin() as connection:
+                connection.execute(text(f"ALTER TABLE `{table}` " + partition_clause(TIME_COLUMNS[table], self.partition_start, 
+                                                            add_months(month_start(dt.date.today()), MONTHS_AHEAD))))
+            self.schema.changed(table)
+
+    def maintain_partitions(self, months_ahead = MONTHS_AHEAD, retention_months = None, archive_dir = None):
+        """Add the partitions of the next months_ahead months to the partitioned tables, by splitting p_future.
+        If retention_months is set, the partitions of months older than that (and p_before) are dropped, after writing 
+        their rows to parquet files in archive_dir/<table>/ if archive_dir is set"""
+        current = month_start(dt.date.today())
+        for table in PARTITIONED_TABLES:
+            partitions = self._partitions(table)
+            if not partitions:
+                continue
+            months = [m for m in map(partition_month, partitions) if m is not None]
+            first = add_months(max(months), 1) if months else current
+            new = months_between(first, add_months(current, months_ahead))
+            if new and FUTURE in partitions:
+                with self.engine.begin() as connection:
+                    connection.execute(text(f"ALTER TABLE `{table}` REORGANIZE PARTITION {FUTURE} INTO (" 
+                                            + ', '.join(partition_defs(new)) + ")"))
+                logger.info(f"Added {len(new)} partitions to table {table}")
+            if retention_months is None:
+                continue
+            cutoff = add_months(current, -retention_months)
+            for partition in partitions:
+                month = partition_month(partition)
+                if partition == FUTURE or (month is not None and month >= cutoff):
+                    continue
+                if archive_dir is not None:
+                    self.archive_partition(table, partition, archive_dir)
+                with self.engine.begin() as connection:
+                    connection.execute(text(f"ALTER TABLE `{table}` DROP PARTITION {partition}"))
+                logger.info(f"Dropped partition {partition} of table {table}")
+
+    def archive_partition(self, table, partition, archive_dir, chunksize = 500000):
+        """Write the rows of a partition to archive_dir/<table>/<partition>-<part>.parquet"""
+        os.makedirs(os.path.join(archive_dir, table), exist_ok=True)
+        n = 0
+        with self.engine.connect() as connection:
+            connection = connection.execution_options(stream_results=True)
+            chunks = pd.read_sql_query(text(f"SELECT * FROM `{table}` PARTITION ({partition})"), connection, chunksize=chunksize)
+            for i, df in enumerate(chunks):
+                df.to_parquet(os.path.join(archive_dir, table, f"{partition}-{i:05d}.parquet"), index=False)
+                n += len(df)
+        logger.info(f"Archived {n} rows of partition {partition} of table {table} in {archive_dir}")
 
     def drop_tables(self, table_name=None):
         """
@@ -77,43 +451,154 @@ class MulticastDB:
         """
         
         if table_name == 'all':
-            self.metadata.drop_all()
+            self.schema.reflect_all().drop_all(self.engine)
+            for name in list(self.schema.names):
+                self.schema.dropped(name)
             logger.info("All tables dropped successfully.")
         elif table_name:
-            if table_name in self.metadata.tables:
-                Table(table_name, self.metadata).drop(self.engine)
-            else:
-                raise ValueError(f"Table '{table_name}' does not exist in the database.")
+            self.schema.table(table_name).drop(self.engine) #raises if it does not exist
+            self.schema.dropped(table_name)
         else:
             raise ValueError("No table name provided. Specify 'all' to drop all tables or provide a table name.")
         
     def table_to_csv(self,table,**kwargs):
+        """Returns the whole table as a dataframe. See get_stream to read only some columns, participants or times, 
+        and export_table to write large tables to a file"""
         query = f"""SELECT * FROM {table};""" 
         return pd.read_sql_query(query, self.engine,**kwargs)
 
-    def get_sensing_timespan(self, table = None, exact = True):
+    def _column_types(self, table):
+        #(name, data type) of the columns of table, in order. Types are lower case without length, e.g. 'decimal'
+        if table not in self.get_table_names():
+            raise ValueError(f"Table '{table}' does not exist in the database.")
+        if self.backend == 'sqlite': #declared types
+            rows = self.query(f"SELECT name, type FROM pragma_table_xinfo('{table}') ORDER BY cid")
+        else:
+            rows = self.query(f"""SELECT column_name, data_type FROM information_schema.columns 
+                                WHERE table_schema = DATABASE() AND table_name = '{table}' 
+                                ORDER BY ordinal_position""")
+        return [(name, (data_type.split('(')[0].split() or ['text'])[0].lower()) for name, data_type in rows]
+
+    def _select(self, table, columns = None, user_ids = None, start = None, end = None):
+        """SELECT statement with bound parameters of the columns of table (all if None), restricted to the participants 
+        user_ids and to times in [start, end), see FILTER_COLUMNS. Returns the statement, its parameters and the 
+        (name, MySQL data type) of the selected columns"""
+        types = dict(self._column_types(table))
+        columns = list(columns) if columns is not None else list(types)
+        unknown = [c for c in columns if c not in types]
+        if unknown:
+            raise ValueError(f"Unknown columns {unknown} of table {table}")
+        user_col, time_col = FILTER_COLUMNS.get(table, (None, None))
+        where, params = [], dict()
+        if user_ids is not None:
+            if user_col not in types:
+                raise ValueError(f"Table {table} can't be filtered by participant")
+            where.append(f"`{user_col}` IN :user_ids")
+            params['user_ids'] = list(user_ids)
+        for name, value, op in [('start', start, '>='), ('end', end, '<')]:
+            if value is not None:
+                if time_col not in types:
+                    raise ValueError(f"Table {table} can't be filtered by time")
+                where.append(f"`{time_col}` {op} :{name}")
+                params[name] = pd.Timestamp(value).to_pydatetime()
+        qry = text(f"SELECT " + ', '.join(f"`{c}`" for c in columns) + f" FROM `{table}`" 
+                   + (" WHERE " + " AND ".join(where) if where else ''))
+        if user_ids is not None:
+            qry = qry.bindparams(bindparam('user_ids', expanding=True))
+        return qry, params, [(c, types[c]) for c in columns]
+
+    def iter_table(self, table, columns = None, user_ids = None, start = None, end = None, chunksize = DEFAULT_CHUNK_ROWS):
+        """Yield the rows of table as dataframes of at most chunksize rows, read with a server side cursor so that 
+        only one chunk is in memory. See _select for the filters"""
+        qry, params, column_types = self._select(table, columns, user_ids, start, end)
+        with self.engine.connect() as connection:
+            connection = connection.execution_options(stream_results=True)
+            for df in pd.read_sql_query(qry, connection, params=params, chunksize=chunksize):
+                yield df
+
+    def resolve_participants(self, ids, column = 'user_id'):
+        """Values of column of PartOverview ('user_id' or 'part_code') of the participants ids, which can be harmonized 
+        participant codes (MC_1001), participant codes (MC_1001_b) or user ids. ids not in PartOverview are kept as they are,
+        run update_overview first to resolve recently added participants"""
+        ids = [ids] if isinstance(ids, str) else list(ids)
+        if not ids or 'PartOverview' not in self.get_table_names():
+            return ids
+        qry = text(f"""SELECT DISTINCT {column}, part_code_harm, part_code, user_id FROM PartOverview
+                       WHERE part_code_harm IN :ids OR part_code IN :ids OR user_id IN :ids""").bindparams(bindparam('ids', expanding=True))
+        with self.engine.connect() as connection:
+            rows = connection.execute(qry, {'ids': ids}).fetchall()
+        found = {v for r in rows for v in r[1:]}
+        return sorted({r[0] for r in rows if r[0] is not None} | {i for i in ids if i not in found})
+
+    def get_stream(self, table, user_ids = None, start = None, end = None, columns = None, chunksize = None):
+        """Rows of table filtered in MySQL with a parameterized query: participants user_ids (user ids or participant codes, 
+        see resolve_participants), times in [start, end) of the time column of the table and columns (all if None).
+        Returns a dataframe with the pandas types of the MySQL columns, or if chunksize is set an iterator over dataframes 
+        of at most chunksize rows, read with a server side cursor
+        e.g. db.get_stream('LOCATION', ['MC_1001'], '2024-03-01', '2024-03-29', ['TIMESTAMP', 'LATITUDE', 'LONGITUDE'])"""
+        if user_ids is not None:
+            user_col = FILTER_COLUMNS.get(table, (None, None))[0]
+            user_ids = self.resolve_participants(user_ids, 'part_code' if user_col == 'participantCode' else 'user_id')
+        column_types = self._select(table, columns, user_ids, start, end)[2] #invalid filters raise here, not on iteration
+        chunks = (apply_types(df, column_types) 
+                  for df in self.iter_table(table, columns, user_ids, start, end, chunksize or DEFAULT_CHUNK_ROWS))
+        if chunksize:
+            return chunks
+        chunks = list(chunks)
+        if not chunks:
+            return apply_types(pd.DataFrame(columns=[c for c, t in column_types]), column_types)
+        return pd.concat(chunks, ignore_index=True)
+
+    def export_table(self, table, path, fmt = None, columns = None, user_ids = None, start = None, end = None,
+                     chunksize = DEFAULT_CHUNK_ROWS):
+        """Write the rows of table to a csv or parquet file (fmt, by default from the extension of path) chunk by chunk, 
+        with constant memory whatever the size of the table. See _select for the filters and export.write_chunks for 
+        compression. Returns the number of rows written"""
+        fmt = fmt or ('parquet' if path.endswith('.parquet') else 'csv')
+        column_types = self._select(table, columns, user_ids, start, end)[2]
+        start_time = time.perf_counter()
+        n = write_chunks(self.iter_table(table, columns, user_ids, start, end, chunksize), path, fmt, column_types)
+        logger.info(f"Exported {n} rows of table {table} to {path} in {time.perf_counter() - start_time:.1f}s")
+        return n
+
+    def export_tables(self, tables, out_dir, fmt = 'parquet', workers = None, **filters):
+        """Export each of tables to out_dir/<table>.parquet (or .csv.gz) with export_table, workers tables at a time
+        (query_workers by default). filters are passed to export_table. Returns a dictionary table -> rows written"""
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown export format '{fmt}', choose one of {FORMATS}")
+        ext = '.parquet' if fmt == 'parquet' else '.csv.gz'
+        with ThreadPoolExecutor(max_workers=workers or self.query_workers) as pool:
+            res = {table: pool.submit(self.export_table, table, os.path.join(out_dir, table + ext), fmt, **filters)
+                   for table in tables}
+        return {table: r.result() for table, r in res.items()}
+
+    def get_sensing_timespan(self, table = None, exact = True, summary = False):
         """Returns the start and end date of sensing for each participant in the database, across all tables present 
         If exact is set to true, return all daily time windows for which there is passive sensing data, otherwise only return 
         start and end dates.
+        If summary is set to true, read the DAILY_COVERAGE table instead of the sensor tables, see update_coverage,
+        and the daily time windows from the coverage index built from it, see coverage_index.
         Returns list of tuples 
         """
         all_tables = set(TABLES.keys())
         all_tables.discard('DEVICE_INFO')
         qry = str()
-        if table == 'STEPS_IOS' or table == 'STEPS':
-            timecol = 'START_TIME'
-        else:
-            timecol = 'TIMESTAMP'
+        timecol = TIME_COLUMNS.get(table, 'TIMESTAMP')
+        source = f"`DAILY_COVERAGE` WHERE STREAM = '{table}'" if summary else f"`{table}`"
+        first, last = ('FIRST_TS', 'LAST_TS') if summary else (timecol, timecol)
+        if table and exact and summary: #days of the coverage index
+            return self.coverage_index.refresh().windows(table)
         if table: 
             if exact == False:#get first and last timestamp for which data is available, disregarding gaps in between
-                qry = f"""SELECT USER_ID, min({timecol}) min, max({timecol}) max
-                        FROM `{table}` GROUP BY USER_ID """
-            else: #get days in between which sensing was continuous
+                qry = f"""SELECT USER_ID, min({first}) min, max({last}) max
+                        FROM {source} GROUP BY USER_ID """
+            else: #get days in between which sensing was continuous, DAY is DATE({timecol}), indexed with USER_ID
+                day = self._day(table)
                 qry = f"""WITH t AS (
                             WITH tt AS (
-                                SELECT USER_ID, DATE({timecol}) AS dd
-                                FROM {table}
-                                GROUP BY USER_ID, DATE({timecol})
+                                SELECT USER_ID, {day} AS dd
+                                FROM {source}
+                                GROUP BY USER_ID, {day}
                                 ORDER BY 1, 2
                             )
                             SELECT USER_ID, dd AS d, ROW_NUMBER() OVER (ORDER BY USER_ID, dd) AS i,
@@ -123,18 +608,17 @@ class MulticastDB:
                         )
                         SELECT USER_ID, MIN(d), MAX(d)
                         FROM t
-                        GROUP BY USER_ID, ii;
+                        GROUP BY USER_ID, ii
+                        ORDER BY 1, 2;
                         """
+        elif summary: #get first and last timestamp for which data is available, across all tables
+            qry = """SELECT USER_ID, min(FIRST_TS) min, max(LAST_TS) max FROM `DAILY_COVERAGE` GROUP BY USER_ID"""
         else: #get first and last timestamp for which data is available, across all tables  
             for i in all_tables:
-                if i == 'STEPS_IOS' or i == 'STEPS':
-                   qry += f"""SELECT USER_ID, min(START_TIME) min , max(START_TIME) max
-                            FROM `{i}` GROUP BY USER_ID UNION """ 
-                else:
-                    qry += f"""SELECT USER_ID, min(TIMESTAMP) min , max(TIMESTAMP) max
-                            FROM `{i}` GROUP BY USER_ID UNION """
+                qry += f"""SELECT USER_ID, min({TIME_COLUMNS[i]}) min , max({TIME_COLUMNS[i]}) max
+                        FROM `{i}` GROUP BY USER_ID UNION """
             qry = qry[:-6]
-            qry = """WITH t AS ( """ + qry + """ ) SELECT USER_ID, min, max from t GROUP BY USER_ID"""
+            qry = """WITH t AS ( """ + qry + """ ) SELECT USER_ID, MIN(min) min, MAX(max) max from t GROUP BY USER_ID"""
         
         return self.query(qry)
     
@@ -159,12 +643,33 @@ class MulticastDB:
                     )
                     SELECT participantCode, MIN(d), MAX(d)
                     FROM t
-                    GROUP BY participantCode, ii;
+                    GROUP BY participantCode, ii
+                    ORDER BY 1, 2;
                     """
         return self.query(qry)
+
+    def get_ema_counts(self):
+        """Returns (part_code_harm, ema_count) tuples, the number of EMA records of the participant codes of each 
+        harmonized code, counted once per row of the participant code in PartOverview"""
+        return self.query("""SELECT o.part_code_harm, COUNT(e.datestamp) AS ema_count
+                             FROM EMA e JOIN PartOverview o ON e.participantCode = o.part_code
+                             WHERE o.part_code_harm IS NOT NULL
+                             GROUP BY o.part_code_harm""")
     
-    def get_no_ps_dates(self):
-        ret = self.query("""WITH RECURSIVE date_series AS (
+    def get_no_ps_dates(self, summary = False):
+        """Days of the 28 day study window of each participant without any record of the streams in PS_DAY_STREAMS.
+        If summary is set to true, read the days of the coverage index instead of the sensor tables, see coverage_index"""
+        if summary:
+            starts = self.query("SELECT user_id, start_date FROM PartOverview")
+            return self.coverage_index.refresh().missing_days(starts, PS_DAY_STREAMS)
+        #literal bounds of the study windows, so that only the partitions of those months are read
+        bounds = self.query("""SELECT MIN(start_date), DATE_ADD(MAX(start_date), INTERVAL 28 DAY) FROM PartOverview""")
+        if bounds is None: #error logged by query
+            return None
+        lo, hi = bounds[0]
+        window = f"WHERE `TIMESTAMP` >= '{lo}' AND `TIMESTAMP` < '{hi}'" if lo is not None else ''
+        days = " UNION ".join(f"SELECT DISTINCT USER_ID, {self._day(s)} AS recorded_date FROM `{s}` {window}" for s in PS_DAY_STREAMS)
+        ret = self.query(f"""WITH RECURSIVE date_series AS (
                 -- Start the series with day_index = 1
                 SELECT 
                     s.USER_ID, 
@@ -185,19 +690,8 @@ class MulticastDB:
                 WHERE ds.missing_date < ds.max_date
             ),
             recorded_dates AS (
-                -- Get distinct existing dates from all event tables
-                SELECT DISTINCT USER_ID, DATE(TIMESTAMP) AS recorded_date
-                FROM (
-                    SELECT USER_ID, TIMESTAMP FROM LOCATION
-                    UNION ALL
-                    SELECT USER_ID, TIMESTAMP FROM ACTIVITY
-                    UNION ALL
-                    SELECT USER_ID, TIMESTAMP FROM WIFI_CONNECTED
-                    UNION ALL
-                    SELECT USER_ID, TIMESTAMP FROM BLUETOOTH
-                    UNION ALL
-                    SELECT USER_ID, TIMESTAMP FROM SCREEN
-                ) t
+                -- Get distinct existing dates from all event tables, read from the user_day indexes
+                {days}
             )
             -- Find missing dates and include their position (day_index)
             SELECT 
@@ -214,96 +708,141 @@ class MulticastDB:
                         """)
         return ret 
 
-    def get_count_ps_days(self): #NOTE: count all passive sensing days, also including days outside study participation
-        ret = self.query("""SELECT USER_ID, COUNT(DISTINCT DATE(TIMESTAMP)) AS recorded_days
+    def get_count_ps_days(self, summary = False): #NOTE: count all passive sensing days, also including days outside study participation
+        if summary: #days of the coverage index
+            return self.coverage_index.refresh().count_days(PS_DAY_STREAMS)
+        days = " UNION ".join(f"SELECT DISTINCT USER_ID, {self._day(s)} AS DAY FROM `{s}`" for s in PS_DAY_STREAMS)
+        ret = self.query(f"""SELECT USER_ID, COUNT(DAY) AS recorded_days
                         FROM (
-                            SELECT USER_ID, TIMESTAMP FROM LOCATION
-                            UNION ALL
-                            SELECT USER_ID, TIMESTAMP FROM ACTIVITY
-                            UNION ALL
-                            SELECT USER_ID, TIMESTAMP FROM WIFI_CONNECTED
-                            UNION ALL
-                            SELECT USER_ID, TIMESTAMP FROM BLUETOOTH
-                            UNION ALL
-                            SELECT USER_ID, TIMESTAMP FROM SCREEN
+                            {days}
                         ) t
                         GROUP BY USER_ID
                         ORDER BY USER_ID;
                         """)
         return ret 
 
-    def update_overview(self):
-        """make table with part_code, part_code_harmonized, user_id, is_participant
+    def update_overview(self, force = False):
+        """make table with part_code, part_code_harmonized, user_id, is_participant, start_date, end_date
         note that some device_ids that are present in the ps tables from a time before study start
-        might not be present here as the database was cleaned before study start"""
-        
-        if 'PartOverview' in self.get_table_names():
-            self.drop_tables('PartOverview')
+        might not be present here as the database was cleaned before study start.
+        The table is refreshed incrementally, see OVERVIEW_WATERMARKS: nothing is done if Participant and EMA did not 
+        change since the last refresh, participants are added and removed as in Participant, and study windows are 
+        recomputed only for participants with new EMA records unless earlier EMA records changed. force rebuilds the table"""
+        tables = set(self.get_table_names())
+        if 'PartOverview' in tables and (force or (self.backend == 'mysql' and 'overview_key' not in self._index_names('PartOverview'))):
+            with self.engine.begin() as connection: #also the table of earlier versions, without key
+                connection.execute(text("DROP TABLE PartOverview"))
+            self.schema.dropped('PartOverview')
+            tables.discard('PartOverview')
 
-        with self.engine.connect() as connection:
-            #create table
-            qry = """CREATE TABLE IF NOT EXISTS PartOverview (
-                        part_code VARCHAR(15),
-                        part_code_harm VARCHAR(10),
-                        user_id VARCHAR(40),
-                        is_participant BOOLEAN
-                    );"""
-            res = connection.execute(text(qry))
-            
-            #select values from Participant table to populate with part_code, part_code_harm, user_id, is_participant
-            #note: there might be duplicate values in Participant
-            qry = """INSERT INTO PartOverview (part_code, part_code_harm, user_id, is_participant) 
-                    SELECT DISTINCT
-                        nickname AS part_code,
-                        NULLIF(REGEXP_SUBSTR(nickname, '^(MC_|BMC_)[0-9]{4}'), '') AS part_code_harm,
-                        _id AS user_id,
-                        nickname REGEXP '^(MC_|BMC_)[0-9]{4}.*' AS is_participant
-                    FROM Participant;
-                    """
-            res = connection.execute(text(qry))
+        with self.engine.begin() as connection:
+            for name, query in OVERVIEW_TABLES.items(): #created by the migrations, PartOverview again after a rebuild
+                if name not in tables:
+                    connection.execute(text(query))
+                    if self.backend in EMBEDDED: #keys are declared separately
+                        for index in index_statements(query):
+                            connection.execute(text(index))
+                    self.schema.created(name)
+            marks = {r[0]: tuple(r[1:]) for r in connection.execute(text(
+                        "SELECT SOURCE, N_ROWS, CHECKSUM, MAX_TIME FROM OVERVIEW_WATERMARKS"))}
+            if 'PartOverview' not in tables: #new table, built from scratch
+                marks = dict()
+            participant = self._participant_watermark(connection) if 'Participant' in tables else None
+            ema, ema_before = (self._ema_watermark(connection, marks.get('EMA', (None, None, None))[2]) 
+                               if 'EMA' in tables else (None, None))
+            if participant == marks.get('Participant') and ema == marks.get('EMA'):
+                logger.debug("PartOverview is up to date")
+                return
+            if participant is not None and participant != marks.get('Participant'):
+                self._refresh_participants(connection)
+            if ema is not None:
+                old = marks.get('EMA')
+                appended = old is not None and ema_before == old[:2] #records up to the previous watermark unchanged
+                self._refresh_windows(connection, old[2] if appended else None)
+            for source, mark in [('Participant', participant), ('EMA', ema)]:
+                if mark is not None:
+                    connection.execute(text("""REPLACE INTO OVERVIEW_WATERMARKS (SOURCE, N_ROWS, CHECKSUM, MAX_TIME) 
+                                               VALUES (:source, :n, :checksum, :max_time)"""),
+                                       {'source': source, 'n': mark[0], 'checksum': mark[1], 'max_time': mark[2]})
+            #TODO support for harminizing participant codes with the wrong format eg 'MC_1⁰499' to MC_1049
 
-            #parse user_id names
-            qry = """UPDATE PartOverview
-                    SET user_id = REPLACE(REPLACE(user_id, 'ObjectId(', ''), ')', '');
-                    """
-            res = connection.execute(text(qry))
-
-            #include start dates sourced from ema table (second oldest day) end end 27 days after that.
-            #start date will differ from actual start date if participant skipped the first day of surveys 
-            qry = """
-                    ALTER TABLE PartOverview 
-                    ADD COLUMN start_date DATE, 
-                    ADD COLUMN end_date DATE;
-                    """
-            res = connection.execute(text(qry))
+    def _participant_watermark(self, connection):
+        #(rows, checksum, None) of the Participant table
+        n, checksum = connection.execute(text("""SELECT COUNT(*), COALESCE(BIT_XOR(CRC32(CONCAT_WS('|', _id, nickname))), 0) 
+                                                 FROM Participant""")).fetchone()
+        return int(n), int(checksum), None
 
-        with self.engine.connect() as connection:
-            #include start dates sourced from ema table (second oldest day)
-            qry = """ UPDATE PartOverview po
-                    LEFT JOIN (
-                        SELECT participantCode, MIN(datestamp) AS second_oldest_date
-                        FROM (
-                            SELECT participantCode, datestamp, 
-                                ROW_NUMBER() OVER (PARTITION BY participantCode ORDER BY datestamp) AS rn
-                            FROM EMA
-                        ) ranked
-                        WHERE rn = 2
-                        GROUP BY participantCode
-                    ) sod
-                    ON po.part_code = sod.participantCode
-                    SET po.start_date = sod.second_oldest_date, 
-                        po.end_date = DATE_ADD(sod.second_oldest_date, INTERVAL 27 DAY);
-                    """
-            res = connection.execute(text(qry))
-            
+    def _ema_watermark(self, connection, since):
+        #(rows, checksum, latest datestamp) of the EMA table, and (rows, checksum) of the records up to since
+        n, checksum, max_time, n_before, checksum_before = connection.execute(text("""
+                    SELECT COUNT(*), COALESCE(BIT_XOR(CRC32(CONCAT_WS('|', participantCode, datestamp))), 0), MAX(datestamp),
+                           SUM(CASE WHEN datestamp <= :since THEN 1 ELSE 0 END), 
+                           COALESCE(BIT_XOR(CASE WHEN datestamp <= :since THEN CRC32(CONCAT_WS('|', participantCode, datestamp)) END), 0)
+                    FROM EMA"""), {'since': since}).fetchone()
+        before = (int(n_before), int(checksum_before)) if since is not None and n_before is not None else None
+        return (int(n), int(checksum), max_time), before
 
+    def _refresh_participants(self, connection):
+        #add the new (user_id, part_code) pairs of Participant, remove those no longer in it
+        participants = """SELECT DISTINCT
+                            nickname AS part_code,
+                            NULLIF(REGEXP_SUBSTR(nickname, '^(MC_|BMC_)[0-9]{4}'), '') AS part_code_harm,
+                            REPLACE(REPLACE(_id, 'ObjectId(', ''), ')', '') AS user_id,
+                            REGEXP_LIKE(nickname, '^(MC_|BMC_)[0-9]{4}.*') AS is_participant
+                        FROM Participant"""
+        n_new = connection.execute(text(f"""INSERT INTO PartOverview (part_code, part_code_harm, user_id, is_participant) 
+                        SELECT p.part_code, p.part_code_harm, p.user_id, p.is_participant
+                        FROM ({participants}) p
+                        WHERE NOT EXISTS (SELECT 1 FROM PartOverview po 
+                                          WHERE po.user_id <=> p.user_id AND po.part_code <=> p.part_code)""")).rowcount
+        n_gone = connection.execute(text(f"""DELETE FROM PartOverview
+                        WHERE NOT EXISTS (SELECT 1 FROM ({participants}) p 
+                                          WHERE PartOverview.user_id <=> p.user_id AND PartOverview.part_code <=> p.part_code)""")).rowcount
+        logger.info(f"PartOverview: {n_new} participant codes added, {n_gone} removed")
 
-            #TODO support for harminizing participant codes with the wrong format eg 'MC_1⁰499' to MC_1049
-        self.metadata.reflect()
-         
+    def _refresh_windows(self, connection, since = None):
+        """include start dates sourced from ema table (second oldest day) end end 27 days after that.
+        start date will differ from actual start date if participant skipped the first day of surveys.
+        If since is set, only participants with EMA records after since or without start date are updated"""
+        params = dict()
+        ema_where, po_where = '', ''
+        if since is not None:
+            codes = [r[0] for r in connection.execute(text("""SELECT DISTINCT participantCode FROM EMA WHERE datestamp > :since
+                                                             UNION
+                                                             SELECT part_code FROM PartOverview WHERE start_date IS NULL"""),
+                                                        {'since': since}) if r[0] is not None]
+            if not codes:
+                return
+            params['codes'] = codes
+            ema_where, po_where = "WHERE participantCode IN :codes", "WHERE part_code IN :codes"
+        #correlated subquery rather than an UPDATE with JOIN, which only MySQL has
+        qry = text(f""" UPDATE PartOverview
+                SET start_date = (
+                    SELECT DATE(MIN(datestamp))
+                    FROM (
+                        SELECT participantCode, datestamp, 
+                            ROW_NUMBER() OVER (PARTITION BY participantCode ORDER BY datestamp) AS rn
+                        FROM EMA
+                        {ema_where}
+                    ) ranked
+                    WHERE rn = 2 AND ranked.participantCode = PartOverview.part_code
+                )
+                {po_where};
+                """)
+        if params:
+            qry = qry.bindparams(bindparam('codes', expanding=True))
+        connection.execute(qry, params)
+        qry = text(f"UPDATE PartOverview SET end_date = DATE_ADD(start_date, INTERVAL 27 DAY) {po_where}")
+        if params:
+            qry = qry.bindparams(bindparam('codes', expanding=True))
+        connection.execute(qry, params)
 
-    def make_participant_report(self): #only study participants         
+    def make_participant_report(self, summary = False, workers = None): #only study participants         
         """Returns a pandas table containing data coverage information for study participants only
+        If summary is set to true, passive sensing coverage is read from the DAILY_COVERAGE table, which takes seconds
+        instead of scanning the sensor tables. The queries of the report run concurrently in workers threads 
+        (query_workers by default), so the report takes about as long as its slowest query. They aggregate on the 
+        server, only rows per participant (and per continuous window of each stream) are transferred
         """
         #TODO dates_no_ps, and consequently days_no_ps, days_ps, tot_days_ps are not computed for some participants.
         #TODO compute  hr_no_ps, hr_no_ps_pct, missing_gps_pings   #between 8 and 18 
@@ -312,8 +851,21 @@ class MulticastDB:
         ow = self.table_to_csv('PartOverview')
         ow = ow.drop_duplicates() #for safety 
         
+        #the remaining queries only depend on PartOverview, each runs on its own connection of the pool
+        all_tables = set(TABLES.keys())
+        all_tables.discard('DEVICE_INFO')
+        with ThreadPoolExecutor(max_workers=workers or self.query_workers) as pool:
+            psws_res = {table: pool.submit(self.get_sensing_timespan, table=table, exact=True, summary=summary) 
+                        for table in all_tables} #scans of the sensor tables first, they take longest
+            ps_win_res = pool.submit(self.get_sensing_timespan, exact=False, summary=summary)
+            no_ps_res = pool.submit(self.get_no_ps_dates, summary=summary)
+            days_ps_res = pool.submit(self.get_count_ps_days, summary=summary)
+            ema_win_res = pool.submit(self.get_ema_timespan, exact=False)
+            emaws_res = pool.submit(self.get_ema_timespan, exact=True)
+            emas_res = pool.submit(self.get_ema_counts)
+
         #oldest and latest ps rec
-        ps_win = pd.DataFrame(self.get_sensing_timespan(exact=False))
+        ps_win = pd.DataFrame(ps_win_res.result())
         ps_win.columns = ['USER_ID', 'oldest_ps_rec', 'latest_ps_rec']
         ps_win = ps_win.merge(ow[['user_id','part_code','part_code_harm']], left_on='USER_ID', right_on='user_id', how='left')
         ps_win = ps_win.groupby('part_code_harm', as_index=False).agg(
@@ -322,7 +874,7 @@ class MulticastDB:
                             )
         
         #oldest and latest ema rec
-        ema_win = pd.DataFrame(self.get_ema_timespan(exact=False))
+        ema_win = pd.DataFrame(ema_win_res.result())
         ema_win.columns = ['participantCode', 'oldest_ema_rec', 'latest_ema_rec']
         ema_win = ema_win.merge(ow[['user_id','part_code','part_code_harm']], left_on='participantCode', right_on='part_code', how='left')
         ema_win = ema_win.groupby('part_code_harm', as_index=False).agg(
@@ -330,41 +882,29 @@ class MulticastDB:
                     latest_ema_rec=('latest_ema_rec', 'max')
                     )
         
-        #get all daily sensing windows 
-        tot_psws = pd.DataFrame()
-        all_tables = set(TABLES.keys())
-        all_tables.discard('DEVICE_INFO')
+        #get all daily sensing windows, EMA windows first
+        windows = [pd.DataFrame(emaws_res.result(), columns=['participantCode', 'min', 'max']) #names differ per backend
+                   .merge(ow[['part_code', 'part_code_harm']], left_on='participantCode', right_on='part_code').assign(table='EMA')]
         for table in all_tables:
-            psws = pd.DataFrame(self.get_sensing_timespan(table = table, exact=True))
-            psws['table'] = table
-            tot_psws = pd.concat([psws, tot_psws])
-        tot_psws = tot_psws.merge(ow, left_on='USER_ID', right_on='user_id', how='left')        #change from user_id to participant code harmonized
-        #add EMA windows 
-        emaws = pd.DataFrame(self.get_ema_timespan(exact=True))
-        emaws['table'] = 'EMA'
-        emaws = emaws.merge(ow, left_on='participantCode', right_on='part_code', how='left')    #change from participantCode to participant code harmonized
-        tot_psws = pd.concat([emaws, tot_psws],join = 'inner')
-        # Group tot_psws by harmonized part code and create a dictionary with min and max values per participant
-        ps_ema_ws = tot_psws.groupby('part_code_harm').apply(lambda g: {
-            table: {
-                "min": g.loc[g["table"] == table, "MIN(d)"].tolist(),
-                "max": g.loc[g["table"] == table, "MAX(d)"].tolist()
-            } for table in g["table"].unique()
-        }).reset_index(name='all_windows') 
-
-        #missed_emas 
-        emas = self.table_to_csv('EMA') #there will be one record per sent survey 
-        emas['datestamp'] = pd.to_datetime(emas['datestamp'])
-        emas = emas.merge(ow, left_on='participantCode', right_on='part_code', how='left')
-        emas_count = emas.groupby('part_code_harm')['datestamp'].count().reset_index()
-        emas_count.columns = ['part_code_harm', 'ema_count']        # Rename column for clarity
+            windows.append(pd.DataFrame(psws_res[table].result(), columns=['USER_ID', 'min', 'max'])
+                           .merge(ow[['user_id', 'part_code_harm']], left_on='USER_ID', right_on='user_id').assign(table=table))
+        tot_psws = pd.concat([w[['part_code_harm', 'table', 'min', 'max']] for w in windows], ignore_index=True)
+        #lists of window bounds per harmonized part code and table, in one grouping, then nested per participant
+        bounds = tot_psws.groupby(['part_code_harm', 'table'], sort=False)[['min', 'max']].agg(list)
+        all_windows = dict()
+        for (part_code_harm, table), mins, maxs in zip(bounds.index, bounds['min'], bounds['max']):
+            all_windows.setdefault(part_code_harm, dict())[table] = {"min": mins, "max": maxs}
+        ps_ema_ws = pd.DataFrame({'part_code_harm': list(all_windows.keys()), 'all_windows': list(all_windows.values())})
+
+        #missed_emas, there is one record per sent survey 
+        emas_count = pd.DataFrame(emas_res.result(), columns=['part_code_harm', 'ema_count'])
         emas_count['ema_count'] = emas_count['ema_count'] -1         # first submitted survey is from tutorial and does not count TODO this needs to happen on part code not on harm 
         emas_count['ema_missed'] = 70 - emas_count['ema_count'] #70 total prompts
         emas_count['ema_missed_pct'] = emas_count['ema_missed'] * 100 /70
         emas_count['ema_missed_pct'] = emas_count['ema_missed_pct'].round(2)
         
         #dates of days with no ps
-        days_no_ps = pd.DataFrame(self.get_no_ps_dates(), columns=['user_id','day_missing_ps','index_missing_day']) 
+        days_no_ps = pd.DataFrame(no_ps_res.result(), columns=['user_id','day_missing_ps','index_missing_day']) 
         days_no_ps = days_no_ps.merge(ow, how='right')
         miss_ps = (
             days_no_ps.groupby('part_code_harm', dropna=False)
@@ -378,7 +918,7 @@ class MulticastDB:
         #miss_ps['days_ps'] = 28-miss_ps['days_no_ps']
         
         #days_ps #NOTE: count all passive sensing days, also including days outside study participation
-        days_ps = pd.DataFrame(self.get_count_ps_days(), columns=['user_id','tot_days_ps'])
+        days_ps = pd.DataFrame(days_ps_res.result(), columns=['user_id','tot_days_ps'])
         days_ps = days_ps.merge(ow, how='left', on = 'user_id' )
         days_ps = days_ps.groupby('part_code_harm', as_index=False)['tot_days_ps'].sum() #sum counts per part code harm, get part_code_harm and ps_days_count
         
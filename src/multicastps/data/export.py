@@ -0,0 +1,119 @@
+#typing of query results and their incremental writing to csv or parquet files, see MulticastDB.get_stream and export_table
+import os
+import pandas as pd
+
+try: #optional, needed for parquet files
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+FORMATS = ['csv', 'parquet']
+DEFAULT_CHUNK_ROWS = 100000
+COMPRESSION = 'zstd'
+
+#arrow type of the MySQL column types (information_schema.columns.data_type), and of the names DuckDB and SQLite give 
+#to the same types, other types are written as strings
+ARROW_TYPES = {
+    'tinyint': 'int64', 'smallint': 'int64', 'mediumint': 'int64', 'int': 'int64', 'bigint': 'int64',
+    'integer': 'int64', 'utinyint': 'int64', 'usmallint': 'int64', 'uinteger': 'int64', 'ubigint': 'int64', 'boolean': 'int64',
+    'float': 'float64', 'double': 'float64', 'decimal': 'float64', 'real': 'float64', 'numeric': 'float64',
+    'timestamp': 'timestamp', 'datetime': 'timestamp', 'date': 'date',
+}
+
+#pandas type of the column types, other types are read as strings
+PANDAS_TYPES = {data_type: {'int64': 'Int64', 'float64': 'float64'}.get(arrow, 'datetime64[us]') 
+                for data_type, arrow in ARROW_TYPES.items()}
+
+def apply_types(df, column_types):
+    """Convert the columns of df, as returned by the driver, to the pandas type of their MySQL type (nullable integers, 
+    floats for decimals, datetimes, strings), the same in every chunk of a query"""
+    for name, data_type in column_types:
+        dtype = PANDAS_TYPES.get(data_type.lower(), 'string')
+        if dtype == 'Int64':
+            df[name] = pd.to_numeric(df[name], errors='coerce').astype('Int64')
+        elif dtype == 'float64':
+            df[name] = pd.to_numeric(df[name], errors='coerce').astype('float64')
+        elif dtype.startswith('datetime'):
+            df[name] = pd.to_datetime(df[name], errors='coerce').astype(dtype)
+        else:
+            df[name] = df[name].astype('string')
+    return df
+
+def arrow_schema(column_types):
+    """Arrow schema of columns given as (name, MySQL data type), so that every chunk of an export is written with
+    the same types, whatever pandas infers for a chunk (e.g. a column that is null in a whole chunk)"""
+    fields = []
+    for name, data_type in column_types:
+        arrow = ARROW_TYPES.get(data_type.lower(), 'string')
+        if arrow == 'timestamp':
+            fields.append(pa.field(name, pa.timestamp('us')))
+        elif arrow == 'date':
+            fields.append(pa.field(name, pa.date32()))
+        elif arrow == 'int64':
+            fields.append(pa.field(name, pa.int64()))
+        elif arrow == 'float64':
+            fields.append(pa.field(name, pa.float64()))
+        else:
+            fields.append(pa.field(name, pa.string()))
+    return pa.schema(fields)
+
+def _conform(df, schema):
+    #convert the columns of a chunk to the types of schema
+    df = df.copy()
+    for field in schema:
+        col = df[field.name]
+        if pa.types.is_floating(field.type) or pa.types.is_integer(field.type):
+            df[field.name] = pd.to_numeric(col, errors='coerce')
+        elif pa.types.is_timestamp(field.type):
+            df[field.name] = pd.to_datetime(col, errors='coerce')
+        elif pa.types.is_date32(field.type):
+            df[field.name] = pd.to_datetime(col, errors='coerce').dt.date
+        else:
+            df[field.name] = col.astype('string')
+    return pa.Table.from_pandas(df, schema=schema, preserve_index=False, safe=False)
+
+def csv_compression(path):
+    #compression of a csv file from its extension. Compressed chunks are appended as separate streams (gzip members,
+    #zstd frames...), which readers decompress as one file
+    for ext, method in [('.gz', 'gzip'), ('.bz2', 'bz2'), ('.zst', 'zstd'), ('.xz', 'xz')]:
+        if path.endswith(ext):
+            return method
+    return None
+
+def write_chunks(chunks, path, fmt = 'csv', column_types = None):
+    """Write the dataframes of chunks one after the other to path, holding one chunk in memory at a time.
+    csv files are compressed if path ends with e.g. .gz or .zst, parquet files are compressed with COMPRESSION
+    and need column_types, the (name, MySQL data type) of the columns. Returns the number of rows written"""
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format '{fmt}', choose one of {FORMATS}")
+    if fmt == 'parquet' and pa is None:
+        raise ImportError("pyarrow is needed to export to parquet")
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    n = 0
+    writer = None
+    tmp = path + '.part' #renamed once complete, an interrupted export leaves no truncated file
+    try:
+        for df in chunks:
+            if fmt == 'csv':
+                df.to_csv(tmp, mode='w' if n == 0 else 'a', header=n == 0, index=False, compression=csv_compression(path))
+            else:
+                if writer is None:
+                    schema = arrow_schema(column_types)
+                    writer = pq.ParquetWriter(tmp, schema, compression=COMPRESSION)
+                writer.write_table(_conform(df, schema))
+            n += len(df)
+        if writer is not None:
+            writer.close()
+            writer = None
+        if n == 0 and fmt == 'csv' and not os.path.exists(tmp): #no rows, no chunk at all
+            pd.DataFrame(columns=[c for c, t in column_types or []]).to_csv(tmp, index=False, compression=csv_compression(path))
+        if n == 0 and fmt == 'parquet':
+            pq.write_table(arrow_schema(column_types).empty_table(), tmp, compression=COMPRESSION)
+        os.replace(tmp, path)
+    finally:
+        if writer is not None:
+            writer.close()
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return n
@@ -0,0 +1,196 @@
+import logging
+import os
+import sqlite3
+import sys
+import time
+from pathlib import Path
+import pandas as pd
+from multicastps.data.parsing import parse_and_df, parse_ios_df, stream_event_ids, AND_EVENTS, IOS_EVENTS
+
+logger = logging.getLogger('make_db')
+
+#status values of a file or chunk
+EMPTY = 'empty'             #file has no events table, nothing to upload
+UNREADABLE = 'unreadable'   #sqlite file could not be read
+FAILED = 'failed'           #file was read but parsing raised
+OK = 'ok'
+
+#columns of the events table used by the parsers, per file extension (.dbr android, .db ios)
+EVENT_COLUMNS = {
+    'dbr': "timestamp, data_type AS event_id, data",
+    '.db': "event_time AS timestamp, event_id, event_data AS data, device_id, user_id",
+}
+EVENT_ID_COLUMN = {'dbr': 'data_type', '.db': 'event_id'}
+MMAP_SIZE = 256 * 2**20     #bytes of the source file mapped in memory by sqlite
+EXPANSION = 10              #parsed dataframes take roughly this many times the bytes of the raw events
+MIN_CHUNK_ROWS = 1000
+DEFAULT_BUDGET = 512 * 2**20
+
+#streams that are built from the whole file and not from single events: the frames of all chunks are merged before upload
+FILE_LEVEL = {'DEVICE_INFO'}
+
+def connect_readonly(dbloc, mmap_size = MMAP_SIZE):
+    """Open a phone sensing file read-only. Uploaded files are never modified, so sqlite can skip locking (immutable)"""
+    conn = sqlite3.connect(Path(dbloc).absolute().as_uri() + '?mode=ro&immutable=1', uri=True)
+    conn.execute(f"PRAGMA mmap_size = {int(mmap_size)}")
+    return conn
+
+def plan_chunks(dbloc, budget = DEFAULT_BUDGET):
+    """Split the events table of dbloc into rowid ranges small enough to be read and parsed within budget bytes.
+    Returns (status, detail): detail is a list of (first rowid, last rowid) if status is OK, an error message otherwise"""
+    try:
+        conn = connect_readonly(dbloc)
+        try:
+            if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'events'").fetchone() is None:
+                return EMPTY, "no such table: events"
+            lo, hi = conn.execute("SELECT min(rowid), max(rowid) FROM events").fetchone()
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        return UNREADABLE, str(e)
+    if lo is None:
+        return OK, []
+    n_rows = hi - lo + 1 #upper bound, rowids might have gaps
+    row_bytes = max(1, os.path.getsize(dbloc) // n_rows)
+    chunk_rows = max(MIN_CHUNK_ROWS, budget // (row_bytes * EXPANSION))
+    return OK, [(start, min(start + chunk_rows - 1, hi)) for start in range(lo, hi + 1, chunk_rows)]
+
+def file_event_ids(dbloc, streams):
+    """Event ids to read from dbloc to build the tables in streams, None for all events"""
+    if streams is None:
+        return None
+    return stream_event_ids(streams, android = dbloc[-3:] == 'dbr')
+
+def unread_streams(dbloc, streams):
+    """Tables of the platform of dbloc that are not built when only the events of streams are read"""
+    if file_event_ids(dbloc, streams) is None:
+        return set()
+    mapping = AND_EVENTS if dbloc[-3:] == 'dbr' else IOS_EVENTS
+    return set(mapping) - set(streams)
+
+def read_events(dbloc, lo, hi, event_ids = None):
+    """Read the rows of the events table of dbloc with rowid between lo and hi into a pandas dataframe.
+    If event_ids is given only those events are read"""
+    ext = dbloc[-3:]
+    qry = f"SELECT {EVENT_COLUMNS[ext]} FROM events WHERE rowid BETWEEN ? AND ?"
+    if event_ids is not None:
+        qry += f" AND {EVENT_ID_COLUMN[ext]} IN ({', '.join(str(int(e)) for e in event_ids)})"
+    conn = connect_readonly(dbloc)
+    try:
+        return pd.read_sql(sql=qry + " ORDER BY rowid", con=conn, params=(lo, hi))
+    finally:
+        conn.close()
+
+def parse_events(dft, dbloc):
+    """Parse a dataframe of events with the parser of the platform of dbloc"""
+    if dbloc[-3:] == 'dbr':
+        return parse_and_df(dft, dbloc)
+    return parse_ios_df(dft, dbloc)
+
+def read_chunk(dbloc, lo, hi, event_ids = None):
+    """Read the events of one rowid range of a phone sensing file. Returns (status, events dataframe, seconds)"""
+    start = time.perf_counter()
+    try:
+        dft = read_events(dbloc, lo, hi, event_ids)
+    except pd.errors.DatabaseError:
+        ex_type, ex_value, ex_traceback = sys.exc_info()
+        logger.error(f"Can't read database file: {dbloc} --- error: {ex_value}")
+        return UNREADABLE, None, time.perf_counter() - start
+    return OK, dft, time.perf_counter() - start
+
+def parse_frame(dft, dbloc):
+    """Parse the events read by read_chunk. Returns (status, df_dict, seconds)"""
+    start = time.perf_counter()
+    try:
+        df_dict = parse_events(dft, dbloc)
+    except:
+        ex_type, ex_value, ex_traceback = sys.exc_info()
+        logger.error(f"Parsing failed, no data extracted at location: {dbloc} --- error: {ex_value}")
+        return FAILED, None, time.perf_counter() - start
+    return OK, df_dict, time.perf_counter() - start
+
+def parse_chunk(dbloc, lo, hi, event_ids = None):
+    """Read and parse the events of one rowid range of a phone sensing file (.db for ios, .dbr for android).
+    Returns a tuple (status, df_dict, seconds) where df_dict maps table names to dataframes and is None unless status is OK"""
+    status, dft, read_seconds = read_chunk(dbloc, lo, hi, event_ids)
+    if status != OK:
+        return status, None, read_seconds
+    status, df_dict, seconds = parse_frame(dft, dbloc)
+    return status, df_dict, read_seconds + seconds
+
+def file_tasks(paths, budget = DEFAULT_BUDGET, streams = None):
+    """Yield one task (dbloc, status, detail) per chunk of each file, see run_task.
+    Files that can't be chunked give a single task carrying their status and error message.
+    If streams is given, only the events feeding those tables are read"""
+    for dbloc in paths:
+        status, detail = plan_chunks(dbloc, budget)
+        event_ids = file_event_ids(dbloc, streams)
+        if status != OK:
+            yield dbloc, status, detail
+        elif not detail or event_ids == []:
+            yield dbloc, OK, None #nothing to read, still reported so that the file is recorded as processed
+        else:
+            for lo, hi in detail:
+                yield dbloc, OK, (lo, hi, event_ids)
+
+def read_task(task):
+    """Reading half of run_task. Returns (dbloc, status, events dataframe or None, seconds)"""
+    dbloc, status, detail = task
+    if status == EMPTY:
+        logger.info(f"At location {dbloc} Execution failed on sql 'SELECT * FROM events': {detail}")
+        return dbloc, status, None, 0.0
+    if status != OK:
+        logger.error(f"Can't read database file: {dbloc} --- error: {detail}")
+        return dbloc, status, None, 0.0
+    if detail is None:
+        return dbloc, OK, None, 0.0
+    return (dbloc, *read_chunk(dbloc, *detail))
+
+def parse_task(item):
+    """Parsing half of run_task, takes the result of read_task"""
+    dbloc, status, dft, read_seconds = item
+    if status != OK:
+        return dbloc, status, None, read_seconds
+    if dft is None:
+        return dbloc, OK, dict(), read_seconds
+    status, df_dict, seconds = parse_frame(dft, dbloc)
+    return dbloc, status, df_dict, read_seconds + seconds
+
+def run_task(task):
+    """Returns (dbloc, status, df_dict, seconds) for a task of file_tasks"""
+    return parse_task(read_task(task))
+
+def merge_file_level(frames):
+    """Merge the frames of a FILE_LEVEL stream parsed from several chunks of the same file"""
+    detailed = [f for f in frames if 'name' in f.columns] #ios DEVICE_INFO enriched with event 22, preferred as in parse_ios_df
+    df = pd.concat(detailed or frames, ignore_index=True)
+    subset = [c for c in df.columns if c != 'start_time']
+    return df.drop_duplicates(subset=subset)
+
+#------------PROCESS POOL SUPPORT
+class _RecordBuffer(logging.Handler):
+    """Keeps the log records emitted while a worker parses one chunk, so the parent can replay them in file order"""
+    def __init__(self):
+        super().__init__(level=logging.DEBUG)
+        self.records = []
+
+    def emit(self, record):
+        record.msg = record.getMessage() #args might not be picklable
+        record.args = None
+        record.exc_info = None
+        self.records.append(record)
+
+_buffer = None
+
+def init_worker():
+    """Process pool initializer: route the parser logs of this worker to a buffer instead of the inherited handlers"""
+    global _buffer
+    _buffer = _RecordBuffer()
+    logger.handlers = [_buffer]
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+
+def parse_task_logged(item):
+    """Worker entry point of the parse stage of the pipeline. Returns the result of parse_task and the log records emitted meanwhile"""
+    _buffer.records = []
+    return parse_task(item), _buffer.records
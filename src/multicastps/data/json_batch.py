@@ -0,0 +1,99 @@
+#batch decoding of the json payloads of phone sensing events, used by the explode_json helpers in parsing.py
+import json
+import logging
+import time
+import numpy as np
+import pandas as pd
+
+try: #optional, several times faster than the json module
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
+logger = logging.getLogger(__name__)
+
+def repair_json(raw):
+    """Close a payload truncated inside a string value, e.g. '{"ssid":"abc' -> '{"ssid":"abc}"}'.
+    Same repairs the parsers applied to the whole column before"""
+    x = raw.decode('utf-8') if isinstance(raw, bytes) else raw
+    if not x.strip().endswith('}'):
+        x = x + '}'
+    if not x.strip().endswith('"}'):
+        x = x + '"}'
+    return x
+
+def decode_json_column(series, schema = None, repair = False):
+    """Decode a series of json payloads (bytes or str) into a dataframe with the same index, one column per key.
+    Non-object payloads (e.g. a single number) give a single column named 0.
+    :schema: expected keys, always present as columns (NaN when missing). Other keys are kept as well
+    :repair: if True, rows that fail to decode are repaired with repair_json and dropped if still malformed,
+             if False the decoding error is raised
+    Returns the dataframe and the index of the dropped rows"""
+    decoded = []
+    bad = []
+    for i, raw in enumerate(series.tolist()):
+        try:
+            decoded.append(_loads(raw))
+        except (ValueError, TypeError): #json.JSONDecodeError and orjson.JSONDecodeError are ValueErrors
+            if not repair:
+                raise
+            try:
+                decoded.append(_loads(repair_json(raw)))
+            except (ValueError, TypeError, AttributeError):
+                bad.append(i)
+                decoded.append(None)
+    index = series.index
+    if bad:
+        keep = np.ones(len(decoded), dtype=bool)
+        keep[bad] = False
+        decoded = [d for d, k in zip(decoded, keep) if k]
+        index = index[keep]
+
+    if all(isinstance(d, dict) for d in decoded):
+        ret = pd.DataFrame(decoded, index=index)
+    elif not any(isinstance(d, (dict, list)) for d in decoded):
+        ret = pd.DataFrame({0: decoded}, index=index)
+    else: #mixed payloads, rare
+        ret = pd.Series(decoded, index=index, dtype=object).apply(pd.Series)
+    for col in schema or []:
+        if col not in ret.columns:
+            ret[col] = np.nan
+    return ret, series.index[bad]
+
+
+#------------BENCHMARK
+def _legacy_decode(series):
+    return series.apply(json.loads).apply(pd.Series)
+
+def benchmark(n_rows = 20000, repeat = 3):
+    """Compare rows/sec of decode_json_column with the previous .apply(json.loads).apply(pd.Series)
+    on synthetic payloads shaped like some frequent events"""
+    from multicastps.data.parsing import IOS_SCHEMAS, AND_SCHEMAS
+    payloads = {
+        ('ios', 151) : {'latitude': 47.376887, 'longitude': 8.541694, 'accuracy': 5.0, 'altitude': 408.2},
+        ('ios', 19) : {'timestamp': 1700000000, 'bt_address': 'a41b5e08e766', 'bt_rssi': -71, 'bt_name': 'headset'},
+        ('ios', 11) : {'timestamp': 1700000000, 'battery_left': 0.53},
+        ('android', 2) : {'LATITUDE': 47.376887, 'LONGITUDE': 8.541694, 'ACCURACY': 5.0, 'ALTITUDE': 408.2,
+                          'PROVIDER': 'gps', 'SPEED': 1.2, 'BEARING': 120.0, 'HASBEARING': True, 'HASSPEED': True},
+        ('android', 171) : {'level': 53, 'state': 2},
+    }
+    rows = []
+    for (platform, ev_id), payload in payloads.items():
+        series = pd.Series([json.dumps(payload).encode('utf-8')] * n_rows)
+        schema = (IOS_SCHEMAS if platform == 'ios' else AND_SCHEMAS).get(ev_id)
+        timings = dict()
+        for name, fn in [('legacy', _legacy_decode), ('batch', lambda s: decode_json_column(s, schema)[0])]:
+            best = float('inf')
+            for _ in range(repeat):
+                start = time.perf_counter()
+                fn(series)
+                best = min(best, time.perf_counter() - start)
+            timings[name] = n_rows / best
+        rows.append((platform, ev_id, round(timings['legacy']), round(timings['batch']), round(timings['batch'] / timings['legacy'], 1)))
+    return pd.DataFrame(rows, columns=['platform', 'event_id', 'legacy_rows_per_sec', 'batch_rows_per_sec', 'speedup'])
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    logger.info(f"json library: {_loads.__module__}")
+    logger.info(f"Decoding throughput:\n{benchmark().to_string(index=False)}")
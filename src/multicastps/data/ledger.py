@@ -0,0 +1,95 @@
+#persistent record of the phone sensing files copied to the database
+import hashlib
+import os
+from sqlalchemy import text
+
+#file status
+DONE = 'done'           #all streams of the file were uploaded
+PARTIAL = 'partial'     #some streams failed or were not selected with --streams
+FAILED = 'failed'       #the file could not be read or parsed
+EMPTY = 'empty'         #the file has no events table
+#stream status
+SKIPPED = 'skipped'     #stream not selected with --streams
+
+def file_hash(path, block_size = 1 << 20):
+    """sha1 of the file contents"""
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            h.update(block)
+    return h.hexdigest()
+
+def fingerprint(path):
+    """Returns (size, mtime, content hash) of a file"""
+    st = os.stat(path)
+    return st.st_size, st.st_mtime, file_hash(path)
+
+
+class IngestLedger:
+    """Per-file and per-stream status of phone sensing files, stored in the INGEST_LEDGER tables of the MulticastDB.
+    Entries are written with the connection used for the inserts of the file, so that the data of a file and
+    its ledger entry are committed in the same transaction. The tables are created by the migrations of the database,
+    see schema.py"""
+
+    def __init__(self, db) -> None:
+        self.db = db
+        self.files = dict()     #path -> (size, mtime, hash, status)
+        self.streams = dict()   #path -> {stream: status}
+        for path, size, mtime, hsh, status in db.query("SELECT PATH, SIZE, MTIME, HASH, STATUS FROM INGEST_LEDGER"):
+            self.files[path] = (size, mtime, hsh, status)
+        for path, stream, status in db.query("SELECT PATH, STREAM, STATUS FROM INGEST_LEDGER_STREAMS"):
+            self.streams.setdefault(path, dict())[stream] = status
+
+    def is_unchanged(self, path, fp = None):
+        #cheap check on size and mtime first, content hash only if those differ.
+        #fp is the (size, mtime, hash) of the file when it was parsed, if it is not read from disk now
+        size, mtime, hsh, status = self.files[path]
+        if fp is not None:
+            return fp[2] == hsh
+        st = os.stat(path)
+        if st.st_size == size and st.st_mtime == mtime:
+            return True
+        return st.st_size == size and file_hash(path) == hsh
+
+    def done_streams(self, path, fp = None):
+        """Streams of path already uploaded in a previous run, empty if the file changed since"""
+        if path not in self.files or not self.is_unchanged(path, fp):
+            return set()
+        return {s for s, status in self.streams.get(path, dict()).items() if status == DONE}
+
+    def pending_streams(self, path):
+        """Streams of path recorded as skipped or failed"""
+        return {s for s, status in self.streams.get(path, dict()).items() if status != DONE}
+
+    def needs_processing(self, path, streams, fp = None):
+        """A file is processed again if it is new or has changed, if it previously failed,
+        or if one of the selected streams was not uploaded yet"""
+        if path not in self.files or (fp is None and not os.path.exists(path)) or not self.is_unchanged(path, fp):
+            return True
+        status = self.files[path][3]
+        if status in (FAILED, EMPTY):
+            return True
+        return any(status != DONE and stream in streams for stream, status in self.streams.get(path, dict()).items())
+
+    def to_process(self, paths, streams):
+        return {p for p in paths if self.needs_processing(p, streams)}
+
+    def record(self, connection, path, status, parse_seconds = None, stream_status = None, fp = None):
+        """Write the outcome of one file. stream_status maps stream name to (status, number of rows)
+        for the streams handled in this run, streams uploaded by earlier runs are kept.
+        fp is the fingerprint of the file when it was parsed, computed now if not given"""
+        stream_status = stream_status or dict()
+        size, mtime, hsh = fp or fingerprint(path)
+        if path in self.files and self.files[path][2] != hsh: #contents changed, earlier stream outcomes are stale
+            connection.execute(text("DELETE FROM INGEST_LEDGER_STREAMS WHERE PATH = :path"), {'path': path})
+            self.streams.pop(path, None)
+        n_rows = sum(n for st, n in stream_status.values() if st == DONE)
+        connection.execute(text("""REPLACE INTO INGEST_LEDGER (PATH, SIZE, MTIME, HASH, STATUS, N_ROWS, PARSE_SECONDS)
+                                VALUES (:path, :size, :mtime, :hash, :status, :n_rows, :parse_seconds)"""),
+                           {'path': path, 'size': size, 'mtime': mtime, 'hash': hsh, 'status': status,
+                            'n_rows': n_rows, 'parse_seconds': parse_seconds})
+        if stream_status:
+            connection.execute(text("""REPLACE INTO INGEST_LEDGER_STREAMS (PATH, STREAM, STATUS, N_ROWS)
+                                    VALUES (:path, :stream, :status, :n_rows)"""),
+                               [{'path': path, 'stream': stream, 'status': st, 'n_rows': n}
+                                for stream, (st, n) in stream_status.items()])
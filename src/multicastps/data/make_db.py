@@ -3,19 +3,33 @@ from pathlib import Path
 from glob import glob 
 import os
 from tqdm import tqdm 
-import sqlite3
 import argparse
+import logging
 import pickle
 import sys
+from itertools import groupby, chain
+from sqlalchemy import text
 from sqlalchemy.exc import IntegrityError, DataError
-from multicastps.data.parsing import parse_and_df, parse_ios_df, parse_part_vars
+from multicastps.data.parsing import parse_part_vars, IOS_PARSERS, AND_PARSERS
+from multicastps.data.ingest import file_tasks, run_task, merge_file_level, unread_streams, OK, EMPTY, FILE_LEVEL, DEFAULT_BUDGET
+from multicastps.data.ledger import IngestLedger, DONE, PARTIAL, FAILED, SKIPPED
+from multicastps.data.ledger import EMPTY as FILE_EMPTY
 from multicastps.data.database import MulticastDB
+from multicastps.data.bulk_load import METHODS, ON_DUPLICATE
+from multicastps.data.pipeline import pipeline_results, run_writers, PipelineStats
+from multicastps.data.write_buffer import WriteBuffer, DEFAULT_ROWS, DEFAULT_BYTES
+from multicastps.data.csv_load import read_csv_chunks
+from multicastps.data.partitions import MONTHS_AHEAD
+from multicastps.data.backends import BACKENDS
+from multicastps.data.staging import stage_file, is_staged, read_manifests, staged_chunks, staged_fingerprint, PHONE, CSV
 
 from dotenv import load_dotenv
 from multicastps.data.queries_mc import TABLES
 import sys
 from multicastps.utils.logging_setup import setup_logging
 
+logger = logging.getLogger('make_db')
+
 #------------UTILS
 def build_file_index(path, already_processed):
     #Build index of passive sensing files to be parsed an uploaded, excluding files already uploaded. 
@@ -51,145 +65,459 @@ def dir_path(path):
 
     return path
 
-#------------ARGUMENTS
-parser = argparse.ArgumentParser()
-parser.add_argument(
-    "--path",
-    help="Directory containing sub-directories ema, mongo_export and phone. Make sure you have read privileges to it. Defaults to current wd.",
-    type=dir_path,  
-    default=os.path.join(os.getcwd(),'data','raw'),  # Default to the data folder in current working directory
-    required=False   
-)
-parser.add_argument(
-    "--pickle",
-    help="Path to binarized set containing paths to db files already successfully uploaded.",
-    required=False,
-    default=None
-)    
-parser.add_argument(
-    "--log-level",
-    help="Set the logging level for shell. Options are: DEBUG, INFO, WARNING, ERROR, CRITICAL.",
-    type=str,
-    choices=["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"],
-    default="INFO"  
-)
-parser.add_argument(
-    "--streams",
-    help="The sensor streams to import. If only a subset of streams are selected, this will not reflect in the logs",
-    type=str,
-    choices=list(TABLES.keys()),
-    default=list(TABLES.keys()),
-    nargs='+'
-)
-parser.add_argument( #TODO add support for PM
-    "--sources",
-    help="Which sources to pull data from",
-    type=str,
-    default='ALL',
-    choices=["ALL", "PM", "PR"]
-)
-
-args = parser.parse_args()
-
-load_dotenv() 
-mod_name = str(__file__).split('/')[-1][:-3]
-logger = setup_logging(mod_name, args.log_level)
-if args.pickle:
-    processed_dbs = pickle.load(open(args.pickle,'rb'))
-else:
-    processed_dbs = set()
-
-logger.info('Execution started')
-paths, paths_ema, paths_mc = build_file_index(args.path, processed_dbs)
-not_copied = dict()
-
-db = MulticastDB()
-
-#------------EMA DATA UPLOAD 
-file1, file2 = paths_ema
-df1 = pd.read_csv(file1)
-df2 = pd.read_csv(file2)
-# Merge the two DataFrames, keeping common and non-common columns
-merged_df = pd.concat([df1, df2], ignore_index=True)
-
-db.insert_pd(merged_df,'EMA')
-logger.info('EMA uploaded')
-
-#------------MOBILECOACH DATA UPLOAD
-for file in paths_mc:
-    if os.path.splitext(os.path.basename(file))[0] == "ParticipantVariableWithValue": #exception for big table
-        with pd.read_csv(file, chunksize=1000,) as reader:
-            for chunk in reader:
-                df_dict = parse_part_vars(chunk)
-                for stream_name in df_dict.keys():
-                    db.insert_pd(df_dict[stream_name], stream_name)
-                chunk['formerVariableValues'] = chunk['formerVariableValues'].str[-10000:]#truncate to only keep last 10K values of string values in column formerVariableValues
-                db.insert_pd(chunk, os.path.splitext(os.path.basename(file))[0]) 
-    else:
-        df = pd.read_csv(file)
-        db.insert_pd(df, os.path.splitext(os.path.basename(file))[0]) 
-logger.info('Mobilecoach data uploaded')
-    
-#------------PASSIVE SENSING UPLOAD
-logger.info(f'Found {len(paths)} phone sensing files to process ({len(processed_dbs)} already processed)')
+class ChunkFailed(Exception):
+    #raised when a chunk of a file could not be read or parsed
+    pass
 
-for dbloc in tqdm(paths):
-    failed_skipped_streams = set()
-    conn = sqlite3.connect(dbloc)
-    try:
-        dft = pd.read_sql(sql="SELECT * FROM events", con=conn)
-    except pd.errors.DatabaseError:
-        ex_type, ex_value, ex_traceback = sys.exc_info()
-        if str(ex_value) == """Execution failed on sql 'SELECT * FROM events': no such table: events""":
-            logger.info(f"At location {dbloc} Execution failed on sql 'SELECT * FROM events': no such table: events")
-        else:
-            logger.error(f"Can't read database file: {dbloc} --- error: {ex_value}")
-            not_copied[dbloc] = 'all' #the whole file contents could not be copied
-        continue
+class RetryFile(Exception):
+    #raised when a stream fails after rows of it were already inserted from earlier chunks of the same file
+    def __init__(self, streams):
+        self.streams = streams
 
-    try:
-        if dbloc[-3:] == 'dbr':
-            dft = dft[['timestamp','data_type','data']]
-            dft.rename(columns={
-                                'data_type' : 'event_id'
-                                                }, inplace = True )
-
-            df_dict = parse_and_df(dft, dbloc)
-            
-        elif dbloc[-3:] == '.db':
-            dft = dft[['event_time','event_id','event_data','device_id', 'user_id']]
-            dft.rename(columns={
-                                'event_data' : 'data',
-                                'event_time' : 'timestamp'
-                                                }, inplace = True )
-            df_dict = parse_ios_df(dft, dbloc)
-    except:
-        ex_type, ex_value, ex_traceback = sys.exc_info()
-        logger.error(f"Parsing failed, no data extracted at location: {dbloc} --- error: {ex_value}")
-        not_copied[dbloc] = 'all' #the whole file contents could not be copied
-        continue
-    
-    #Upload to database
+def upload_streams(db, df_dict, dbloc, streams, connection, skip=frozenset()):
+    #Upload the parsed streams of one chunk as part of the transaction of connection. Each stream is inserted in 
+    #a savepoint, so a failing stream does not prevent the others from being committed. 
+    #Returns a dictionary stream name -> (status, number of rows) for the streams handled here
+    stream_status = dict()
     for stream_name in df_dict.keys():
+        if stream_name in skip: #uploaded by a previous run or failed in an earlier chunk
+            continue
         try: 
-            if stream_name in args.streams :
-                db.insert_pd(df_dict[stream_name], stream_name)
+            if stream_name in streams :
+                with connection.begin_nested():
+                    db.insert_pd(df_dict[stream_name], stream_name, connection)
+                stream_status[stream_name] = (DONE, len(df_dict[stream_name]))
             else:
-                failed_skipped_streams.add(stream_name)
+                stream_status[stream_name] = (SKIPPED, 0)
         except IntegrityError:
             logger.error(f"Data violates schema constraints, no data extracted for table {stream_name} at location: {dbloc}")
-            failed_skipped_streams.add(stream_name)
+            stream_status[stream_name] = (FAILED, 0)
         except:
             ex_type, ex_value, ex_traceback = sys.exc_info()
             logger.error(f"Execution failed: {dbloc} \n {ex_value}")
-            failed_skipped_streams.add(stream_name)
-    
-    #save outcomes of processing operations 
-    if len(failed_skipped_streams)!= 0:
-        not_copied[dbloc] = failed_skipped_streams
-    processed_dbs.add(dbloc)
-
-logger.info(f'Execution complete for path: {args.path}')
-# Save to a pickle file
-with open(os.path.join(os.environ.get('LOG_DIR'), 'processed_dbs.pkl'), "wb") as file:
-    pickle.dump(processed_dbs, file)
+            stream_status[stream_name] = (FAILED, 0)
+    return stream_status
+
+def upload_file(db, ledger, dbloc, chunks, streams, failed=frozenset(), unread=None, fp=None):
+    #Upload all chunks (status, df_dict, seconds) of one file and its ledger entry in a single transaction.
+    #Streams in failed are not uploaded and recorded as failed. unread are the streams whose events were not read,
+    #by default those not selected with streams. fp is the fingerprint of the file when it was parsed, if staged.
+    #Returns the status of the file and the set of streams that failed or were skipped
+    stream_status = {s: (FAILED, 0) for s in failed}
+    done_streams = ledger.done_streams(dbloc, fp)
+    unread = unread_streams(dbloc, streams) if unread is None else unread
+    file_level = dict()
+    seconds = 0.0
+    try:
+        with db.transaction() as connection:
+            for status, df_dict, chunk_seconds in chunks:
+                seconds += chunk_seconds
+                if status != OK:
+                    raise ChunkFailed() #roll back what was inserted from earlier chunks
+                for stream_name in FILE_LEVEL & df_dict.keys():
+                    file_level.setdefault(stream_name, []).append(df_dict.pop(stream_name))
+                skip = done_streams | {st for st, (res, n) in stream_status.items() if res == FAILED}
+                for stream_name, (res, n) in upload_streams(db, df_dict, dbloc, streams, connection, skip).items():
+                    prev_res, prev_n = stream_status.get(stream_name, (res, 0))
+                    if res == FAILED and prev_n > 0:
+                        raise RetryFile({stream_name} | set(failed))
+                    stream_status[stream_name] = (res, prev_n + n)
+            merged = {s: merge_file_level(frames) for s, frames in file_level.items()}
+            stream_status.update(upload_streams(db, merged, dbloc, streams, connection, done_streams))
+            for stream_name in ledger.pending_streams(dbloc) & set(streams) - stream_status.keys():
+                stream_status[stream_name] = (DONE, 0) #left out by an earlier run, but not present in the file
+            for stream_name in set(unread) - stream_status.keys() - done_streams:
+                stream_status[stream_name] = (SKIPPED, 0) #events not read, a run selecting the stream will read the file again
+            failed_skipped_streams = {s for s, (res, n) in stream_status.items() if res != DONE}
+            ledger.record(connection, dbloc, PARTIAL if failed_skipped_streams else DONE, seconds, stream_status, fp)
+            return DONE, failed_skipped_streams
+    except ChunkFailed:
+        pass
+    with db.transaction() as connection:
+        ledger.record(connection, dbloc, FILE_EMPTY if status == EMPTY else FAILED, seconds, fp=fp)
+    return status, None
+
+def single_chunk(chunks):
+    #Returns (chunk, chunks): the chunk of a file read in a single chunk, None if the file has several,
+    #and an iterator over all chunks of the file
+    chunks = iter(chunks)
+    first = next(chunks, None)
+    second = next(chunks, None)
+    if first is None:
+        return None, iter([])
+    if second is None:
+        return first, iter([first])
+    return None, chain([first, second], chunks)
+
+def upload_results(db, ledger, results, streams, budget, coalesce, not_copied, buffers, progress=None):
+    #Writer stage: upload the chunk results (dbloc, status, df_dict, seconds) of consecutive files, as given by pipeline_results.
+    #Files read in a single chunk are uploaded together through a WriteBuffer of this writer, coalesce being its
+    #(max rows, max bytes), or None to upload each file on its own. Outcomes are added to not_copied
+    buffer = WriteBuffer(db, ledger, *coalesce) if coalesce else None
+    if buffer is not None:
+        buffers.append(buffer)
+    for dbloc, file_chunks in groupby(results, key=lambda r: r[0]):
+        if progress is not None:
+            progress.update()
+        chunk, chunks = single_chunk(r[1:] for r in file_chunks)
+        if buffer is not None and chunk is not None and chunk[0] == OK: #small file, uploaded with others
+            for path, failed_skipped_streams in buffer.add(dbloc, chunk[1], chunk[2], streams, unread_streams(dbloc, streams)).items():
+                if len(failed_skipped_streams) != 0:
+                    not_copied[path] = failed_skipped_streams
+            continue
+        try:
+            status, failed_skipped_streams = upload_file(db, ledger, dbloc, chunks, streams)
+        except RetryFile as e:
+            #a stream failed halfway through the file: upload again without it, reading the file in this thread
+            logger.warning(f"Uploading {dbloc} again without streams {e.streams}")
+            chunks = (run_task(task)[1:] for task in file_tasks([dbloc], budget, streams))
+            status, failed_skipped_streams = upload_file(db, ledger, dbloc, chunks, streams, failed=e.streams)
+        if status != DONE:
+            if status != EMPTY:
+                not_copied[dbloc] = 'all' #the whole file contents could not be copied
+            continue
+
+        #save outcomes of processing operations 
+        if len(failed_skipped_streams)!= 0:
+            not_copied[dbloc] = failed_skipped_streams
+
+    if buffer is not None:
+        for path, failed_skipped_streams in buffer.flush().items():
+            if len(failed_skipped_streams) != 0:
+                not_copied[path] = failed_skipped_streams
+
+def ema_chunks(paths_ema, budget):
+    #the two survey exports (old and new questionnaire) are merged in one table, keeping common and non-common columns
+    for df in read_csv_chunks('EMA', sorted(paths_ema), budget):
+        yield OK, {'EMA': df}, 0.0
+
+def mc_chunks(file, budget):
+    table = os.path.splitext(os.path.basename(file))[0]
+    for chunk in read_csv_chunks(table, [file], budget):
+        if table == "ParticipantVariableWithValue":
+            df_dict = parse_part_vars(chunk)
+            chunk['formerVariableValues'] = chunk['formerVariableValues'].str[-10000:]#truncate to only keep last 10K values of string values in column formerVariableValues
+            df_dict[table] = chunk
+            yield OK, df_dict, 0.0
+        else:
+            yield OK, {table: chunk}, 0.0
+
+def csv_sources(paths_ema, paths_mc, budget):
+    #Yield (source name, chunks) for the EMA and MobileCoach exports, chunks being (status, df_dict, seconds) as for phone files
+    yield 'EMA', ema_chunks(paths_ema, budget)
+    for file in paths_mc:
+        yield os.path.splitext(os.path.basename(file))[0], mc_chunks(file, budget)
+
+def insert_chunks(db, chunks):
+    #Upload the tables of an EMA or MobileCoach export in one transaction, replacing their rows: the exports are full
+    #snapshots, so that uploading the same export again does not duplicate it
+    existing = set(db.get_table_names())
+    replaced = set()
+    with db.transaction() as connection:
+        for status, df_dict, seconds in chunks:
+            for stream_name in df_dict.keys():
+                if stream_name in existing and stream_name not in replaced:
+                    connection.execute(text(f"DELETE FROM `{stream_name}`"))
+                replaced.add(stream_name)
+                db.insert_pd(df_dict[stream_name], stream_name, connection)
+
+if __name__ == '__main__':
+    #------------ARGUMENTS
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--path",
+        help="Directory containing sub-directories ema, mongo_export and phone. Make sure you have read privileges to it. Defaults to current wd.",
+        type=dir_path,  
+        default=os.path.join(os.getcwd(),'data','raw'),  # Default to the data folder in current working directory
+        required=False   
+    )
+    parser.add_argument(
+        "--pickle",
+        help="Path to binarized set containing paths to db files already successfully uploaded, as written by earlier versions of this script. "
+             "Progress is now recorded in the INGEST_LEDGER table of the database.",
+        required=False,
+        default=None
+    )    
+    parser.add_argument(
+        "--log-level",
+        help="Set the logging level for shell. Options are: DEBUG, INFO, WARNING, ERROR, CRITICAL.",
+        type=str,
+        choices=["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"],
+        default="INFO"  
+    )
+    parser.add_argument(
+        "--streams",
+        help="The sensor streams to import. Only the events feeding these tables are read from the phone sensing files. "
+             "Streams left out are recorded in the ingest ledger and imported by a later run that selects them",
+        type=str,
+        choices=list(TABLES.keys()),
+        default=list(TABLES.keys()),
+        nargs='+'
+    )
+    parser.add_argument( #TODO add support for PM
+        "--sources",
+        help="Which sources to pull data from",
+        type=str,
+        default='ALL',
+        choices=["ALL", "PM", "PR"]
+    )
+    parser.add_argument(
+        "--workers",
+        help="Number of processes used to parse phone sensing files",
+        type=int,
+        default=1
+    )
+    parser.add_argument(
+        "--readers",
+        help="Number of threads reading phone sensing files",
+        type=int,
+        default=1
+    )
+    parser.add_argument(
+        "--writers",
+        help="Number of threads uploading parsed files to the database, each with its own connection",
+        type=int,
+        default=1
+    )
+    parser.add_argument(
+        "--queue-size",
+        help="Number of chunks waiting between two stages of the import (read, parse, write) before the upstream stage stalls. "
+             "Defaults to the number of workers, at least 2",
+        type=int,
+        default=None
+    )
+    parser.add_argument(
+        "--backend",
+        help="Database to copy the data to: the MySQL server of the DB_* environment variables, or a local SQLite or DuckDB "
+             "file (--db-path). Defaults to DB_BACKEND, or mysql",
+        type=str,
+        choices=BACKENDS,
+        default=None
+    )
+    parser.add_argument(
+        "--db-path",
+        help="File of the SQLite or DuckDB database, defaults to DB_PATH or data/db/multicast.<backend>",
+        default=None
+    )
+    parser.add_argument(
+        "--insert-method",
+        help="Strategy used to insert data in the database: multi-row INSERT batches, LOAD DATA LOCAL INFILE or pandas to_sql",
+        type=str,
+        choices=METHODS,
+        default='executemany'
+    )
+    parser.add_argument(
+        "--batch-size",
+        help="Number of rows per INSERT statement",
+        type=int,
+        default=10000
+    )
+    parser.add_argument(
+        "--on-duplicate",
+        help="Rows of sensor tables whose natural key (participant, timestamp, ...) is already in the database are skipped (ignore), "
+             "overwrite the existing row (update) or make the upload of the stream fail (error)",
+        type=str,
+        choices=ON_DUPLICATE,
+        default='ignore'
+    )
+    parser.add_argument(
+        "--add-keys",
+        help="Before uploading, add the natural key to sensor tables created without it, removing duplicated rows. "
+             "Rewrites each such table, needs time and disk space proportional to its size",
+        action='store_true'
+    )
+    parser.add_argument(
+        "--keep-indexes",
+        help="Maintain the secondary indexes of the sensor tables while uploading. By default they are dropped before "
+             "uploading phone sensing files and built again at the end, which is faster for large imports",
+        action='store_true'
+    )
+    parser.add_argument(
+        "--rebuild-coverage",
+        help="Recount the DAILY_COVERAGE summary from the whole sensor tables at the end of the run, for data uploaded "
+             "before the summary existed. Uploads keep it up to date otherwise",
+        action='store_true'
+    )
+    parser.add_argument(
+        "--memory-budget",
+        help="Approximate memory in MB used to hold events read from phone sensing files and their parsed dataframes. "
+             "Large files are read and uploaded in chunks that fit in this budget.",
+        type=int,
+        default=DEFAULT_BUDGET // 2**20
+    )
+    parser.add_argument(
+        "--coalesce-rows",
+        help="Tables of files read in a single chunk are buffered and uploaded together with one insert per table "
+             "once this many rows are buffered. 0 uploads each file on its own.",
+        type=int,
+        default=DEFAULT_ROWS
+    )
+    parser.add_argument(
+        "--coalesce-mb",
+        help="Memory in MB of buffered tables that triggers an upload, see --coalesce-rows",
+        type=int,
+        default=DEFAULT_BYTES // 2**20
+    )
+    parser.add_argument(
+        "--mode",
+        help="direct: parse the raw files and upload them to the database. stage: parse the raw files and write the parsed "
+             "tables as parquet files in --stage-dir, without touching the database. load: upload the tables staged in "
+             "--stage-dir to the database, without parsing the raw files again. maintain: add the DAY column to the sensor tables "
+             "created without it, add the partitions of the coming months to the partitioned sensor tables (partitioning "
+             "them if needed) and drop those older than --retention-months. Rewrites the tables that lack the column or partitions.",
+        type=str,
+        choices=['direct', 'stage', 'load', 'maintain'],
+        default='direct'
+    )
+    parser.add_argument(
+        "--stage-dir",
+        help="Staging directory of parquet files, required with --mode stage and load",
+        default=None
+    )
+    parser.add_argument(
+        "--months-ahead",
+        help="With --mode maintain, number of months after the current one that get a partition",
+        type=int,
+        default=MONTHS_AHEAD
+    )
+    parser.add_argument(
+        "--retention-months",
+        help="With --mode maintain, partitions of months older than this are dropped. Partitions are kept if not set",
+        type=int,
+        default=None
+    )
+    parser.add_argument(
+        "--archive-dir",
+        help="With --mode maintain, rows of dropped partitions are first written as parquet files in this directory",
+        default=None
+    )
+
+    args = parser.parse_args()
+    if args.mode in ('stage', 'load') and args.stage_dir is None:
+        parser.error(f"--stage-dir is required with --mode {args.mode}")
+
+    load_dotenv() 
+    mod_name = str(__file__).split('/')[-1][:-3]
+    logger = setup_logging(mod_name, args.log_level)
+    if args.pickle:
+        processed_dbs = pickle.load(open(args.pickle,'rb'))
+    else:
+        processed_dbs = set()
+
+    logger.info('Execution started')
+    if args.mode == 'maintain':
+        #------------PARTITION MAINTENANCE
+        db = MulticastDB(backend=args.backend, path=args.db_path)
+        db.add_day_columns()
+        db.partition_tables()
+        db.maintain_partitions(args.months_ahead, args.retention_months, args.archive_dir)
+        if args.rebuild_coverage:
+            db.rebuild_coverage()
+        logger.info('Maintenance complete')
+        sys.exit(0)
+    not_copied = dict()
+    budget = args.memory_budget * 2**20
+    if args.mode != 'load':
+        paths, paths_ema, paths_mc = build_file_index(args.path, processed_dbs)
+        n_found = len(paths)
+    if args.mode != 'stage':
+        db = MulticastDB(insert_method=args.insert_method, batch_size=args.batch_size, on_duplicate=args.on_duplicate,
+                         backend=args.backend, path=args.db_path)
+        ledger = IngestLedger(db)
+        if args.add_keys:
+            db.add_natural_keys()
+
+    if args.mode == 'stage':
+        #------------STAGING OF PARSED DATA
+        for source, chunks in csv_sources(paths_ema, paths_mc, budget):
+            stage_file(args.stage_dir, source, chunks, None, kind=CSV)
+        logger.info('EMA and Mobilecoach data staged')
+
+        paths = {p for p in paths if not is_staged(args.stage_dir, p, args.streams)}
+        logger.info(f'Found {len(paths)} phone sensing files to stage ({n_found - len(paths)} already staged, {len(processed_dbs)} excluded with --pickle)')
+        stats = PipelineStats()
+        results = pipeline_results(sorted(paths), budget, args.streams, args.readers, args.workers, args.queue_size, stats)
+        for dbloc, file_chunks in tqdm(groupby(results, key=lambda r: r[0]), total=len(paths)):
+            chunks = (r[1:] for r in file_chunks)
+            status = stage_file(args.stage_dir, dbloc, chunks, args.streams, unread_streams(dbloc, args.streams))
+            if status not in (OK, EMPTY):
+                not_copied[dbloc] = 'all'
+        logger.info(f'Staging complete for path: {args.path} in {args.stage_dir}')
+
+    elif args.mode == 'load':
+        #------------UPLOAD OF STAGED DATA
+        for manifest in read_manifests(args.stage_dir, kind=CSV):
+            insert_chunks(db, staged_chunks(args.stage_dir, manifest, None))
+        logger.info('EMA and Mobilecoach data uploaded')
+
+        manifests = [m for m in read_manifests(args.stage_dir, kind=PHONE)
+                     if ledger.needs_processing(m['source'], args.streams, staged_fingerprint(m))]
+        logger.info(f'Found {len(manifests)} staged phone sensing files to upload')
+        if manifests and not args.keep_indexes:
+            db.drop_indexes()
+        buffer = WriteBuffer(db, ledger, args.coalesce_rows, args.coalesce_mb * 2**20) if args.coalesce_rows > 0 else None
+        buffers = [buffer] if buffer is not None else []
+        for manifest in tqdm(manifests):
+            dbloc, fp = manifest['source'], staged_fingerprint(manifest)
+            unread = {s for s, (res, n) in manifest['streams'].items() if res == SKIPPED} #not staged, stage the file again to get them
+            streams = [s for s in args.streams if s not in unread]
+            chunk, chunks = single_chunk(staged_chunks(args.stage_dir, manifest, streams))
+            if buffer is not None and chunk is not None:
+                for path, failed_skipped_streams in buffer.add(dbloc, chunk[1], chunk[2], streams, unread, fp).items():
+                    if len(failed_skipped_streams) != 0:
+                        not_copied[path] = failed_skipped_streams
+                continue
+            try:
+                status, failed_skipped_streams = upload_file(db, ledger, dbloc, chunks, streams, unread=unread, fp=fp)
+            except RetryFile as e:
+                logger.warning(f"Uploading {dbloc} again without streams {e.streams}")
+                status, failed_skipped_streams = upload_file(db, ledger, dbloc, staged_chunks(args.stage_dir, manifest, streams),
+                                                             streams, failed=e.streams, unread=unread, fp=fp)
+            if len(failed_skipped_streams) != 0:
+                not_copied[dbloc] = failed_skipped_streams
+        if buffer is not None:
+            for path, failed_skipped_streams in buffer.flush().items():
+                if len(failed_skipped_streams) != 0:
+                    not_copied[path] = failed_skipped_streams
+        logger.info(f'Upload complete for staging directory: {args.stage_dir}')
+
+    else:
+        paths = ledger.to_process(paths, args.streams)
+
+        #------------EMA AND MOBILECOACH DATA UPLOAD 
+        for source, chunks in csv_sources(paths_ema, paths_mc, budget):
+            insert_chunks(db, chunks)
+            if source == 'EMA':
+                logger.info('EMA uploaded')
+        logger.info('Mobilecoach data uploaded')
+        
+        #------------PASSIVE SENSING UPLOAD
+        logger.info(f'Found {len(paths)} phone sensing files to process ({n_found - len(paths)} already in the ingest ledger, {len(processed_dbs)} excluded with --pickle)')
+        if paths and not args.keep_indexes:
+            db.drop_indexes()
+
+        stats = PipelineStats()
+        stats.stage('write', args.writers)
+        results = pipeline_results(sorted(paths), budget, args.streams, args.readers, args.workers, args.queue_size, stats)
+        coalesce = (args.coalesce_rows, args.coalesce_mb * 2**20) if args.coalesce_rows > 0 else None
+        buffers = []
+        with tqdm(total=len(paths)) as progress:
+            run_writers(results, args.writers,
+                        lambda res: upload_results(db, ledger, res, args.streams, budget, coalesce, not_copied, buffers, progress),
+                        stats=stats)
+        logger.info(f'Execution complete for path: {args.path}')
+
+    if args.mode != 'stage':
+        db.create_indexes() #also those dropped by an interrupted run
+        if args.rebuild_coverage:
+            db.rebuild_coverage()
+    if args.mode != 'load':
+        logger.info(f'Pipeline stages:\n{stats.summary().to_string(index=False)}')
+    if args.mode != 'stage' and buffers:
+        logger.info(f'Small files uploaded in {sum(b.flushes for b in buffers)} coalesced transactions')
+    if args.mode != 'stage':
+        logger.info(f'Insert throughput:\n{db.load_stats.summary().to_string(index=False)}')
+        logger.info(f'Connection pool: {db.pool_stats.summary()}')
+    if args.workers == 1: #parser timings of worker processes stay in the workers
+        logger.debug(f'iOS parser time per event id:\n{IOS_PARSERS.timing_summary().to_string(index=False)}')
+        logger.debug(f'Android parser time per event id:\n{AND_PARSERS.timing_summary().to_string(index=False)}')
@@ -2,15 +2,84 @@ import logging
 import pandas as pd
 import os
 import json
-from json.decoder import JSONDecodeError
 import ast
 import sys
 import re
+import time
+from multicastps.data.json_batch import decode_json_column
 
 #TODO input values might contain quotation marks, semicolons, % and _ wildcard characters
 
 logger = logging.getLogger('make_db')
 
+#keys expected in the json payload of each event id, see json_batch.decode_json_column 
+IOS_SCHEMAS = {
+    151 : ('latitude', 'longitude', 'accuracy', 'altitude'),
+    152 : ('latitude', 'longitude', 'accuracy', 'altitude'),
+    18 : ('timestamp', 'bssid', 'ssid'),
+    181 : ('timestamp', 'wifi_connected', 'wifi_enabled'),
+    19 : ('timestamp', 'bt_address', 'bt_rssi', 'bt_name'),
+    22 : ('sample_type', 'sample_quantity', 'start_date', 'end_date', 'source'),
+    23 : ('timestamp', 'callId', 'callType', 'duration'),
+    13 : ('timestamp', 'brightness'),
+    14 : ('LockState',),
+    111 : ('timestamp', 'battery_state'),
+    11 : ('timestamp', 'battery_left'),
+}
+AND_SCHEMAS = {
+    171 : ('level', 'state'),
+    2 : ('LATITUDE', 'LONGITUDE', 'ACCURACY', 'ALTITUDE', 'PROVIDER'),
+    91 : ('state', 'SSID', 'bssid'),
+    202 : ('start_time', 'end_time', 'steps', 'steps_since_boot', 'time_since_boot'),
+    136 : ('screen_state',),
+}
+
+class ParserRegistry:
+    """Maps event ids to the functions building tables from them. A handler is called once per file (or chunk) with 
+    the events of its id, the dictionary of parsed tables, to which it adds its results, and the file location.
+    Register new event ids with the register decorator. Time spent in each handler is kept in timings"""
+    def __init__(self) -> None:
+        self.handlers = dict()  #event id -> function
+        self.tables = dict()    #event id -> tables built by the handler
+        self.timings = dict()   #event id -> [seconds, rows, calls]
+
+    def register(self, ev_id, tables):
+        def decorator(fn):
+            self.handlers[ev_id] = fn
+            self.tables[ev_id] = tuple(tables)
+            return fn
+        return decorator
+
+    def table_events(self):
+        """Returns a dictionary table name -> tuple of the event ids it is built from"""
+        ret = dict()
+        for ev_id, tables in self.tables.items():
+            for table in tables:
+                ret[table] = ret.get(table, tuple()) + (ev_id,)
+        return ret
+
+    def parse(self, df_ex, ret, dbloc):
+        """Partition df_ex on event_id in one pass and call the handler of each event id present, in order of appearance"""
+        for ev_id, dfe in df_ex.groupby('event_id', sort=False):
+            handler = self.handlers.get(ev_id)
+            if handler is None:
+                continue
+            start = time.perf_counter()
+            handler(dfe, ret, dbloc)
+            entry = self.timings.setdefault(ev_id, [0.0, 0, 0])
+            entry[0] += time.perf_counter() - start
+            entry[1] += len(dfe)
+            entry[2] += 1
+        return ret
+
+    def timing_summary(self):
+        """Returns a pandas table with the time spent, rows and calls per event id"""
+        ret = pd.DataFrame([(ev_id, *v) for ev_id, v in self.timings.items()], columns=['event_id', 'seconds', 'rows', 'calls'])
+        return ret.sort_values('seconds', ascending=False).reset_index(drop=True)
+
+IOS_PARSERS = ParserRegistry()
+AND_PARSERS = ParserRegistry()
+
 def safe_decode_utf8(series):
     decoded_series = series.str.decode("utf-8")
     if decoded_series.isnull().sum() == 0:  # Ensure no nulls appeared
@@ -18,6 +87,360 @@ def safe_decode_utf8(series):
     else:
         return series  # Return the original series if decoding fails
 
+def explode_ios_json(dfe, dbloc, drop_timestamp = False):
+    #add the keys of the json payloads of dfe as columns, truncated payloads are repaired row by row
+    ev_id = dfe['event_id'].iat[0]
+    df2, bad = decode_json_column(dfe['data'], IOS_SCHEMAS.get(ev_id), repair=True)
+    if len(bad) != 0:
+        logger.warning(f"Malformed json for event_id {ev_id} at location: {dbloc} --- {len(bad)} of {len(dfe)} rows dropped")
+        dfe = dfe.drop(index=bad)
+    if drop_timestamp: 
+        dfe = dfe.drop(['timestamp'],axis = 1)
+    return pd.concat([dfe, df2], axis = 1)
+
+def explode_and_json(dfe, drop_timestamp = False):
+    #add the keys of the json payloads of dfe as columns
+    df2, bad = decode_json_column(dfe['data'], AND_SCHEMAS.get(dfe['event_id'].iat[0]))
+    if drop_timestamp: 
+        dfe = dfe.drop(['timestamp'],axis = 1)
+    return pd.concat([dfe, df2], axis = 1)
+
+def extract_from_json_list(row):
+    # Convert the bytes to string
+    try:
+        json_str = safe_decode_utf8(row['data'])
+    except AttributeError:
+        json_str = row['data']
+    # Convert the string to a dictionary
+    json_dict = json.loads(json_str)
+    # Extract the data list and attach timestamp and user_id
+    key = list(json_dict.keys())[0]
+    return [
+                {**entry, 'timestamp': row['timestamp'], 'user_id': row['user_id']} 
+                for entry in json_dict[key]
+            ]
+
+#------------IOS EVENTS
+@IOS_PARSERS.register(151, tables=('LOCATION',))
+def _ios_151(dfe, ret, dbloc):
+    dfp = explode_ios_json(dfe, dbloc)
+    dfp = dfp[['timestamp', 'user_id', 'latitude', 'longitude', 'accuracy', 'altitude']]
+    dfp['source'] = 'all'
+    try: #a file can hold both 151 and 152 events
+        ret['LOCATION'] = pd.concat([ret['LOCATION'], dfp], ignore_index=True)
+    except KeyError:
+        ret['LOCATION'] = dfp
+
+@IOS_PARSERS.register(152, tables=('LOCATION',))
+def _ios_152(dfe, ret, dbloc):
+    dfp = explode_ios_json(dfe, dbloc)        
+    dfp = dfp[['timestamp', 'user_id','latitude', 'longitude', 'accuracy', 'altitude']]
+    dfp['source'] = 'app'
+    try: #a file can hold both 151 and 152 events
+        ret['LOCATION'] = pd.concat([ret['LOCATION'], dfp], ignore_index=True)
+    except KeyError:
+        ret['LOCATION'] = dfp
+
+@IOS_PARSERS.register(18, tables=('WIFI_CONNECTED',))
+def _ios_18(dfe, ret, dbloc):
+    dfp = explode_ios_json(dfe, dbloc, drop_timestamp=True)
+    if not dfp.empty: #json is correctly parsed 
+        dfp['timestamp'] = pd.to_datetime(dfp['timestamp'], unit='s', utc=True).dt.tz_convert('Europe/Zurich')
+        ret['WIFI_CONNECTED'] = dfp[['timestamp', 'user_id', 'bssid', 'ssid']]
+
+@IOS_PARSERS.register(181, tables=('WIFI_STATE',))
+def _ios_181(dfe, ret, dbloc):
+    dfp = explode_ios_json(dfe, dbloc, drop_timestamp=True)
+    dfp['timestamp'] = pd.to_datetime(dfp['timestamp'], unit='s', utc=True).dt.tz_convert('Europe/Zurich')        
+    #ret['DEVICE_STATE'] = pd.concat([ret['DEVICE_STATE'], dfp[['start_date', 'end_date', 'user_id', 'wifi_connected_old', 'wifi_connected', 'wifi_enabled']] ], axis = 1)
+    ret['WIFI_STATE'] = dfp[['timestamp', 'user_id', 'wifi_connected', 'wifi_enabled']].drop_duplicates()
+
+@IOS_PARSERS.register(19, tables=('BLUETOOTH',))
+def _ios_19(dfe, ret, dbloc):
+    dfp = explode_ios_json(dfe, dbloc, drop_timestamp=True)
+    dfp['timestamp'] = pd.to_datetime(dfp['timestamp'], unit='s', utc=True).dt.tz_convert('Europe/Zurich')
+    ret['BLUETOOTH'] = dfp[['timestamp', 'user_id', 'bt_address', 'bt_rssi', 'bt_name']].dropna(axis=0,how='all',inplace=False)
+
+@IOS_PARSERS.register(21, tables=('STEPS_IOS',))    # "1709500823,15,9.089999999850988,0,0 #will keep the timestamp present in the 'data' field
+def _ios_21(dfe, ret, dbloc):
+    dfp = dfe[['timestamp', 'user_id', 'data']]
+    dfp['data'] = safe_decode_utf8(dfp['data'])
+    dfp = pd.concat([dfp[['user_id','timestamp']], dfp['data'].str.split(',', expand=True)], axis=1)
+    dfp.rename(columns={'timestamp' : 'start_time', 
+                        0 : 'end_time',
+                        1 : 'step_count',
+                        2 : 'est_distance',
+                        3 : 'floors_ascended',
+                        4 : 'floors_descended'
+                                        }, inplace = True ) 
+    dfp['end_time'] = pd.to_datetime(dfp['end_time'], unit='s', utc=True).dt.tz_convert('Europe/Zurich')   
+    dfp['start_time'] = pd.to_datetime(dfp['start_time'], unit='s', utc=True).dt.tz_convert('Europe/Zurich')         
+    ret['STEPS_IOS'] = dfp
+
+@IOS_PARSERS.register(22, tables=('STEPS', 'DEVICE_INFO',))
+def _ios_22(dfe, ret, dbloc):
+    dfp = explode_ios_json(dfe, dbloc)
+    if not dfp.empty:
+        dfp = dfp.loc[dfp['sample_type'] == 'HKQuantityTypeIdentifierStepCount']
+        dfp['sample_quantity'] = [x[:-6] for x in dfp['sample_quantity']]
+        daytime_mapping = {
+            'am Namittag': 'PM', 
+            'am Vormittag' : 'AM'
+            }
+        for key, value in daytime_mapping.items():
+            dfp['start_date'] = dfp['start_date'].str.replace(key, value)
+            dfp['end_date'] = dfp['end_date'].str.replace(key, value)
+
+        dfp['start_date'] = pd.to_datetime(dfp['start_date'], infer_datetime_format=True).dt.tz_convert('Europe/Zurich')
+        dfp['end_date'] = pd.to_datetime(dfp['end_date'], infer_datetime_format=True).dt.tz_convert('Europe/Zurich')
+        dfp.rename(columns={'end_date' : 'end_time',
+                            'start_date' : 'start_time',
+                            'sample_quantity' : 'steps'}, inplace=True)
+
+        ret['STEPS'] = dfp[['start_time', 'end_time','user_id', 'steps']]
+
+        pattern = r'name:(.*?), bundle:(.*?), version:(.*?), productType:(.*?), operatingSystemVersion:(.*?)>'
+        dfp[['name', 'bundle', 'version', 'productType', 'operatingSystemVersion']] = dfp['source'].str.extract(pattern)
+
+        #dfp['operatingSystemVersion'] = dfp['source'].str.split("""\n""", expand=True)[2].str.split("""=""", expand=True)[1].str.strip('"').str.strip(';')
+        #dfp['productType'] = dfp['source'].str.split("""\n""", expand=True)[3].str.split("""=""", expand=True)[1].str.strip('"').str.strip(';')
+        #ret['DEVICE_STATE'] = pd.concat([ret['DEVICE_STATE'], dfp[['user_id','start_date','end_date','operatingSystemVersion']]], axis = 0)
+        #ret['DEVICE_INFO'].loc[:,'productType'] = dfp['productType'].iloc[0]
+
+        dfp['user_id'] = ret['DEVICE_INFO']['user_id'][0]
+        dfp['device_id'] = ret['DEVICE_INFO']['device_id'][0]
+        dfp['os'] = ret['DEVICE_INFO']['os'][0]
+        ret['DEVICE_INFO'] = dfp[['user_id','device_id','os','name', 'bundle', 'version', 'productType', 'operatingSystemVersion','start_time']]
+
+@IOS_PARSERS.register(23, tables=('CALL_LOG',))
+def _ios_23(dfe, ret, dbloc):
+    dfp = explode_ios_json(dfe, dbloc, drop_timestamp=True)   
+    dfp = dfp.astype({"duration": float})
+    dfp['timestamp'] = pd.to_datetime(dfp['timestamp'], unit='s', utc=True).dt.tz_convert('Europe/Zurich')
+    ret['CALL_LOG'] = dfp[['timestamp', 'user_id', 'callId', 'callType', 'duration']] #TODO harmonize with ios 'Disconnected', unknown, dialing, connected, incoming
+
+@IOS_PARSERS.register(987, tables=('HEART_BEAT',))
+def _ios_987(dfe, ret, dbloc):
+    dfp = explode_ios_json(dfe, dbloc)
+    dfp.rename(columns={
+                        0 : 'heart_beat'}, inplace=True)
+    ret['HEART_BEAT'] = dfp[['timestamp', 'user_id','heart_beat']]
+
+@IOS_PARSERS.register(16, tables=('ACTIVITY',))
+def _ios_16(dfe, ret, dbloc):
+    dfp = dfe[['user_id', 'timestamp', 'data']]
+    dfp['data'] = safe_decode_utf8(dfp['data'])
+    dfp = pd.concat([dfp[['timestamp','user_id']], dfp['data'].str.split(',', expand=True)], axis=1)
+    dfp.rename(columns={
+                        0 : 'activity',
+                        1 : 'confidence'
+                                        }, inplace = True )
+    dfp['activity'].replace(r"^ +| +$", r"", regex=True, inplace=True) #remove whitespaces at beginnning and end
+    ret['ACTIVITY'] = dfp[['timestamp','user_id','activity', 'confidence']]
+
+@IOS_PARSERS.register(13, tables=('BRIGHTNESS',))
+def _ios_13(dfe, ret, dbloc):
+    dfp = explode_ios_json(dfe, dbloc, drop_timestamp=True)   
+    dfp = dfp.astype({"brightness": float})
+    dfp['timestamp'] = pd.to_datetime(dfp['timestamp'], unit='s', utc=True).dt.tz_convert('Europe/Zurich')
+    ret['BRIGHTNESS'] = dfp[['timestamp', 'user_id', 'brightness']]
+
+@IOS_PARSERS.register(14, tables=('SCREEN',))
+def _ios_14(dfe, ret, dbloc):
+    dfp = explode_ios_json(dfe, dbloc)   
+    dfp = dfp.astype({'LockState': float})
+    dfp = dfp.astype({'LockState': bool})
+    ret['SCREEN'] = dfp[['timestamp', 'user_id','LockState']]
+
+@IOS_PARSERS.register(111, tables=('BATTERY_STATE',))
+def _ios_111(dfe, ret, dbloc):
+    dfp = explode_ios_json(dfe, dbloc, drop_timestamp=True) 
+    dfp['timestamp'] = pd.to_datetime(dfp['timestamp'], unit='s', utc=True).dt.tz_convert('Europe/Zurich')
+    #dfp.rename(columns={'timestamp' : 'start_date'}, inplace = True)
+    dfp = dfp.astype({"battery_state": int})
+    dfp["battery_state"] = dfp["battery_state"].map( {2: 'charging', 
+                                                      1: 'unplugged', 
+                                                      3: 'full', 
+                                                      0: 'unknown'})
+    #ret['DEVICE_STATE'] = pd.concat([ret['DEVICE_STATE'], dfp[['user_id','start_date','battery_state']]])
+    ret['BATTERY_STATE'] = dfp[['timestamp','user_id','battery_state']]
+
+@IOS_PARSERS.register(11, tables=('BATTERY_LEVEL',))    #battery
+def _ios_11(dfe, ret, dbloc):
+    dfp = explode_ios_json(dfe, dbloc, drop_timestamp=True)   
+    dfp['timestamp'] = pd.to_datetime(dfp['timestamp'], unit='s', utc=True).dt.tz_convert('Europe/Zurich')
+    dfp = dfp.astype({'battery_left': float})
+    ret['BATTERY_LEVEL'] = dfp[['timestamp', 'user_id','battery_left']]
+
+#------------ANDROID EVENTS
+@AND_PARSERS.register(171, tables=('BATTERY_LEVEL', 'BATTERY_STATE',))
+def _and_171(dfe, ret, dbloc):
+    dfp = explode_and_json(dfe, drop_timestamp=False)   
+    #dfp['timestamp'] = pd.to_datetime(dfp['timestamp'], unit='s', utc=True).dt.tz_convert('Europe/Zurich')
+    dfp.rename(columns={'level' : 'battery_left', "state": 'battery_state'}, inplace = True)
+    dfp = dfp.astype({'battery_left': float, "battery_state": int})
+    dfp['battery_state'] = dfp['battery_state'].map({2:'charging', 
+                                                    3 : 'unplugged',  #'discharging' is changed to match with ios 
+                                                    5 : 'full', 
+                                                    4 : 'unplugged', #'not_charging' is changed to match with ios 
+                                                    1 : 'unknown'})
+    ret['BATTERY_LEVEL'] = dfp[['timestamp', 'user_id','battery_left']]
+    ret['BATTERY_STATE'] = dfp[['timestamp', 'user_id','battery_state']]
+
+@AND_PARSERS.register(2, tables=('LOCATION', 'LOCATION_MORE',))
+def _and_2(dfe, ret, dbloc):
+    dfp = explode_and_json(dfe)
+    dfp.rename(columns={
+                        'ALTITUDE' : 'altitude',
+                        'LONGITUDE' : 'longitude',
+                        'LATITUDE' : 'latitude',
+                        'ACCURACY' : 'accuracy',
+                        'PROVIDER' : 'source',
+                        'STAELLITES' : 'satellites'
+                                        }, inplace = True )     
+    ret['LOCATION'] = dfp[['timestamp', 'user_id','latitude', 'longitude', 'accuracy', 'altitude','source']]
+    desired_columns = {'timestamp', 'user_id', 'satellites', 'SPEED', 
+           'NEWWORKLOCATIONSOURCE', 'BEARING', 'HASBEARING', 
+           'NEWWORKLOCATIONTYPE', 'HASSPEED', 'TRAVELSTATE'}
+    
+    present_columns = desired_columns & set(dfp.columns)
+    missing_columns = desired_columns - set(dfp.columns)
+    df_c = dfp[list(present_columns)].copy()
+    df_c[list(missing_columns)] = None
+    ret['LOCATION_MORE'] = df_c
+
+@AND_PARSERS.register(902, tables=('LOCATION_PING',))    #location ping one single numerical field: app tried to collect location data
+def _and_902(dfe, ret, dbloc):
+    dfp = explode_and_json(dfe)    
+    dfp.rename(columns={0 : 'ping'}, inplace = True )    
+    ret['LOCATION_PING'] = dfp[['timestamp', 'user_id','ping']]
+
+@AND_PARSERS.register(91, tables=('WIFI_CONNECTED',))
+def _and_91(dfe, ret, dbloc):
+    dfp = explode_and_json(dfe, drop_timestamp=False)
+    dfp.loc[dfp['state']=='disconnected',['SSID','bssid']] = None
+    dfp['bssid'] = dfp['bssid'].astype(object)
+    dfp.loc[dfp['state']=='disconnected',['bssid']] = None
+    dfp.rename(columns={'SSID' : 'ssid'}, inplace = True)    
+    ret['WIFI_CONNECTED'] = dfp[['timestamp', 'user_id', 'bssid', 'ssid']]
+
+@AND_PARSERS.register(9, tables=('WIFI_SCANNED',))
+def _and_9(dfe, ret, dbloc):
+    wifi_data_list = dfe.apply(extract_from_json_list, axis=1).explode().tolist()
+    wifi_data = pd.json_normalize(wifi_data_list)
+    if not wifi_data.empty:
+        #wifi_data['timestamp'] = pd.to_datetime(wifi_data['timestamp'], unit='s', utc=True).dt.tz_convert('Europe/Zurich')
+        wifi_data.columns = [x.lower() for x in wifi_data.columns]
+        ret['WIFI_SCANNED'] = wifi_data.dropna(axis=0,how='all',inplace=False)
+    else:
+        par  = dfe[['timestamp', 'user_id']].copy()
+        par[['bssid', 'ssid']] = None
+        ret['WIFI_SCANNED'] = par.dropna(axis=0,how='all',inplace=False)
+
+@AND_PARSERS.register(10, tables=('BLUETOOTH',))
+def _and_10(dfe, ret, dbloc):
+    devices_data_list = dfe.apply(extract_from_json_list, axis=1).explode().tolist()
+    devices_df = pd.json_normalize(devices_data_list)
+    #devices_df['timestamp'] = pd.to_datetime(devices_df['timestamp'], unit='s', utc=True).dt.tz_convert('Europe/Zurich')
+    if not devices_df.empty:
+        devices_df.rename(columns={'DEVICE' : 'bt_address', 'RSSI' : 'bt_rssi', 'CLASS' : 'bt_class'}, inplace = True)
+        ret['BLUETOOTH'] = devices_df[['timestamp', 'user_id', 'bt_address', 'bt_rssi','bt_class']].dropna(axis=0,how='all',inplace=False)
+    else:
+        par = dfe[['timestamp','user_id']].copy()
+        par[['bt_address', 'bt_rssi','bt_class']] = None
+        ret['BLUETOOTH'] = par.dropna(axis=0,how='all',inplace=False)
+
+@AND_PARSERS.register(202, tables=('STEPS',))
+def _and_202(dfe, ret, dbloc):
+    dfp = explode_and_json(dfe, drop_timestamp = True)
+    dfp['start_time'] = pd.to_datetime(dfp['start_time'], unit='ms', utc=True).dt.tz_convert('Europe/Zurich') 
+    dfp['end_time'] = pd.to_datetime(dfp['end_time'], unit='ms', utc=True).dt.tz_convert('Europe/Zurich')    
+    dfp['time_since_boot'] = dfp['time_since_boot']/1000    #convert from milliseconds to seconds
+    dfp = dfp.astype({"time_since_boot": int})
+    ret['STEPS'] = dfp[['start_time', 'end_time','user_id', 'steps', 'steps_since_boot', 'time_since_boot']]
+
+@AND_PARSERS.register(210, tables=('CALL_LOG',))    #"[{'number': '83653d9d0e8628eb301cef41df5722502f50eb94', 'type': 2, 'date': 1701967333263, 'duration': 73}]"
+def _and_210(dfe, ret, dbloc):
+    dfe = dfe.copy()
+    ll = dfe['data'].iloc[0].decode('utf-8')
+    ll = ast.literal_eval(ll)
+    #restructure the data field so that it matches the wifi data format, to use already built functions
+    dfe['data'] = json.dumps({'calls' : ll}).encode('utf-8')
+    calls_data_list = dfe.apply(extract_from_json_list, axis=1).explode().tolist()
+    calls_data = pd.json_normalize(calls_data_list)
+    calls_data.drop(['timestamp'],axis = 1, inplace=True) #drop timestamp relative to data dump
+    calls_data.rename(columns={'date' : 'timestamp', 'type':'callType', 'number' : 'callId'}, inplace = True) #keep only internal timestamp
+    calls_data['callType'] = calls_data['callType'].map({1: 'incoming', #connected ?
+                                                         2: 'outgoing', #dialing ?
+                                                         3: 'missed', 
+                                                         4: 'voicemail', 
+                                                         5: 'rejected', 
+                                                         6: 'blocked', 
+                                                         7: 'answered_externally'}) 
+    #'Disconnected', unknown, dialing, connected , incoming  
+    calls_data = calls_data.astype({"duration": float})
+    calls_data['timestamp'] = pd.to_datetime(calls_data['timestamp'], unit='ms', utc=True).dt.tz_convert('Europe/Zurich')
+    ret['CALL_LOG'] = calls_data[['timestamp', 'user_id', 'callId', 'callType', 'duration']]
+
+@AND_PARSERS.register(136, tables=('SCREEN',))
+def _and_136(dfe, ret, dbloc):
+    dfp = explode_and_json(dfe)   
+    dfp.rename(columns={
+                        'screen_state' : 'LockState'}, inplace = True )
+    dfp = dfp.astype({'LockState': float})
+    dfp = dfp.astype({'LockState': bool})
+    ret['SCREEN'] = dfp[['timestamp', 'user_id','LockState']]
+
+@AND_PARSERS.register(211, tables=('SMS',))    #"[{'address': 'a41b5e08e76671e7507e7e83e69d71305ad163e8', 'type': 1, 'date': 1699082630522, 'read': 1, 'body': 18, 'status': -1, 'thread_id': 6}]",
+def _and_211(dfe, ret, dbloc):
+    dfe = dfe.copy()
+    ll = dfe['data'].iloc[0].decode('utf-8')
+    ll = ast.literal_eval(ll)
+    #restructure the data field so that it matches the wifi data format, to use already built functions
+    dfe['data'] = json.dumps({'calls' : ll}).encode('utf-8')
+    sms_data_list = dfe.apply(extract_from_json_list, axis=1).explode().tolist()
+    sms_data = pd.json_normalize(sms_data_list)
+    sms_data.drop(['timestamp'],axis = 1, inplace=True)
+    sms_data.rename(columns={'date' : 'timestamp'}, inplace = True)
+    sms_data['timestamp'] = pd.to_datetime(sms_data['timestamp'], unit = 'ms', utc=True).dt.tz_convert('Europe/Zurich') 
+    ret['SMS'] = sms_data
+
+@AND_PARSERS.register(22, tables=('APP_USAGE',))    #timestamp	time_in_foreground	package_name	package_category	user_id
+def _and_22(dfe, ret, dbloc):
+    apps_data_list = dfe.apply(extract_from_json_list, axis=1).explode().tolist()
+    apps_df = pd.json_normalize(apps_data_list)
+    apps_df.drop(['timestamp'],axis = 1, inplace=True) #drop timestamp relative to data dump
+    #TODO for some rows, value in ms, for others some integer, eg. 89
+    #apps_df.rename(columns={'last_time_used' : 'timestamp'}, inplace = True)
+    apps_df['timestamp'] = apps_df['last_time_used'] 
+    apps_df.loc[(apps_df['timestamp'] < 1696090012000), 'timestamp'] = pd.NaT
+    apps_df['timestamp'] = pd.to_datetime(apps_df['timestamp'], unit='ms', utc=True).dt.tz_convert('Europe/Zurich')
+    ret['APP_USAGE'] = apps_df
+
+@AND_PARSERS.register(301, tables=('NOTIFICATIONS',))
+def _and_301(dfe, ret, dbloc):
+    dfp = explode_and_json(dfe, drop_timestamp=False)  
+    dfp.drop(['data'],axis = 1, inplace=True)
+    ret['NOTIFICATIONS'] = dfp
+
+#event ids feeding each table, per platform. None means the table is built from all events of a file
+IOS_EVENTS = IOS_PARSERS.table_events()
+IOS_EVENTS['DEVICE_INFO'] = None
+AND_EVENTS = AND_PARSERS.table_events()
+AND_EVENTS['DEVICE_INFO'] = None
+
+def stream_event_ids(streams, android):
+    """Returns the sorted event ids needed to build the tables in streams, or None if all events are needed"""
+    mapping = AND_EVENTS if android else IOS_EVENTS
+    ids = set()
+    for stream in streams:
+        if stream not in mapping:
+            continue
+        if mapping[stream] is None:
+            return None
+        ids.update(mapping[stream])
+    return sorted(ids)
+
 def parse_ios_df(df_ex, dbloc):
     """Take as input one pandas dataframe for ios sensing streams and 
     return a dictionary with keys corresponding to the sensing stream ids contained in the input dataframe 
@@ -32,155 +455,8 @@ def parse_ios_df(df_ex, dbloc):
     ret['DEVICE_INFO'] = ret['DEVICE_INFO'].assign(os='ios')
     #ret['DEVICE_STATE'] = pd.DataFrame()
 
-    def explode_json(df,ev_id, drop_timestamp = False):
-        if drop_timestamp: 
-            df1 = df.loc[df['event_id'] == ev_id].drop(['timestamp'],axis = 1)
-        else:
-            df1 = df.loc[df['event_id'] == ev_id]
-        try:    
-            df2 = df.loc[df['event_id'] == ev_id,'data'].apply(json.loads).apply(pd.Series)
-        except JSONDecodeError:
-            try:
-                df2 = df.loc[df['event_id'] == ev_id,'data'].apply(lambda x: x.decode('utf-8'))
-                df2 = df2.apply(lambda x: x + '}' if not x.strip().endswith('}') else x)
-                df2 = df2.apply(lambda x: x + '"}' if not x.strip().endswith('"}') else x)
-                df2 = df2.apply(json.loads).apply(pd.Series)    
-            except JSONDecodeError:
-                ex_type, ex_value, ex_traceback = sys.exc_info()
-                logger.warning(f"Malformed json for event_id {ev_id} at location: {dbloc} --- error: {ex_value}")
-                return pd.DataFrame()
-        
-        return pd.concat([df1, df2], axis = 1)
-
-    for ev_id in df_ex['event_id'].unique():
-        #ret = dict()
-        if ev_id == 151: 
-            dfp = explode_json(df_ex,ev_id)
-            dfp = dfp[['timestamp', 'user_id', 'latitude', 'longitude', 'accuracy', 'altitude']]
-            dfp['source'] = 'all'
-            try:
-                pd.concat([ret['LOCATION'],dfp])
-            except KeyError:
-                ret['LOCATION'] = dfp
-        elif ev_id == 152:
-            dfp = explode_json(df_ex,ev_id)        
-            dfp = dfp[['timestamp', 'user_id','latitude', 'longitude', 'accuracy', 'altitude']]
-            dfp['source'] = 'app'
-            try:
-                pd.concat([ret['LOCATION'],dfp])
-            except KeyError:
-                ret['LOCATION'] = dfp
-        elif ev_id == 18: 
-            dfp = explode_json(df_ex,ev_id,drop_timestamp=True)
-            if not dfp.empty: #json is correctly parsed 
-                dfp['timestamp'] = pd.to_datetime(dfp['timestamp'], unit='s', utc=True).dt.tz_convert('Europe/Zurich')
-                ret['WIFI_CONNECTED'] = dfp[['timestamp', 'user_id', 'bssid', 'ssid']]
-        elif ev_id == 181: 
-            dfp = explode_json(df_ex,ev_id,drop_timestamp=True)
-            dfp['timestamp'] = pd.to_datetime(dfp['timestamp'], unit='s', utc=True).dt.tz_convert('Europe/Zurich')        
-            #ret['DEVICE_STATE'] = pd.concat([ret['DEVICE_STATE'], dfp[['start_date', 'end_date', 'user_id', 'wifi_connected_old', 'wifi_connected', 'wifi_enabled']] ], axis = 1)
-            ret['WIFI_STATE'] = dfp[['timestamp', 'user_id', 'wifi_connected', 'wifi_enabled']].drop_duplicates()
-        elif ev_id == 19:   
-            dfp = explode_json(df_ex,ev_id,drop_timestamp=True)
-            dfp['timestamp'] = pd.to_datetime(dfp['timestamp'], unit='s', utc=True).dt.tz_convert('Europe/Zurich')
-            ret['BLUETOOTH'] = dfp[['timestamp', 'user_id', 'bt_address', 'bt_rssi', 'bt_name']].dropna(axis=0,how='all',inplace=False)
-        elif ev_id ==  21:              # "1709500823,15,9.089999999850988,0,0 #will keep the timestamp present in the 'data' field 
-            dfp = df_ex.loc[df_ex['event_id'] == ev_id, ['timestamp', 'user_id', 'data']]
-            dfp['data'] = safe_decode_utf8(dfp['data'])
-            dfp = pd.concat([dfp[['user_id','timestamp']], dfp['data'].str.split(',', expand=True)], axis=1)
-            dfp.rename(columns={'timestamp' : 'start_time', 
-                                0 : 'end_time',
-                                1 : 'step_count',
-                                2 : 'est_distance',
-                                3 : 'floors_ascended',
-                                4 : 'floors_descended'
-                                                }, inplace = True ) 
-            dfp['end_time'] = pd.to_datetime(dfp['end_time'], unit='s', utc=True).dt.tz_convert('Europe/Zurich')   
-            dfp['start_time'] = pd.to_datetime(dfp['start_time'], unit='s', utc=True).dt.tz_convert('Europe/Zurich')         
-            ret['STEPS_IOS'] = dfp
-        elif ev_id == 22:   
-            dfp = explode_json(df_ex,ev_id)
-            if not dfp.empty:
-                dfp = dfp.loc[dfp['sample_type'] == 'HKQuantityTypeIdentifierStepCount']
-                dfp['sample_quantity'] = [x[:-6] for x in dfp['sample_quantity']]
-                daytime_mapping = {
-                    'am Namittag': 'PM', 
-                    'am Vormittag' : 'AM'
-                    }
-                for key, value in daytime_mapping.items():
-                    dfp['start_date'] = dfp['start_date'].str.replace(key, value)
-                    dfp['end_date'] = dfp['end_date'].str.replace(key, value)
-
-                dfp['start_date'] = pd.to_datetime(dfp['start_date'], infer_datetime_format=True).dt.tz_convert('Europe/Zurich')
-                dfp['end_date'] = pd.to_datetime(dfp['end_date'], infer_datetime_format=True).dt.tz_convert('Europe/Zurich')
-                dfp.rename(columns={'end_date' : 'end_time',
-                                    'start_date' : 'start_time',
-                                    'sample_quantity' : 'steps'}, inplace=True)
-
-                ret['STEPS'] = dfp[['start_time', 'end_time','user_id', 'steps']]
-
-                pattern = r'name:(.*?), bundle:(.*?), version:(.*?), productType:(.*?), operatingSystemVersion:(.*?)>'
-                dfp[['name', 'bundle', 'version', 'productType', 'operatingSystemVersion']] = dfp['source'].str.extract(pattern)
-
-                #dfp['operatingSystemVersion'] = dfp['source'].str.split("""\n""", expand=True)[2].str.split("""=""", expand=True)[1].str.strip('"').str.strip(';')
-                #dfp['productType'] = dfp['source'].str.split("""\n""", expand=True)[3].str.split("""=""", expand=True)[1].str.strip('"').str.strip(';')
-                #ret['DEVICE_STATE'] = pd.concat([ret['DEVICE_STATE'], dfp[['user_id','start_date','end_date','operatingSystemVersion']]], axis = 0)
-                #ret['DEVICE_INFO'].loc[:,'productType'] = dfp['productType'].iloc[0]
-
-                dfp['user_id'] = ret['DEVICE_INFO']['user_id'][0]
-                dfp['device_id'] = ret['DEVICE_INFO']['device_id'][0]
-                dfp['os'] = ret['DEVICE_INFO']['os'][0]
-                ret['DEVICE_INFO'] = dfp[['user_id','device_id','os','name', 'bundle', 'version', 'productType', 'operatingSystemVersion','start_time']]
-        elif ev_id == 23:   
-            dfp = explode_json(df_ex,ev_id,drop_timestamp=True)   
-            dfp = dfp.astype({"duration": float})
-            dfp['timestamp'] = pd.to_datetime(dfp['timestamp'], unit='s', utc=True).dt.tz_convert('Europe/Zurich')
-            ret['CALL_LOG'] = dfp[['timestamp', 'user_id', 'callId', 'callType', 'duration']] #TODO harmonize with ios 'Disconnected', unknown, dialing, connected, incoming 
-        elif ev_id == 987:     
-            dfp = explode_json(df_ex,ev_id)
-            dfp.rename(columns={
-                                0 : 'heart_beat'}, inplace=True)
-            ret['HEART_BEAT'] = dfp[['timestamp', 'user_id','heart_beat']]  
-        elif ev_id == 16:  
-            dfp = df_ex.loc[df_ex['event_id'] == ev_id, ['user_id', 'timestamp', 'data']]
-            dfp['data'] = safe_decode_utf8(dfp['data'])
-            dfp = pd.concat([dfp[['timestamp','user_id']], dfp['data'].str.split(',', expand=True)], axis=1)
-            dfp.rename(columns={
-                                0 : 'activity',
-                                1 : 'confidence'
-                                                }, inplace = True )
-            dfp['activity'].replace(r"^ +| +$", r"", regex=True, inplace=True) #remove whitespaces at beginnning and end
-            ret['ACTIVITY'] = dfp[['timestamp','user_id','activity', 'confidence']]
-        elif ev_id == 13:  
-            dfp = explode_json(df_ex,ev_id,drop_timestamp=True)   
-            dfp = dfp.astype({"brightness": float})
-            dfp['timestamp'] = pd.to_datetime(dfp['timestamp'], unit='s', utc=True).dt.tz_convert('Europe/Zurich')
-            ret['BRIGHTNESS'] = dfp[['timestamp', 'user_id', 'brightness']]
-        
-        elif ev_id == 14:    
-            dfp = explode_json(df_ex,ev_id)   
-            dfp = dfp.astype({'LockState': float})
-            dfp = dfp.astype({'LockState': bool})
-            ret['SCREEN'] = dfp[['timestamp', 'user_id','LockState']]
-
-        elif ev_id == 111:
-            dfp = explode_json(df_ex,ev_id, drop_timestamp=True) 
-            dfp['timestamp'] = pd.to_datetime(dfp['timestamp'], unit='s', utc=True).dt.tz_convert('Europe/Zurich')
-            #dfp.rename(columns={'timestamp' : 'start_date'}, inplace = True)
-            dfp = dfp.astype({"battery_state": int})
-            dfp["battery_state"] = dfp["battery_state"].map( {2: 'charging', 
-                                                              1: 'unplugged', 
-                                                              3: 'full', 
-                                                              0: 'unknown'})
-            #ret['DEVICE_STATE'] = pd.concat([ret['DEVICE_STATE'], dfp[['user_id','start_date','battery_state']]])
-            ret['BATTERY_STATE'] = dfp[['timestamp','user_id','battery_state']]
-
-        elif ev_id == 11:    #battery
-            dfp = explode_json(df_ex,ev_id, drop_timestamp=True)   
-            dfp['timestamp'] = pd.to_datetime(dfp['timestamp'], unit='s', utc=True).dt.tz_convert('Europe/Zurich')
-            dfp = dfp.astype({'battery_left': float})
-            ret['BATTERY_LEVEL'] = dfp[['timestamp', 'user_id','battery_left']]
-        
+    IOS_PARSERS.parse(df_ex, ret, dbloc)
+
     try:
         ret['DEVICE_INFO'] = ret['DEVICE_INFO'].drop_duplicates(subset=['user_id','device_id','os','name', 'bundle', 'version', 'productType', 'operatingSystemVersion'])
     except KeyError:
@@ -192,30 +468,6 @@ def parse_ios_df(df_ex, dbloc):
         
 
 def parse_and_df(df_ex, dbloc):
-    def explode_json(df,ev_id, drop_timestamp = False):
-        if drop_timestamp: 
-            df1 = df.loc[df['event_id'] == ev_id].drop(['timestamp'],axis = 1)
-        else:
-            df1 = df.loc[df['event_id'] == ev_id]
-        df2 = df.loc[df['event_id'] == ev_id,'data'].apply(json.loads).apply(pd.Series)   
-        return pd.concat([df1, df2], axis = 1)
-
-    def extract_from_json_list(row):
-        # Convert the bytes to string
-        try:
-            json_str = safe_decode_utf8(row['data'])
-        except AttributeError:
-            json_str = row['data']
-        # Convert the string to a dictionary
-        json_dict = json.loads(json_str)
-        # Extract the data list and attach timestamp and user_id
-        key = list(json_dict.keys())[0]
-        return [
-                    {**entry, 'timestamp': row['timestamp'], 'user_id': row['user_id']} 
-                    for entry in json_dict[key]
-                ]
-
-
     df_ex['timestamp'] = pd.to_datetime(df_ex['timestamp'], unit='s', utc=True).dt.tz_convert('Europe/Zurich')
     df_ex['user_id'] = dbloc.split(os.sep)[-1].split('_')[1].split('.')[0] #get a portion of the folder name 
     ret = dict()
@@ -223,135 +475,7 @@ def parse_and_df(df_ex, dbloc):
     ret['DEVICE_INFO'] = ret['DEVICE_INFO'].assign(os='android')
     #ret['DEVICE_STATE'] = pd.DataFrame()
 
-
-    for ev_id in df_ex['event_id'].unique():
-        if ev_id == 171:    
-            dfp = explode_json(df_ex,ev_id, drop_timestamp=False)   
-            #dfp['timestamp'] = pd.to_datetime(dfp['timestamp'], unit='s', utc=True).dt.tz_convert('Europe/Zurich')
-            dfp.rename(columns={'level' : 'battery_left', "state": 'battery_state'}, inplace = True)
-            dfp = dfp.astype({'battery_left': float, "battery_state": int})
-            dfp['battery_state'] = dfp['battery_state'].map({2:'charging', 
-                                                            3 : 'unplugged',  #'discharging' is changed to match with ios 
-                                                            5 : 'full', 
-                                                            4 : 'unplugged', #'not_charging' is changed to match with ios 
-                                                            1 : 'unknown'})
-            ret['BATTERY_LEVEL'] = dfp[['timestamp', 'user_id','battery_left']]
-            ret['BATTERY_STATE'] = dfp[['timestamp', 'user_id','battery_state']]
-            
-        elif ev_id == 2: 
-            dfp = explode_json(df_ex,ev_id)
-            dfp.rename(columns={
-                                'ALTITUDE' : 'altitude',
-                                'LONGITUDE' : 'longitude',
-                                'LATITUDE' : 'latitude',
-                                'ACCURACY' : 'accuracy',
-                                'PROVIDER' : 'source',
-                                'STAELLITES' : 'satellites'
-                                                }, inplace = True )     
-            ret['LOCATION'] = dfp[['timestamp', 'user_id','latitude', 'longitude', 'accuracy', 'altitude','source']]
-            desired_columns = {'timestamp', 'user_id', 'satellites', 'SPEED', 
-                   'NEWWORKLOCATIONSOURCE', 'BEARING', 'HASBEARING', 
-                   'NEWWORKLOCATIONTYPE', 'HASSPEED', 'TRAVELSTATE'}
-            
-            present_columns = desired_columns & set(dfp.columns)
-            missing_columns = desired_columns - set(dfp.columns)
-            df_c = dfp[list(present_columns)].copy()
-            df_c[list(missing_columns)] = None
-            ret['LOCATION_MORE'] = df_c
-
-        elif ev_id == 902: #location ping one single numerical field: app tried to collect location data
-            dfp = explode_json(df_ex, ev_id)    
-            dfp.rename(columns={0 : 'ping'}, inplace = True )    
-            ret['LOCATION_PING'] = dfp[['timestamp', 'user_id','ping']]
-        elif ev_id == 91:  
-            dfp = explode_json(df_ex,ev_id,drop_timestamp=False)
-            dfp.loc[dfp['state']=='disconnected',['SSID','bssid']] = None
-            dfp['bssid'] = dfp['bssid'].astype(object)
-            dfp.loc[dfp['state']=='disconnected',['bssid']] = None
-            dfp.rename(columns={'SSID' : 'ssid'}, inplace = True)    
-            ret['WIFI_CONNECTED'] = dfp[['timestamp', 'user_id', 'bssid', 'ssid']]
-        elif ev_id == 9: 
-            wifi_data_list = df_ex.loc[df_ex['event_id'] == ev_id].apply(extract_from_json_list, axis=1).explode().tolist()
-            wifi_data = pd.json_normalize(wifi_data_list)
-            if not wifi_data.empty:
-                #wifi_data['timestamp'] = pd.to_datetime(wifi_data['timestamp'], unit='s', utc=True).dt.tz_convert('Europe/Zurich')
-                wifi_data.columns = [x.lower() for x in wifi_data.columns]
-                ret['WIFI_SCANNED'] = wifi_data.dropna(axis=0,how='all',inplace=False)
-            else:
-                par  = df_ex.loc[df_ex['event_id'] == ev_id, ['timestamp', 'user_id']].copy()
-                par[['bssid', 'ssid']] = None
-                ret['WIFI_SCANNED'] = par.dropna(axis=0,how='all',inplace=False)
-        elif ev_id == 10:   
-            devices_data_list = df_ex.loc[df_ex['event_id'] == ev_id].apply(extract_from_json_list, axis=1).explode().tolist()
-            devices_df = pd.json_normalize(devices_data_list)
-            #devices_df['timestamp'] = pd.to_datetime(devices_df['timestamp'], unit='s', utc=True).dt.tz_convert('Europe/Zurich')
-            if not devices_df.empty:
-                devices_df.rename(columns={'DEVICE' : 'bt_address', 'RSSI' : 'bt_rssi', 'CLASS' : 'bt_class'}, inplace = True)
-                ret['BLUETOOTH'] = devices_df[['timestamp', 'user_id', 'bt_address', 'bt_rssi','bt_class']].dropna(axis=0,how='all',inplace=False)
-            else:
-                par = df_ex.loc[df_ex['event_id'] == ev_id, ['timestamp','user_id']].copy()
-                par[['bt_address', 'bt_rssi','bt_class']] = None
-                ret['BLUETOOTH'] = par.dropna(axis=0,how='all',inplace=False)
-             
-        elif ev_id ==  202:      
-            dfp = explode_json(df_ex,ev_id, drop_timestamp = True)
-            dfp['start_time'] = pd.to_datetime(dfp['start_time'], unit='ms', utc=True).dt.tz_convert('Europe/Zurich') 
-            dfp['end_time'] = pd.to_datetime(dfp['end_time'], unit='ms', utc=True).dt.tz_convert('Europe/Zurich')    
-            dfp['time_since_boot'] = dfp['time_since_boot']/1000    #convert from milliseconds to seconds
-            dfp = dfp.astype({"time_since_boot": int})
-            ret['STEPS'] = dfp[['start_time', 'end_time','user_id', 'steps', 'steps_since_boot', 'time_since_boot']]
-        elif ev_id == 210:   #"[{'number': '83653d9d0e8628eb301cef41df5722502f50eb94', 'type': 2, 'date': 1701967333263, 'duration': 73}]"
-            ll = df_ex.loc[df_ex['event_id'] == 210,'data'].iloc[0].decode('utf-8')
-            ll = ast.literal_eval(ll)
-            #restructure the data field so that it matches the wifi data format, to use already built functions
-            df_ex.loc[df_ex['event_id'] == 210, 'data'] = json.dumps({'calls' : ll}).encode('utf-8')
-            calls_data_list = df_ex.loc[df_ex['event_id'] == 210].apply(extract_from_json_list, axis=1).explode().tolist()
-            calls_data = pd.json_normalize(calls_data_list)
-            calls_data.drop(['timestamp'],axis = 1, inplace=True) #drop timestamp relative to data dump
-            calls_data.rename(columns={'date' : 'timestamp', 'type':'callType', 'number' : 'callId'}, inplace = True) #keep only internal timestamp
-            calls_data['callType'] = calls_data['callType'].map({1: 'incoming', #connected ?
-                                                                 2: 'outgoing', #dialing ?
-                                                                 3: 'missed', 
-                                                                 4: 'voicemail', 
-                                                                 5: 'rejected', 
-                                                                 6: 'blocked', 
-                                                                 7: 'answered_externally'}) 
-            #'Disconnected', unknown, dialing, connected , incoming  
-            calls_data = calls_data.astype({"duration": float})
-            calls_data['timestamp'] = pd.to_datetime(calls_data['timestamp'], unit='ms', utc=True).dt.tz_convert('Europe/Zurich')
-            ret['CALL_LOG'] = calls_data[['timestamp', 'user_id', 'callId', 'callType', 'duration']] 
-        elif ev_id == 136:    
-            dfp = explode_json(df_ex,ev_id)   
-            dfp.rename(columns={
-                                'screen_state' : 'LockState'}, inplace = True )
-            dfp = dfp.astype({'LockState': float})
-            dfp = dfp.astype({'LockState': bool})
-            ret['SCREEN'] = dfp[['timestamp', 'user_id','LockState']]
-        elif ev_id == 211:     #"[{'address': 'a41b5e08e76671e7507e7e83e69d71305ad163e8', 'type': 1, 'date': 1699082630522, 'read': 1, 'body': 18, 'status': -1, 'thread_id': 6}]",
-            ll = df_ex.loc[df_ex['event_id'] == 211,'data'].iloc[0].decode('utf-8')
-            ll = ast.literal_eval(ll)
-            #restructure the data field so that it matches the wifi data format, to use already built functions
-            df_ex.loc[df_ex['event_id'] == 211, 'data'] = json.dumps({'calls' : ll}).encode('utf-8')
-            sms_data_list = df_ex.loc[df_ex['event_id'] == 211].apply(extract_from_json_list, axis=1).explode().tolist()
-            sms_data = pd.json_normalize(sms_data_list)
-            sms_data.drop(['timestamp'],axis = 1, inplace=True)
-            sms_data.rename(columns={'date' : 'timestamp'}, inplace = True)
-            sms_data['timestamp'] = pd.to_datetime(sms_data['timestamp'], unit = 'ms', utc=True).dt.tz_convert('Europe/Zurich') 
-            ret['SMS'] = sms_data
-        elif ev_id == 22:  #timestamp	time_in_foreground	package_name	package_category	user_id
-            apps_data_list = df_ex.loc[df_ex['event_id'] == 22].apply(extract_from_json_list, axis=1).explode().tolist()
-            apps_df = pd.json_normalize(apps_data_list)
-            apps_df.drop(['timestamp'],axis = 1, inplace=True) #drop timestamp relative to data dump
-            #TODO for some rows, value in ms, for others some integer, eg. 89
-            #apps_df.rename(columns={'last_time_used' : 'timestamp'}, inplace = True)
-            apps_df['timestamp'] = apps_df['last_time_used'] 
-            apps_df.loc[(apps_df['timestamp'] < 1696090012000), 'timestamp'] = pd.NaT
-            apps_df['timestamp'] = pd.to_datetime(apps_df['timestamp'], unit='ms', utc=True).dt.tz_convert('Europe/Zurich')
-            ret['APP_USAGE'] = apps_df 
-        elif ev_id == 301:  
-            dfp = explode_json(df_ex,301, drop_timestamp=False)  
-            dfp.drop(['data'],axis = 1, inplace=True)
-            ret['NOTIFICATIONS'] = dfp
+    AND_PARSERS.parse(df_ex, ret, dbloc)
         #elif ev_id == 11: 
         #    ret['SERVICES_STARTED'] = [] 
         #elif ev_id == 199:  
@@ -0,0 +1,55 @@
+#monthly RANGE partitioning of the high volume sensor tables on their time column, see MulticastDB.maintain_partitions
+import datetime as dt
+import re
+
+#   p_before    rows older than the first month, e.g. phones with a wrong clock
+#   pYYYYMM     rows of one month
+#   p_future    rows after the last month, kept empty by adding the partitions of the coming months ahead of time
+BEFORE = 'p_before'
+FUTURE = 'p_future'
+MONTHS_AHEAD = 3        #months partitioned ahead of the current one
+DEFAULT_HISTORY = 24    #months partitioned before the current one when a table is created, see DB_PARTITION_START
+
+def month_start(day):
+    return dt.date(day.year, day.month, 1)
+
+def add_months(month, n):
+    year, month0 = divmod(month.month - 1 + n, 12)
+    return dt.date(month.year + year, month0 + 1, 1)
+
+def months_between(first, last):
+    """First days of the months from first to last, both included"""
+    ret = []
+    month = month_start(first)
+    while month <= last:
+        ret.append(month)
+        month = add_months(month, 1)
+    return ret
+
+def partition_name(month):
+    return f"p{month:%Y%m}"
+
+def partition_month(name):
+    """First day of the month of a partition, None for p_before and p_future"""
+    m = re.fullmatch(r'p(\d{4})(\d{2})', name)
+    return dt.date(int(m.group(1)), int(m.group(2)), 1) if m else None
+
+def _bound(month):
+    #partitions of TIMESTAMP columns can only be defined on UNIX_TIMESTAMP, in the time zone of the server
+    return f"UNIX_TIMESTAMP('{month:%Y-%m-%d} 00:00:00')"
+
+def partition_defs(months, future = True):
+    """PARTITION definitions of months, followed by p_future if future"""
+    defs = [f"PARTITION {partition_name(m)} VALUES LESS THAN ({_bound(add_months(m, 1))})" for m in months]
+    if future:
+        defs.append(f"PARTITION {FUTURE} VALUES LESS THAN MAXVALUE")
+    return defs
+
+def partition_clause(column, first, last):
+    """PARTITION BY clause of a table partitioned by month on column, with one partition per month from first to last"""
+    defs = [f"PARTITION {BEFORE} VALUES LESS THAN ({_bound(month_start(first))})"] + partition_defs(months_between(first, last))
+    return f"PARTITION BY RANGE (UNIX_TIMESTAMP(`{column}`)) (\n" + ",\n".join(defs) + ")"
+
+def partitioned_ddl(ddl, column, first, last):
+    """CREATE TABLE statement ddl of queries_mc.TABLES, partitioned by month on column"""
+    return ddl.strip().rstrip(';') + '\n' + partition_clause(column, first, last) + ';'
@@ -0,0 +1,256 @@
+#import of phone sensing files as a pipeline of stages: reading the sqlite files (threads, disk bound),
+#parsing the events (processes, cpu bound) and writing to the database (threads, network bound)
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+from multicastps.data.ingest import file_tasks, read_task, parse_task, parse_task_logged, init_worker
+
+logger = logging.getLogger('make_db')
+
+_END = object() #end of the items of a channel
+STAGES = ['read', 'parse', 'dispatch', 'write']
+
+class StageStats:
+    """Time spent by the threads of a stage working, waiting for input (starved) and waiting for room
+    downstream (blocked), and the depth of the queue feeding the stage"""
+    def __init__(self, name, concurrency) -> None:
+        self.name = name
+        self.concurrency = concurrency
+        self.items = 0
+        self.busy = 0.0
+        self.starved = 0.0
+        self.blocked = 0.0
+        self.depth_max = 0
+        self.depth_sum = 0
+        self.depth_n = 0
+        self.lock = threading.Lock()
+
+    def add(self, items = 0, busy = 0.0, starved = 0.0, blocked = 0.0):
+        with self.lock:
+            self.items += items
+            self.busy += busy
+            self.starved += starved
+            self.blocked += blocked
+
+    def sample_depth(self, depth):
+        with self.lock:
+            self.depth_max = max(self.depth_max, depth)
+            self.depth_sum += depth
+            self.depth_n += 1
+
+class PipelineStats:
+    def __init__(self) -> None:
+        self.stages = dict()
+
+    def stage(self, name, concurrency):
+        self.stages[name] = StageStats(name, concurrency)
+        return self.stages[name]
+
+    def summary(self):
+        """Returns a pandas table with one row per stage. Seconds are summed over the threads of a stage;
+        the stage with the least starved time is the bottleneck"""
+        ret = pd.DataFrame([(s.name, s.concurrency, s.items, s.busy, s.starved, s.blocked, s.depth_max,
+                             s.depth_sum / max(s.depth_n, 1))
+                            for s in sorted(self.stages.values(), key=lambda s: STAGES.index(s.name))],
+                           columns=['stage', 'concurrency', 'items', 'busy_seconds', 'starved_seconds',
+                                    'blocked_seconds', 'queue_max', 'queue_mean'])
+        return ret.round(2)
+
+class Channel:
+    """Bounded queue between two stages. put blocks when the queue is full, which stalls the upstream stage"""
+    def __init__(self, maxsize, stats) -> None:
+        self.queue = queue.Queue(maxsize)
+        self.stats = stats  #stats of the consuming stage
+
+    def put(self, item, producer = None):
+        start = time.perf_counter()
+        self.queue.put(item)
+        if producer is not None:
+            producer.add(blocked=time.perf_counter() - start)
+        self.stats.sample_depth(self.queue.qsize())
+
+    def get(self):
+        start = time.perf_counter()
+        item = self.queue.get()
+        self.stats.add(starved=time.perf_counter() - start)
+        return item
+
+    def __iter__(self):
+        #items until the end marker. Time spent by the consumer between two items is counted as busy
+        while True:
+            item = self.get()
+            if item is _END:
+                return
+            start = time.perf_counter()
+            yield item
+            self.stats.add(items=1, busy=time.perf_counter() - start)
+
+class _ThreadRecords(logging.Filter):
+    """Keeps the records logged by a thread while it parses a chunk instead of emitting them, so that the parser threads
+    replay them in file order as the worker processes do, see ingest.parse_task_logged"""
+    def __init__(self) -> None:
+        super().__init__()
+        self.local = threading.local()
+
+    def parse(self, res):
+        #parse_task(res) and the records logged meanwhile
+        self.local.records = []
+        try:
+            return parse_task(res), self.local.records
+        finally:
+            self.local.records = None
+
+    def filter(self, record):
+        records = getattr(self.local, 'records', None)
+        if records is None:
+            return True
+        records.append(record)
+        return False
+
+def _run_stage(n_threads, target, on_end, on_error):
+    #start n_threads threads running target; the last one to finish calls on_end, a thread raising calls on_error
+    remaining = [n_threads]
+    lock = threading.Lock()
+    def run():
+        try:
+            target()
+        except BaseException as e:
+            on_error(e)
+        finally:
+            with lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last:
+                on_end()
+    threads = [threading.Thread(target=run, daemon=True) for _ in range(n_threads)]
+    for t in threads:
+        t.start()
+    return threads
+
+def pipeline_results(paths, budget, streams = None, readers = 1, workers = 1, queue_size = None, stats = None):
+    """Yield (dbloc, status, df_dict, seconds) for each chunk of each file, in the order of paths, like run_task.
+    Chunks are read by readers threads and parsed by workers processes (in a thread if workers is 1), while the
+    caller writes the previous results. Channels between the stages hold at most queue_size chunks, and at most
+    readers + workers + 2*queue_size chunks are in flight, so the memory budget is shared among them"""
+    stats = stats if stats is not None else PipelineStats()
+    queue_size = queue_size or max(2, workers)
+    window = readers + workers + 2*queue_size
+    read_stats, parse_stats = stats.stage('read', readers), stats.stage('parse', workers)
+    write_stats = stats.stages.get('write') or stats.stage('write', 1)
+    if write_stats.concurrency > 1: #the caller hands the results over to writer threads, see run_writers
+        write_stats = stats.stage('dispatch', 1)
+    tasks = enumerate(file_tasks(paths, budget // (window + 1), streams))
+    tasks_lock = threading.Lock()
+    slots = threading.Semaphore(window)
+    stop = threading.Event()
+    to_parse = Channel(queue_size, parse_stats)
+    results = Channel(queue_size, write_stats)
+    executor = ProcessPoolExecutor(max_workers=workers, initializer=init_worker) if workers > 1 else None
+    thread_records = _ThreadRecords()
+    logger.addFilter(thread_records)
+
+    def reader():
+        while True:
+            start = time.perf_counter()
+            slots.acquire() #wait until the writer consumed a chunk if window chunks are in flight
+            read_stats.add(blocked=time.perf_counter() - start)
+            with tasks_lock:
+                item = None if stop.is_set() else next(tasks, None)
+            if item is None:
+                slots.release()
+                return
+            seq, task = item
+            start = time.perf_counter()
+            res = read_task(task)
+            read_stats.add(items=1, busy=time.perf_counter() - start)
+            to_parse.put((seq, res), read_stats)
+
+    def parser():
+        while True:
+            item = to_parse.get()
+            if item is _END:
+                return
+            seq, res = item
+            start = time.perf_counter()
+            if executor is None:
+                parsed, records = thread_records.parse(res)
+            else:
+                parsed, records = executor.submit(parse_task_logged, res).result()
+            parse_stats.add(items=1, busy=time.perf_counter() - start)
+            results.put((seq, parsed, records), parse_stats)
+
+    def end_readers():
+        for _ in range(workers):
+            to_parse.put(_END)
+
+    _run_stage(readers, reader, end_readers, results.put) #exceptions are raised by the consumer of results
+    _run_stage(workers, parser, lambda: results.put(_END), results.put)
+    try:
+        pending = dict()
+        next_seq = 0
+        while True:
+            while next_seq in pending:
+                parsed, records = pending.pop(next_seq)
+                for record in records: #logs of worker processes, replayed in file order
+                    logger.handle(record)
+                start = time.perf_counter()
+                yield parsed
+                write_stats.add(items=1, busy=time.perf_counter() - start)
+                next_seq += 1
+                slots.release()
+            item = results.get()
+            if item is _END:
+                break
+            if isinstance(item, BaseException):
+                raise item
+            seq, parsed, records = item
+            pending[seq] = (parsed, records)
+    finally:
+        stop.set()
+        logger.removeFilter(thread_records)
+        for _ in range(readers):
+            slots.release()
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+def run_writers(results, writers, write, queue_size = 2, stats = None):
+    """Upload results of pipeline_results with writers threads. write is called once per thread with an iterator over the
+    chunks of the files assigned to it; all chunks of a file go to the same thread, in order. Files go to the thread with 
+    the least chunks waiting, so the uploads of several writers are interleaved. The files still waiting for a thread
+    that failed are logged and left out. With a single writer, write is called in the calling thread"""
+    if writers <= 1:
+        write(results)
+        return
+    stats = stats if stats is not None else PipelineStats()
+    write_stats = stats.stages['write']
+    channels = [Channel(queue_size, write_stats) for _ in range(writers)]
+    errors = []
+    threads = []
+    for channel in channels:
+        def on_error(e, channel=channel):
+            errors.append(e)
+            drained = set()
+            for res in channel: #keep the dispatcher from blocking on this channel until it stops
+                if res[0] not in drained:
+                    drained.add(res[0])
+                    logger.warning(f"Not uploaded after an error of its writer, processed again by the next run: {res[0]}")
+        threads += _run_stage(1, lambda channel=channel: write(iter(channel)), lambda: None, on_error)
+    current, channel = None, None
+    try:
+        for res in results:
+            if res[0] != current: #new file, to the writer with the least chunks waiting
+                current = res[0]
+                channel = min(channels, key=lambda c: c.queue.qsize())
+            channel.put(res)
+            if errors:
+                raise errors[0]
+    finally:
+        for c in channels:
+            c.put(_END)
+        for t in threads:
+            t.join()
+    if errors:
+        raise errors[0]
@@ -1,14 +1,54 @@
+def row_hash(*columns):
+    """Key part of an expression on columns, equal for rows with equal values in columns, NULL included (NULL and ''
+    are equal). Used for the value columns of the natural keys, so that two events of the same second differing in
+    value are both kept, and for nullable columns, which do not collide on NULL in a key"""
+    values = ', '.join(f"COALESCE(CAST(`{c}` AS CHAR), '')" for c in columns)
+    return f"(CRC32(CONCAT_WS('|', {values})))"
+
+#parts identifying a record of each sensor stream, the `natural_key` unique index of the table: columns, or expressions
+#in parentheses. Uploading a record again does not duplicate it, see MulticastDB.insert_pd. DEVICE_INFO has no key, it
+#is deduplicated by the parsers. TIMESTAMP columns have a precision of one second, so the values of the events are part
+#of the key through a row_hash. Two distinct events of a participant in the same second with the same CRC32 of their
+#values (1 in 2**32) keep only the first
+NATURAL_KEYS = {
+        'LOCATION' : ('USER_ID', 'TIMESTAMP', row_hash('LATITUDE', 'LONGITUDE', 'ACCURACY', 'ALTITUDE', 'SOURCE')),
+        'LOCATION_MORE' : ('USER_ID', 'TIMESTAMP', row_hash('SATELLITES', 'SPEED', 'NEWWORKLOCATIONSOURCE', 'BEARING',
+                                                            'HASBEARING', 'NEWWORKLOCATIONTYPE', 'HASSPEED', 'TRAVELSTATE')),
+        'LOCATION_PING' : ('USER_ID', 'TIMESTAMP', row_hash('PING')),
+        'WIFI_CONNECTED' : ('USER_ID', 'TIMESTAMP', row_hash('BSSID')),
+        'WIFI_STATE' : ('USER_ID', 'TIMESTAMP', row_hash('WIFI_CONNECTED', 'WIFI_ENABLED')),
+        'WIFI_SCANNED' : ('USER_ID', 'TIMESTAMP', row_hash('BSSID')),
+        'BLUETOOTH' : ('USER_ID', 'TIMESTAMP', row_hash('BT_ADDRESS')),
+        'STEPS_IOS' : ('USER_ID', 'START_TIME', 'END_TIME'),
+        'STEPS' : ('USER_ID', 'START_TIME', 'END_TIME'),
+        'CALL_LOG' : ('USER_ID', 'TIMESTAMP', row_hash('CALLID')),
+        'ACTIVITY' : ('USER_ID', 'TIMESTAMP', row_hash('ACTIVITY')),
+        'BRIGHTNESS' : ('USER_ID', 'TIMESTAMP', row_hash('BRIGHTNESS')),
+        'SCREEN' : ('USER_ID', 'TIMESTAMP', row_hash('LOCKSTATE')),
+        'BATTERY_STATE' : ('USER_ID', 'TIMESTAMP', row_hash('BATTERY_STATE')),
+        'BATTERY_LEVEL' : ('USER_ID', 'TIMESTAMP', row_hash('BATTERY_LEFT')),
+        'SMS' : ('USER_ID', 'TIMESTAMP', row_hash('ADDRESS', 'TYPE')),
+        'APP_USAGE' : ('USER_ID', 'TIMESTAMP', row_hash('PACKAGE_NAME')),
+        }
+
+def natural_key(table):
+    """UNIQUE KEY clause of the natural key of table, for its CREATE TABLE statement"""
+    parts = ', '.join(k if k.startswith('(') else f'`{k}`' for k in NATURAL_KEYS[table])
+    return f"UNIQUE KEY `natural_key` ({parts})"
+
 TABLES = {
-        'LOCATION' : """CREATE TABLE `LOCATION` (
+        'LOCATION' : f"""CREATE TABLE `LOCATION` (
                     `TIMESTAMP` TIMESTAMP NOT NULL,
                     `USER_ID` varchar(40) NOT NULL,
                     `LATITUDE` decimal(9,6) ,
                     `LONGITUDE` decimal(9,6) ,
                     `ACCURACY` float ,  
                     `ALTITUDE` float ,
-                    `SOURCE` varchar(50) 
+                    `SOURCE` varchar(50),
+                    `DAY` DATE AS (DATE(`TIMESTAMP`)) STORED,
+                    {natural_key('LOCATION')}
                     ) ENGINE=InnoDB;""",  
-        'LOCATION_MORE': """CREATE TABLE `LOCATION_MORE` (
+        'LOCATION_MORE': f"""CREATE TABLE `LOCATION_MORE` (
                         `TIMESTAMP` TIMESTAMP NOT NULL,
                         `USER_ID` varchar(40) NOT NULL,
                         `SATELLITES` smallint,
@@ -18,60 +58,76 @@ TABLES = {
                         `HASBEARING` boolean ,
                         `NEWWORKLOCATIONTYPE` varchar(255) ,
                         `HASSPEED` boolean ,
-                        `TRAVELSTATE` varchar(255)
+                        `TRAVELSTATE` varchar(255),
+                        `DAY` DATE AS (DATE(`TIMESTAMP`)) STORED,
+                        {natural_key('LOCATION_MORE')}
                         ) ENGINE=InnoDB;""",
-        'LOCATION_PING' : """CREATE TABLE `LOCATION_PING` (
+        'LOCATION_PING' : f"""CREATE TABLE `LOCATION_PING` (
                         `TIMESTAMP` TIMESTAMP NOT NULL,
                         `USER_ID` varchar(40) NOT NULL,
-                        `PING` boolean
+                        `PING` boolean,
+                        `DAY` DATE AS (DATE(`TIMESTAMP`)) STORED,
+                        {natural_key('LOCATION_PING')}
                          ) ENGINE=InnoDB;""",   
-        'WIFI_CONNECTED' : """CREATE TABLE `WIFI_CONNECTED` (
+        'WIFI_CONNECTED' : f"""CREATE TABLE `WIFI_CONNECTED` (
                         `TIMESTAMP` TIMESTAMP NOT NULL,
                         `USER_ID` varchar(40) NOT NULL,
                         `BSSID` varchar(250) ,
-                        `SSID` varchar(250) 
+                        `SSID` varchar(250),
+                        `DAY` DATE AS (DATE(`TIMESTAMP`)) STORED,
+                        {natural_key('WIFI_CONNECTED')}
                         ) ENGINE=InnoDB;""",                
-        'WIFI_STATE' : """CREATE TABLE `WIFI_STATE` (
+        'WIFI_STATE' : f"""CREATE TABLE `WIFI_STATE` (
                         `TIMESTAMP` TIMESTAMP NOT NULL,
                         `USER_ID` varchar(40) NOT NULL,
                         `WIFI_CONNECTED` boolean ,
-                        `WIFI_ENABLED` boolean
+                        `WIFI_ENABLED` boolean,
+                        `DAY` DATE AS (DATE(`TIMESTAMP`)) STORED,
+                        {natural_key('WIFI_STATE')}
                         ) ENGINE=InnoDB;""",     
-        'WIFI_SCANNED' : """CREATE TABLE `WIFI_SCANNED` (
+        'WIFI_SCANNED' : f"""CREATE TABLE `WIFI_SCANNED` (
                         `TIMESTAMP` TIMESTAMP NOT NULL,
                         `USER_ID` varchar(40) NOT NULL,
                         `BSSID` varchar(250) ,
                         `SSID` varchar(250) ,
                         `FREQUENCY` float ,
                         `CAPABILITY` varchar(250) ,
-                        `LEVEL` float 
+                        `LEVEL` float,
+                        `DAY` DATE AS (DATE(`TIMESTAMP`)) STORED,
+                        {natural_key('WIFI_SCANNED')}
                         ) ENGINE=InnoDB;""",           
-        'BLUETOOTH' : """CREATE TABLE `BLUETOOTH` (
+        'BLUETOOTH' : f"""CREATE TABLE `BLUETOOTH` (
                                     `TIMESTAMP` TIMESTAMP NOT NULL,
                                     `USER_ID` varchar(40) NOT NULL,
                                     `BT_ADDRESS` varchar(150),
                                     `BT_RSSI` mediumint,
                                     `BT_NAME` varchar(150),
-                                    `BT_CLASS` varchar(20)
+                                    `BT_CLASS` varchar(20),
+                                    `DAY` DATE AS (DATE(`TIMESTAMP`)) STORED,
+                                    {natural_key('BLUETOOTH')}
                                     ) ENGINE=InnoDB;""",                                    
-        'STEPS_IOS': """CREATE TABLE `STEPS_IOS` (
+        'STEPS_IOS': f"""CREATE TABLE `STEPS_IOS` (
                                     `USER_ID` varchar(40) NOT NULL,
                                     `START_TIME` TIMESTAMP NOT NULL, 
                                     `END_TIME` TIMESTAMP NOT NULL, 
                                     `STEP_COUNT` mediumint,
                                     `EST_DISTANCE` float,
                                     `FLOORS_ASCENDED` float,
-                                    `FLOORS_DESCENDED` float
+                                    `FLOORS_DESCENDED` float,
+                                    `DAY` DATE AS (DATE(`START_TIME`)) STORED,
+                                    {natural_key('STEPS_IOS')}
                                     ) ENGINE=InnoDB;""",
-        'STEPS' : """CREATE TABLE `STEPS` (
+        'STEPS' : f"""CREATE TABLE `STEPS` (
                                     `START_TIME` TIMESTAMP NOT NULL, 
                                     `END_TIME` TIMESTAMP NOT NULL, 
                                     `USER_ID` varchar(40) NOT NULL,
                                     `STEPS` mediumint,
                                     `STEPS_SINCE_BOOT` mediumint,
-                                    `TIME_SINCE_BOOT` int unsigned
+                                    `TIME_SINCE_BOOT` int unsigned,
+                                    `DAY` DATE AS (DATE(`START_TIME`)) STORED,
+                                    {natural_key('STEPS')}
                                     ) ENGINE=InnoDB;""",
-        'DEVICE_INFO' : """CREATE TABLE `DEVICE_INFO` (
+        'DEVICE_INFO' : f"""CREATE TABLE `DEVICE_INFO` (
                                         `USER_ID` varchar(40) NOT NULL,
                                         `DEVICE_ID` varchar(40) DEFAULT NULL,
                                         `OS` varchar(10),
@@ -82,40 +138,52 @@ TABLES = {
                                         `OPERATINGSYSTEMVERSION` varchar(50),
                                         `START_TIME` TIMESTAMP
                                     ) ENGINE=InnoDB;""",  
-        'CALL_LOG' : """CREATE TABLE `CALL_LOG` (
+        'CALL_LOG' : f"""CREATE TABLE `CALL_LOG` (
                             `TIMESTAMP` TIMESTAMP NOT NULL,
                             `USER_ID` varchar(40) NOT NULL,
                             `CALLID` varchar(150), 
                             `CALLTYPE`  varchar(30),
-                            `DURATION` float
+                            `DURATION` float,
+                            `DAY` DATE AS (DATE(`TIMESTAMP`)) STORED,
+                            {natural_key('CALL_LOG')}
                             ) ENGINE=InnoDB;""",  
-        'ACTIVITY' : """CREATE TABLE `ACTIVITY` (
+        'ACTIVITY' : f"""CREATE TABLE `ACTIVITY` (
                             `TIMESTAMP` TIMESTAMP NOT NULL,
                             `USER_ID` varchar(40) NOT NULL,
                             `ACTIVITY` varchar(50) ,
-                            `CONFIDENCE` varchar(100) 
+                            `CONFIDENCE` varchar(100),
+                            `DAY` DATE AS (DATE(`TIMESTAMP`)) STORED,
+                            {natural_key('ACTIVITY')}
                             ) ENGINE=InnoDB;""",    
-        'BRIGHTNESS' : """CREATE TABLE `BRIGHTNESS` (
+        'BRIGHTNESS' : f"""CREATE TABLE `BRIGHTNESS` (
                             `TIMESTAMP` TIMESTAMP NOT NULL,
                             `USER_ID` varchar(40) NOT NULL,
-                            `BRIGHTNESS` float
+                            `BRIGHTNESS` float,
+                            `DAY` DATE AS (DATE(`TIMESTAMP`)) STORED,
+                            {natural_key('BRIGHTNESS')}
                             ) ENGINE=InnoDB;""",       
-        'SCREEN' : """CREATE TABLE `SCREEN` (
+        'SCREEN' : f"""CREATE TABLE `SCREEN` (
                             `TIMESTAMP` TIMESTAMP NOT NULL,
                             `USER_ID` varchar(40) NOT NULL,
-                            `LOCKSTATE` boolean 
+                            `LOCKSTATE` boolean,
+                            `DAY` DATE AS (DATE(`TIMESTAMP`)) STORED,
+                            {natural_key('SCREEN')}
                             ) ENGINE=InnoDB;""", 
-        'BATTERY_STATE' : """CREATE TABLE `BATTERY_STATE` (
+        'BATTERY_STATE' : f"""CREATE TABLE `BATTERY_STATE` (
                             `TIMESTAMP` TIMESTAMP NOT NULL,
                             `USER_ID` varchar(40) NOT NULL,
-                            `BATTERY_STATE` varchar(20) 
+                            `BATTERY_STATE` varchar(20),
+                            `DAY` DATE AS (DATE(`TIMESTAMP`)) STORED,
+                            {natural_key('BATTERY_STATE')}
                             ) ENGINE=InnoDB;""",    
-        'BATTERY_LEVEL' : """CREATE TABLE `BATTERY_LEVEL` (
+        'BATTERY_LEVEL' : f"""CREATE TABLE `BATTERY_LEVEL` (
                             `TIMESTAMP` TIMESTAMP NOT NULL,
                             `USER_ID` varchar(40) NOT NULL,
-                            `BATTERY_LEFT` tinyint 
+                            `BATTERY_LEFT` tinyint,
+                            `DAY` DATE AS (DATE(`TIMESTAMP`)) STORED,
+                            {natural_key('BATTERY_LEVEL')}
                             ) ENGINE=InnoDB;""" ,
-        'SMS' :  """CREATE TABLE `SMS` (
+        'SMS' :  f"""CREATE TABLE `SMS` (
                     `USER_ID` varchar(40) NOT NULL,
                     `ADDRESS` varchar(255),
                     `TYPE` tinyint,
@@ -123,15 +191,111 @@ TABLES = {
                     `READ` tinyint,
                     `BODY` smallint,
                     `STATUS` tinyint,
-                    `THREAD_ID` smallint
+                    `THREAD_ID` smallint,
+                    `DAY` DATE AS (DATE(`TIMESTAMP`)) STORED,
+                    {natural_key('SMS')}
                     ) ENGINE=InnoDB;""",
-        'APP_USAGE' : """CREATE TABLE `APP_USAGE` (
+        'APP_USAGE' : f"""CREATE TABLE `APP_USAGE` (
                         `LAST_TIME_USED` BIGINT(20) NULL,
                         `TIME_IN_FOREGROUND` BIGINT(20) NULL,
                         `PACKAGE_NAME` TEXT NULL,
                         `PACKAGE_CATEGORY` TEXT NULL,
                         `USER_ID` varchar(40) NOT NULL,
-                        `TIMESTAMP` TIMESTAMP NOT NULL
+                        `TIMESTAMP` TIMESTAMP NOT NULL,
+                        `DAY` DATE AS (DATE(`TIMESTAMP`)) STORED,
+                        {natural_key('APP_USAGE')}
                     )  ENGINE=InnoDB;"""                           
              
-        }
\ No newline at end of file
+        }
+
+#column with the time of the events of each sensor table, and the day of that time in the generated column `DAY`
+TIME_COLUMNS = {table: 'START_TIME' if table in ('STEPS', 'STEPS_IOS', 'DEVICE_INFO') else 'TIMESTAMP' for table in TABLES}
+DAY_TABLES = [table for table in TABLES if table != 'DEVICE_INFO']
+#participant and time columns of the tables, used to filter exports and streams
+FILTER_COLUMNS = {table: ('USER_ID', TIME_COLUMNS[table]) for table in TABLES}
+FILTER_COLUMNS['EMA'] = ('participantCode', 'datestamp')
+
+#tables partitioned by month on their time column, see partitions.py. Their unique keys include the time column, 
+#as required by MySQL for partitioned tables
+PARTITIONED_TABLES = ['LOCATION', 'WIFI_SCANNED', 'BLUETOOTH', 'BATTERY_LEVEL', 'APP_USAGE']
+
+#secondary indexes of the sensor tables, name -> columns. Lookups by participant and time use the natural_key, which 
+#starts with (USER_ID, TIMESTAMP/START_TIME); per day grouping uses user_day. These are created once the tables are 
+#loaded, see MulticastDB.create_indexes, the natural_key is always present as it deduplicates the inserts
+INDEXES = {table: {'user_day': ('USER_ID', 'DAY')} for table in DAY_TABLES}
+INDEXES['DEVICE_INFO'] = {'user_time': ('USER_ID', 'START_TIME')}
+
+#bookkeeping of the phone sensing files copied to the database, see ledger.py
+LEDGER_TABLES = {
+        'INGEST_LEDGER' : """CREATE TABLE IF NOT EXISTS `INGEST_LEDGER` (
+                            `PATH` varchar(512) NOT NULL,
+                            `SIZE` bigint NOT NULL,
+                            `MTIME` double NOT NULL,
+                            `HASH` char(40) NOT NULL,
+                            `STATUS` varchar(20) NOT NULL,
+                            `N_ROWS` bigint,
+                            `PARSE_SECONDS` float,
+                            `INGESTED_AT` TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                            PRIMARY KEY (`PATH`)
+                            ) ENGINE=InnoDB;""",
+        'INGEST_LEDGER_STREAMS' : """CREATE TABLE IF NOT EXISTS `INGEST_LEDGER_STREAMS` (
+                            `PATH` varchar(512) NOT NULL,
+                            `STREAM` varchar(40) NOT NULL,
+                            `STATUS` varchar(20) NOT NULL,
+                            `N_ROWS` bigint,
+                            PRIMARY KEY (`PATH`, `STREAM`)
+                            ) ENGINE=InnoDB;"""
+        }
+
+#rows, first and last event per participant, sensor stream and day, recounted by MulticastDB.insert_pd for the days 
+#of each inserted dataframe. HOURS has bit h set if there are events in hour h of the day, UPDATED_AT is the time of the
+#recount. Read by the coverage methods of MulticastDB with summary=True, through coverage.CoverageIndex
+SUMMARY_TABLES = {
+        'DAILY_COVERAGE' : """CREATE TABLE IF NOT EXISTS `DAILY_COVERAGE` (
+                            `USER_ID` varchar(40) NOT NULL,
+                            `STREAM` varchar(40) NOT NULL,
+                            `DAY` DATE NOT NULL,
+                            `N_ROWS` bigint NOT NULL,
+                            `FIRST_TS` TIMESTAMP NULL,
+                            `LAST_TS` TIMESTAMP NULL,
+                            `HOURS` int NOT NULL DEFAULT 0,
+                            `UPDATED_AT` TIMESTAMP NULL,
+                            PRIMARY KEY (`USER_ID`, `STREAM`, `DAY`),
+                            KEY `stream_day` (`STREAM`, `USER_ID`, `DAY`)
+                            ) ENGINE=InnoDB;"""
+        }
+#streams whose days count as days with passive sensing, see MulticastDB.get_no_ps_dates
+PS_DAY_STREAMS = ['LOCATION', 'ACTIVITY', 'WIFI_CONNECTED', 'BLUETOOTH', 'SCREEN']
+
+#participant codes, harmonized codes and study windows, refreshed incrementally by MulticastDB.update_overview.
+#OVERVIEW_WATERMARKS holds the row count, checksum and latest time of the tables PartOverview is derived from when 
+#it was last refreshed
+OVERVIEW_TABLES = {
+        'PartOverview' : """CREATE TABLE IF NOT EXISTS `PartOverview` (
+                            part_code VARCHAR(15),
+                            part_code_harm VARCHAR(10),
+                            user_id VARCHAR(40),
+                            is_participant BOOLEAN,
+                            start_date DATE,
+                            end_date DATE,
+                            UNIQUE KEY `overview_key` (user_id, part_code)
+                            ) ENGINE=InnoDB;""",
+        'OVERVIEW_WATERMARKS' : """CREATE TABLE IF NOT EXISTS `OVERVIEW_WATERMARKS` (
+                            `SOURCE` varchar(40) NOT NULL,
+                            `N_ROWS` bigint NOT NULL,
+                            `CHECKSUM` bigint unsigned NOT NULL,
+                            `MAX_TIME` datetime NULL,
+                            `REFRESHED_AT` TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+                            PRIMARY KEY (`SOURCE`)
+                            ) ENGINE=InnoDB;"""
+        }
+
+#migrations applied to the database, see schema.py
+SCHEMA_TABLES = {
+        'SCHEMA_VERSION' : """CREATE TABLE IF NOT EXISTS `SCHEMA_VERSION` (
+                            `VERSION` int NOT NULL,
+                            `DESCRIPTION` varchar(255),
+                            `APPLIED_AT` TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                            PRIMARY KEY (`VERSION`)
+                            ) ENGINE=InnoDB;"""
+        }
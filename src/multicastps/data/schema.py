@@ -0,0 +1,220 @@
+#versioned schema of the MulticastDB: tables are created by numbered migrations, applied once per database and recorded in
+#SCHEMA_VERSION, and their metadata is reflected on first use
+import logging
+import warnings
+import datetime as dt
+from sqlalchemy import MetaData, Table, inspect, text
+from sqlalchemy.exc import SAWarning
+from multicastps.data.queries_mc import (TABLES, SUMMARY_TABLES, LEDGER_TABLES, OVERVIEW_TABLES, SCHEMA_TABLES,
+                                        PARTITIONED_TABLES, TIME_COLUMNS, DAY_TABLES, NATURAL_KEYS, INDEXES, natural_key)
+from multicastps.data.partitions import MONTHS_AHEAD, month_start, add_months, partitioned_ddl
+from multicastps.data.backends import EMBEDDED, index_statements
+from multicastps.data.bulk_load import key_parts
+
+logger = logging.getLogger(__name__)
+
+def _sensor_tables(schema, connection):
+    #tables of queries_mc.TABLES, partitioned by month on MySQL, with their natural key index on embedded databases
+    created = []
+    for name, ddl in TABLES.items():
+        if name in schema.names:
+            continue
+        if name in PARTITIONED_TABLES and schema.backend not in EMBEDDED:
+            ddl = partitioned_ddl(ddl, TIME_COLUMNS[name], schema.partition_start,
+                                  add_months(month_start(dt.date.today()), MONTHS_AHEAD))
+        connection.execute(text(ddl))
+        if schema.backend in EMBEDDED:
+            for index in index_statements(ddl):
+                connection.execute(text(index))
+        created.append(name)
+    return created
+
+def natural_key_current(backend, connection, table):
+    """Whether table has the natural_key of queries_mc.NATURAL_KEYS. On MySQL the parts of the index are compared, 
+    expressions have no column. Embedded databases declare it as the unique index <table>_natural_key, their tables 
+    used to hold an inline UNIQUE constraint on the columns of the key"""
+    if backend == 'sqlite':
+        return bool(connection.execute(text("SELECT COUNT(*) FROM sqlite_master WHERE type = 'index' AND name = :name"),
+                                       {'name': f"{table}_natural_key"}).scalar())
+    if backend == 'duckdb':
+        return bool(connection.execute(text("SELECT COUNT(*) FROM duckdb_indexes() WHERE index_name = :name"),
+                                       {'name': f"{table}_natural_key"}).scalar())
+    parts = connection.execute(text("""SELECT column_name FROM information_schema.statistics 
+                                      WHERE table_schema = DATABASE() AND table_name = :table AND index_name = 'natural_key' 
+                                      ORDER BY seq_in_index"""), {'table': table}).scalars().all()
+    declared = [None if k.startswith('(') else k.split('(')[0].upper() for k in NATURAL_KEYS[table]]
+    return [p.upper() if p else None for p in parts] == declared
+
+def rebuild_natural_key(backend, connection, table):
+    """Copy table to a table with the natural_key of queries_mc.NATURAL_KEYS that replaces it, keeping the first of the 
+    rows with the same key. Needs time and disk space proportional to the size of the table. MySQL keeps the partitions 
+    and indexes of the table, embedded databases get the indexes of queries_mc.INDEXES. Returns the rows kept"""
+    #DAY is the only generated column of the sensor tables
+    stored = ', '.join(f"`{c}`" for c in connection.execute(text(f"SELECT * FROM `{table}` WHERE 1 = 0")).keys()
+                       if c.upper() != 'DAY')
+    if backend not in EMBEDDED:
+        connection.execute(text(f"DROP TABLE IF EXISTS `{table}_dedup`"))
+        connection.execute(text(f"CREATE TABLE `{table}_dedup` LIKE `{table}`"))
+        drop = "DROP INDEX `natural_key`, " if 'natural_key' in _index_names(connection, f"{table}_dedup") else ""
+        connection.execute(text(f"ALTER TABLE `{table}_dedup` {drop}ADD {natural_key(table)}"))
+        n = connection.execute(text(f"INSERT IGNORE INTO `{table}_dedup` ({stored}) SELECT {stored} FROM `{table}`")).rowcount
+        connection.execute(text(f"RENAME TABLE `{table}` TO `{table}_old`, `{table}_dedup` TO `{table}`"))
+        connection.execute(text(f"DROP TABLE `{table}_old`"))
+        return n
+    #DuckDB can't rename a table with indexes, nor skip the duplicates on columns holding NULL with INSERT OR IGNORE
+    connection.execute(text(f"DROP TABLE IF EXISTS `{table}_old`"))
+    connection.execute(text(f"CREATE TABLE `{table}_old` AS SELECT * FROM `{table}`"))
+    connection.execute(text(f"DROP TABLE `{table}`"))
+    connection.execute(text(TABLES[table]))
+    for index in index_statements(TABLES[table]):
+        connection.execute(text(index))
+    for name, cols in INDEXES.get(table, {}).items():
+        connection.execute(text(f"CREATE INDEX IF NOT EXISTS `{table}_{name}` ON `{table}` (" + ', '.join(f"`{c}`" for c in cols) + ")"))
+    n = connection.execute(text(f"""INSERT INTO `{table}` ({stored}) SELECT {stored} FROM (
+                                   SELECT *, ROW_NUMBER() OVER (PARTITION BY {', '.join(key_parts(NATURAL_KEYS[table]))} ORDER BY rowid) AS _n
+                                   FROM `{table}_old`) WHERE _n = 1""")).rowcount
+    connection.execute(text(f"DROP TABLE `{table}_old`"))
+    return n
+
+def _index_names(connection, table):
+    return set(connection.execute(text("""SELECT DISTINCT index_name FROM information_schema.statistics 
+                                          WHERE table_schema = DATABASE() AND table_name = :table"""), {'table': table}).scalars())
+
+def _create(tables):
+    #migration running the CREATE TABLE IF NOT EXISTS statements of tables, and the indexes they declare on embedded databases
+    def migration(schema, connection):
+        for ddl in tables.values():
+            connection.execute(text(ddl))
+            if schema.backend in EMBEDDED:
+                for index in index_statements(ddl):
+                    connection.execute(text(index))
+        return list(tables)
+    return migration
+
+def _coverage_hours(schema, connection):
+    #hours of each day of DAILY_COVERAGE and time of its recount, see coverage.py. Days counted before have no hours
+    columns = {c.upper() for c in connection.execute(text("SELECT * FROM `DAILY_COVERAGE` WHERE 1 = 0")).keys()}
+    if 'HOURS' not in columns:
+        connection.execute(text("ALTER TABLE `DAILY_COVERAGE` ADD COLUMN `HOURS` int NOT NULL DEFAULT 0"))
+    if 'UPDATED_AT' not in columns:
+        connection.execute(text("ALTER TABLE `DAILY_COVERAGE` ADD COLUMN `UPDATED_AT` TIMESTAMP NULL"))
+        if connection.execute(text("SELECT COUNT(*) FROM `DAILY_COVERAGE`")).scalar():
+            logger.warning("Hours of the days already in DAILY_COVERAGE are unknown, run make_db.py --rebuild-coverage")
+    return []
+
+def _day_columns(schema, connection):
+    #user_day index (queries_mc.INDEXES) of the sensor tables created before it was declared, which the per-day coverage
+    #queries group on. Embedded databases always had the DAY column. On MySQL adding the column rebuilds the table, it is
+    #left to MulticastDB.add_day_columns (make_db.py --mode maintain), the coverage queries use DATE(<time>) until then
+    missing = []
+    for table in DAY_TABLES:
+        if table not in schema.names:
+            continue
+        if schema.backend in EMBEDDED:
+            for name, cols in INDEXES[table].items():
+                connection.execute(text(f"CREATE INDEX IF NOT EXISTS `{table}_{name}` ON `{table}` (" 
+                                        + ', '.join(f"`{c}`" for c in cols) + ")"))
+        elif 'DAY' not in {c.upper() for c in connection.execute(text(f"SELECT * FROM `{table}` WHERE 1 = 0")).keys()}:
+            missing.append(table)
+    if missing:
+        logger.warning(f"Tables {', '.join(missing)} have no DAY column, the per-day coverage queries are slower "
+                       f"until make_db.py --mode maintain adds it")
+    return []
+
+def _natural_keys(schema, connection):
+    #sensor tables created with an older natural key or none, which kept one of the events of the same second and the rows
+    #with NULL in the key several times. Rebuilding them takes hours on large tables and removes rows, it is left to
+    #MulticastDB.add_natural_keys (make_db.py --add-keys)
+    outdated = [t for t in NATURAL_KEYS if t in schema.names and not natural_key_current(schema.backend, connection, t)]
+    if outdated:
+        logger.warning(f"Tables {', '.join(outdated)} have an older natural key and may hold duplicated rows, "
+                       f"run make_db.py --add-keys to rebuild them")
+    return []
+
+#(version, description, function creating or altering tables on a connection and returning the tables created).
+#Migrations are appended, never edited, and check what exists so that they can run on databases created before
+#SCHEMA_VERSION existed. DDL is not transactional on MySQL, a migration interrupted halfway is run again
+MIGRATIONS = [
+    (1, 'sensor tables', _sensor_tables),
+    (2, 'daily coverage summary', _create(SUMMARY_TABLES)),
+    (3, 'ingest ledger', _create(LEDGER_TABLES)),
+    (4, 'participant overview', _create(OVERVIEW_TABLES)),
+    (5, 'hours of the daily coverage', _coverage_hours),
+    (6, 'day column of the sensor tables', _day_columns),
+    (7, 'natural keys of the event values', _natural_keys),
+]
+VERSION = MIGRATIONS[-1][0]
+#tables whose structure is set by the migrations
+MANAGED_TABLES = set(TABLES) | set(SUMMARY_TABLES) | set(LEDGER_TABLES) | set(OVERVIEW_TABLES) | set(SCHEMA_TABLES)
+
+
+class SchemaManager:
+    """Tables of a database, from one inspection, and their metadata, reflected table by table on first use and kept
+    for the session"""
+
+    def __init__(self, engine, backend, partition_start) -> None:
+        self.engine = engine
+        self.backend = backend
+        self.partition_start = partition_start
+        self.names = set(inspect(engine).get_table_names())     #tables in the database
+        self.version = self._version()
+        self.metadata = MetaData()
+
+    def _version(self):
+        #latest migration applied to the database, 0 if it predates SCHEMA_VERSION
+        if 'SCHEMA_VERSION' not in self.names:
+            return 0
+        with self.engine.connect() as connection:
+            return connection.execute(text("SELECT MAX(VERSION) FROM SCHEMA_VERSION")).scalar() or 0
+
+    def migrate(self):
+        """Apply the migrations newer than the version of the database, each recorded in SCHEMA_VERSION once done.
+        Returns the tables created"""
+        created = []
+        if self.version >= VERSION:
+            return created
+        with self.engine.begin() as connection:
+            for ddl in SCHEMA_TABLES.values():
+                connection.execute(text(ddl))
+        self.names |= set(SCHEMA_TABLES)
+        for version, description, migration in MIGRATIONS:
+            if version <= self.version:
+                continue
+            with self.engine.begin() as connection:
+                new = migration(self, connection) or []
+                connection.execute(text("INSERT IGNORE INTO SCHEMA_VERSION (VERSION, DESCRIPTION) VALUES (:version, :description)"),
+                                   {'version': version, 'description': description})
+            self.names |= set(new)
+            created += [t for t in new if t not in created]
+            self.version = version
+            logger.info(f"Schema migrated to version {version}: {description}")
+        return created
+
+    def table(self, name):
+        """Metadata of table name, reflected on first use"""
+        if name not in self.metadata.tables:
+            if name not in self.names:
+                raise ValueError(f"Table '{name}' does not exist in the database.")
+            with warnings.catch_warnings(): #natural keys of SQLite are expression indexes, skipped by the reflection
+                warnings.filterwarnings('ignore', 'Skipped unsupported reflection of expression-based index', SAWarning)
+                Table(name, self.metadata, autoload_with=self.engine)
+        return self.metadata.tables[name]
+
+    def reflect_all(self):
+        for name in sorted(self.names):
+            self.table(name)
+        return self.metadata
+
+    def created(self, name):
+        self.names.add(name)
+
+    def changed(self, name):
+        """Forget the metadata of table name after its structure changed, it is reflected again on next use"""
+        if name in self.metadata.tables:
+            self.metadata.remove(self.metadata.tables[name])
+
+    def dropped(self, name):
+        self.names.discard(name)
+        self.changed(name)
+        if name == 'SCHEMA_VERSION':
+            self.version = 0
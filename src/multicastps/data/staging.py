@@ -0,0 +1,168 @@
+#columnar staging area between parsing and the database: parsed tables are written as parquet files that can be
+#loaded into the MulticastDB later, as often as needed, without parsing the raw files again
+import hashlib
+import json
+import logging
+import os
+from glob import glob
+import pandas as pd
+from multicastps.data.ingest import merge_file_level, OK, FILE_LEVEL
+from multicastps.data.ledger import fingerprint, DONE, SKIPPED
+
+logger = logging.getLogger('make_db')
+
+#layout of the staging directory:
+#   <table>/<user_id>/<date>/<source key>-<part>.parquet    rows of one table, participant and day, from one source file
+#   _sources/<source key>.json                              manifest of one source file: fingerprint, outcome and staged files
+MANIFESTS = '_sources'
+USER_COLUMNS = ['user_id', 'USER_ID']
+NO_PARTITION = '_'
+COMPRESSION = 'zstd'
+PHONE = 'phone'     #kind of source: phone sensing file, recorded in the ingest ledger when loaded
+CSV = 'csv'         #kind of source: EMA or MobileCoach export, loaded on every run
+
+def source_key(path):
+    """Name of the staged files of a source file, unique per path"""
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return f"{stem}-{hashlib.sha1(path.encode('utf-8')).hexdigest()[:10]}"
+
+def manifest_path(stage_dir, path):
+    return os.path.join(stage_dir, MANIFESTS, source_key(path) + '.json')
+
+def read_manifest(stage_dir, path):
+    """Returns the manifest of a staged source file, None if it was never staged"""
+    try:
+        with open(manifest_path(stage_dir, path)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def read_manifests(stage_dir, kind = None):
+    """Returns the manifests of all sources staged in stage_dir, optionally only those of one kind"""
+    ret = []
+    for file in sorted(glob(os.path.join(stage_dir, MANIFESTS, '*.json'))):
+        with open(file) as f:
+            manifest = json.load(f)
+        if kind is None or manifest['kind'] == kind:
+            ret.append(manifest)
+    return ret
+
+def write_manifest(stage_dir, manifest):
+    #written to a temporary file and renamed, a manifest is never half written
+    path = manifest_path(stage_dir, manifest['source'])
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(path + '.tmp', path)
+
+def is_staged(stage_dir, path, streams):
+    """A source is staged if its manifest matches the size and modification time of the file
+    and all selected streams were staged"""
+    manifest = read_manifest(stage_dir, path)
+    if manifest is None:
+        return False
+    st = os.stat(path)
+    if st.st_size != manifest['size'] or st.st_mtime != manifest['mtime']:
+        return False
+    return not any(status != DONE and stream in streams for stream, (status, n) in manifest['streams'].items())
+
+def partition_values(df):
+    #participant and day of each row of df, NO_PARTITION if the table has no such column
+    user_col = next((c for c in USER_COLUMNS if c in df.columns), None)
+    users = df[user_col].astype(str) if user_col else pd.Series(NO_PARTITION, index=df.index)
+    date_col = next((c for c in df.columns if pd.api.types.is_datetime64_any_dtype(df[c])), None)
+    dates = df[date_col].dt.strftime('%Y-%m-%d') if date_col else pd.Series(NO_PARTITION, index=df.index)
+    return users.fillna(NO_PARTITION), dates.fillna(NO_PARTITION)
+
+def write_table(stage_dir, key, table, df, part):
+    """Write the rows of df in one parquet file per participant and day. Returns the paths written, relative to stage_dir"""
+    df = df.rename(columns=str).reset_index(drop=True)
+    users, dates = partition_values(df)
+    written = []
+    for (user, date), rows in df.groupby([users, dates], sort=False).groups.items():
+        rel = os.path.join(table, user, date, f"{key}-{part:05d}.parquet")
+        os.makedirs(os.path.join(stage_dir, os.path.dirname(rel)), exist_ok=True)
+        df.loc[rows].to_parquet(os.path.join(stage_dir, rel), index=False, compression=COMPRESSION)
+        written.append(rel)
+    return written
+
+def remove_staged(stage_dir, path):
+    """Delete the staged files and manifest of a source file"""
+    manifest = read_manifest(stage_dir, path)
+    if manifest is None:
+        return
+    for rel in manifest['files']:
+        try:
+            os.remove(os.path.join(stage_dir, rel))
+        except FileNotFoundError:
+            pass
+    os.remove(manifest_path(stage_dir, path))
+
+def stage_file(stage_dir, dbloc, chunks, streams, unread = frozenset(), kind = PHONE):
+    """Stage all chunks (status, df_dict, seconds) of one source file and write its manifest.
+    Streams not in streams (None for all), and the streams in unread, are recorded as skipped in the manifest.
+    Returns the status of the file: the files of a failing source are removed and no manifest is written"""
+    fp = fingerprint(dbloc) if kind == PHONE else (None, None, None) #csv sources are staged again on every run
+    remove_staged(stage_dir, dbloc)
+    key = source_key(dbloc)
+    stream_status = {s: (SKIPPED, 0) for s in unread}
+    file_level = dict()
+    files = []
+    seconds = 0.0
+    n_parts = 0
+    for status, df_dict, chunk_seconds in chunks:
+        seconds += chunk_seconds
+        if status != OK:
+            for rel in files:
+                os.remove(os.path.join(stage_dir, rel))
+            return status
+        for stream_name in FILE_LEVEL & df_dict.keys():
+            file_level.setdefault(stream_name, []).append(df_dict.pop(stream_name))
+        for stream_name, df in df_dict.items():
+            if streams is not None and stream_name not in streams:
+                stream_status[stream_name] = (SKIPPED, 0)
+                continue
+            files += write_table(stage_dir, key, stream_name, df, n_parts)
+            res, n = stream_status.get(stream_name, (DONE, 0))
+            stream_status[stream_name] = (res, n + len(df))
+        n_parts += 1
+    for stream_name, frames in file_level.items(): #staged after the chunks, as they are uploaded last
+        if streams is None or stream_name in streams:
+            df = merge_file_level(frames)
+            files += write_table(stage_dir, key, stream_name, df, n_parts)
+            stream_status[stream_name] = (DONE, len(df))
+        else:
+            stream_status[stream_name] = (SKIPPED, 0)
+    write_manifest(stage_dir, {'source': dbloc, 'kind': kind, 'size': fp[0], 'mtime': fp[1], 'hash': fp[2],
+                               'parse_seconds': seconds, 'streams': stream_status, 'files': files})
+    return OK
+
+def staged_chunks(stage_dir, manifest, streams):
+    """Yield the staged tables of a source as chunks (status, df_dict, seconds) in the order they were parsed,
+    as expected by make_db.upload_file. Only the streams in streams are read, all if None"""
+    parts = dict()
+    for rel in manifest['files']:
+        table = rel.split(os.sep)[0]
+        if streams is None or table in streams:
+            part = int(os.path.splitext(rel)[0].rsplit('-', 1)[1])
+            parts.setdefault(part, dict()).setdefault(table, []).append(os.path.join(stage_dir, rel))
+    seconds = manifest['parse_seconds']
+    for part in sorted(parts):
+        df_dict = {table: pd.concat([pd.read_parquet(f) for f in files], ignore_index=True)
+                   for table, files in parts[part].items()}
+        yield OK, df_dict, seconds
+        seconds = 0.0 #parse time of the file is counted once
+
+def staged_fingerprint(manifest):
+    return manifest['size'], manifest['mtime'], manifest['hash']
+
+def read_table(stage_dir, table, user_id = None, start = None, end = None):
+    """Read the staged rows of table, optionally of one participant and of days in [start, end] ('YYYY-MM-DD').
+    The files can as well be read directly, e.g. pd.read_parquet(os.path.join(stage_dir, 'LOCATION'))"""
+    pattern = os.path.join(stage_dir, table, str(user_id) if user_id is not None else '*', '*', '*.parquet')
+    files = [f for f in sorted(glob(pattern))
+             if (start is None or os.path.basename(os.path.dirname(f)) >= start)
+             and (end is None or os.path.basename(os.path.dirname(f)) <= end)]
+    if not files:
+        return pd.DataFrame()
+    return pd.concat([pd.read_parquet(f) for f in files], ignore_index=True)
@@ -0,0 +1,103 @@
+#coalescing of the uploads of many small phone sensing files into few large inserts
+import logging
+import sys
+import pandas as pd
+from sqlalchemy.exc import IntegrityError
+from multicastps.data.ingest import merge_file_level, FILE_LEVEL
+from multicastps.data.ledger import DONE, PARTIAL, FAILED, SKIPPED
+
+logger = logging.getLogger('make_db')
+
+DEFAULT_ROWS = 100000
+DEFAULT_BYTES = 64 * 2**20
+
+class WriteBuffer:
+    """Accumulates the parsed tables of several files and uploads them with one insert per table.
+    The ledger entries of the buffered files are written in the flush transaction, so a file is only
+    recorded as processed once its rows are committed. If the insert of a table fails, the frames of that
+    table are inserted again file by file, so that only the files with bad data have the stream recorded as failed"""
+
+    def __init__(self, db, ledger, max_rows = DEFAULT_ROWS, max_bytes = DEFAULT_BYTES) -> None:
+        self.db = db
+        self.ledger = ledger
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.files = dict()     #path -> [stream_status, parse seconds, fingerprint]
+        self.frames = dict()    #table -> list of (path, dataframe)
+        self.rows = 0
+        self.bytes = 0
+        self.flushes = 0
+
+    def __len__(self):
+        return len(self.files)
+
+    def add(self, dbloc, df_dict, seconds, streams, unread = frozenset(), fp = None):
+        """Buffer the tables of a file read in a single chunk. Flushes if the buffer is full.
+        Returns the outcomes of the flushed files, see flush"""
+        ret = dict()
+        if dbloc in self.files: #a file can't be buffered twice, its ledger entry would be overwritten
+            ret = self.flush()
+        done_streams = self.ledger.done_streams(dbloc, fp)
+        stream_status = dict()
+        for stream_name, df in df_dict.items():
+            if stream_name in done_streams:
+                continue
+            if stream_name in streams:
+                if stream_name in FILE_LEVEL:
+                    df = merge_file_level([df])
+                self.frames.setdefault(stream_name, []).append((dbloc, df))
+                stream_status[stream_name] = (DONE, len(df))
+                self.rows += len(df)
+                self.bytes += int(df.memory_usage(index=False, deep=True).sum())
+            else:
+                stream_status[stream_name] = (SKIPPED, 0)
+        for stream_name in self.ledger.pending_streams(dbloc) & set(streams) - stream_status.keys():
+            stream_status[stream_name] = (DONE, 0) #left out by an earlier run, but not present in the file
+        for stream_name in set(unread) - stream_status.keys() - done_streams:
+            stream_status[stream_name] = (SKIPPED, 0)
+        self.files[dbloc] = [stream_status, seconds, fp]
+        if self.rows >= self.max_rows or self.bytes >= self.max_bytes:
+            ret.update(self.flush())
+        return ret
+
+    def _insert_table(self, connection, table, frames):
+        #insert all frames of table at once, file by file if that fails. Returns the files whose rows failed
+        try:
+            with connection.begin_nested():
+                self.db.insert_pd(pd.concat([df for path, df in frames], ignore_index=True), table, connection)
+            return set()
+        except:
+            ex_type, ex_value, ex_traceback = sys.exc_info()
+            logger.debug(f"Coalesced insert of {len(frames)} files failed for table {table}, inserting file by file --- error: {ex_value}")
+        failed = set()
+        for path, df in frames:
+            try:
+                with connection.begin_nested():
+                    self.db.insert_pd(df, table, connection)
+            except IntegrityError:
+                logger.error(f"Data violates schema constraints, no data extracted for table {table} at location: {path}")
+                failed.add(path)
+            except:
+                ex_type, ex_value, ex_traceback = sys.exc_info()
+                logger.error(f"Execution failed: {path} \n {ex_value}")
+                failed.add(path)
+        return failed
+
+    def flush(self):
+        """Upload the buffered tables and the ledger entries of the buffered files in one transaction.
+        Returns a dictionary path -> set of streams that failed or were skipped, for each flushed file"""
+        if not self.files:
+            return dict()
+        with self.db.transaction() as connection:
+            for table, frames in self.frames.items():
+                for path in self._insert_table(connection, table, frames):
+                    self.files[path][0][table] = (FAILED, 0)
+            ret = dict()
+            for path, (stream_status, seconds, fp) in self.files.items():
+                ret[path] = {s for s, (res, n) in stream_status.items() if res != DONE}
+                self.ledger.record(connection, path, PARTIAL if ret[path] else DONE, seconds, stream_status, fp)
+        logger.debug(f"Flushed {self.rows} rows of {len(self.files)} files in {len(self.frames)} tables")
+        self.flushes += 1
+        self.files, self.frames = dict(), dict()
+        self.rows, self.bytes = 0, 0
+        return ret
@@ -0,0 +1,35 @@
+import json
+import sqlite3
+import pandas as pd
+import pytest
+from multicastps.data.database import MulticastDB
+
+def open_db(path, **kwargs):
+    #MulticastDB on a SQLite file, without the caches kept in the home directory
+    kwargs = {'coverage_cache': None, **kwargs}
+    return MulticastDB(backend='sqlite', path=str(path), **kwargs)
+
+@pytest.fixture
+def db(tmp_path):
+    db = open_db(tmp_path / 'multicast.sqlite')
+    yield db
+    db.engine.dispose()
+
+def screen(*rows):
+    """SCREEN rows (user, timestamp, lockstate)"""
+    return pd.DataFrame({'USER_ID': [r[0] for r in rows], 'TIMESTAMP': pd.to_datetime([r[1] for r in rows]),
+                         'LOCKSTATE': [r[2] for r in rows]})
+
+def count(db, table):
+    return db.query(f"SELECT COUNT(*) FROM `{table}`")[0][0]
+
+def phone_db(path, lockstates, user = 'u1', start = '2024-03-02 10:00:00'):
+    """iOS phone sensing file with one screen event a minute, of the lock states given"""
+    t = pd.Timestamp(start, tz='Europe/Zurich').timestamp()
+    connection = sqlite3.connect(path)
+    connection.execute("CREATE TABLE events (event_time REAL, event_id INTEGER, event_data BLOB, device_id TEXT, user_id TEXT)")
+    connection.executemany("INSERT INTO events VALUES (?, 14, ?, 'd1', ?)",
+                           [(t + 60*i, json.dumps({'LockState': s}).encode(), user) for i, s in enumerate(lockstates)])
+    connection.commit()
+    connection.close()
+    return str(path)
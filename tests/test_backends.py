@@ -0,0 +1,72 @@
+import sqlite3
+import pandas as pd
+import pytest
+from sqlalchemy import text
+from multicastps.data.backends import translate, index_statements
+from conftest import open_db, screen, count
+
+
+DDL = """CREATE TABLE `T` (
+            `TIMESTAMP` TIMESTAMP NOT NULL,
+            `USER_ID` varchar(40) NOT NULL,
+            `N` int(11) unsigned,
+            `DAY` DATE AS (DATE(`TIMESTAMP`)) STORED,
+            UNIQUE KEY `natural_key` (`USER_ID`(20), `TIMESTAMP`, (CRC32(CONCAT_WS('|', `N`)))),
+            KEY `idx_user_day` (`USER_ID`, `DAY`)
+            ) ENGINE=InnoDB;"""
+
+def test_mysql_statements_are_unchanged():
+    assert translate(DDL, 'mysql') == DDL
+
+@pytest.mark.parametrize('dialect', ['sqlite', 'duckdb'])
+def test_create_table_drops_options_and_keys(dialect):
+    sql = translate(DDL, dialect)
+    assert 'ENGINE' not in sql and 'KEY' not in sql and 'int(11)' not in sql
+    assert '"USER_ID" varchar(40) NOT NULL' in sql
+    if dialect == 'duckdb':
+        assert 'UINTEGER' in sql and 'GENERATED ALWAYS AS' in sql
+
+def test_index_statements():
+    assert index_statements(DDL) == [
+        """CREATE UNIQUE INDEX IF NOT EXISTS `T_natural_key` ON `T` ("USER_ID", "TIMESTAMP", (CRC32(CONCAT_WS('|', "N"))))""",
+        """CREATE INDEX IF NOT EXISTS `T_idx_user_day` ON `T` ("USER_ID", "DAY")"""]
+
+@pytest.mark.parametrize('mysql, sqlite', [
+    ("REPLACE INTO `T` (A) VALUES (%s)", 'INSERT OR REPLACE INTO "T" (A) VALUES (?)'),
+    ("INSERT IGNORE INTO T (A) VALUES (%s)", 'INSERT OR IGNORE INTO T (A) VALUES (?)'),
+    ("INSERT INTO T (A, B) VALUES (%s, %s) ON DUPLICATE KEY UPDATE B = VALUES(B)",
+     'INSERT INTO T (A, B) VALUES (?, ?) ON CONFLICT DO UPDATE SET B = excluded.B'),
+    ("SELECT * FROM T WHERE A <=> B", 'SELECT * FROM T WHERE A IS B'),
+    ("SELECT DATE_ADD(D, INTERVAL 28 DAY)", "SELECT DATE(D, '+' || (28) || ' days')"),
+    ("SELECT 'a `quoted` %s, DATE_ADD(x)' FROM `T`", "SELECT 'a `quoted` %s, DATE_ADD(x)' FROM \"T\""),
+])
+def test_translate_to_sqlite(mysql, sqlite):
+    assert translate(mysql, 'sqlite') == sqlite
+
+def test_translate_to_duckdb():
+    assert (translate("SELECT DATE(TS), CRC32(A) FROM T WHERE DAY > DATE_SUB(D, INTERVAL 1 DAY) AND X = %s AND Y = %s",
+                      'duckdb', 'numeric_dollar')
+            == "SELECT CAST(TS AS DATE), hash(A) FROM T WHERE DAY > (CAST(D AS DATE) - CAST(1 AS INTEGER)) AND X = $1 AND Y = $2")
+
+def test_only_intervals_in_days_are_translated():
+    with pytest.raises(ValueError):
+        translate("SELECT DATE_ADD(D, INTERVAL 1 MONTH)", 'sqlite')
+
+def test_mysql_functions_run_on_sqlite(db):
+    with db.engine.connect() as connection:
+        row = connection.execute(text("""SELECT DATE_ADD('2024-03-02', INTERVAL 28 DAY), REGEXP_LIKE('MC_1001', '^MC_[0-9]+$'),
+                                                REGEXP_SUBSTR('MC_1001_a', '[0-9]+'), CONCAT_WS('|', 'a', NULL, 1),
+                                                HOUR('2024-03-02 10:30:00.000000'), CRC32('a') = CRC32('a')""")).fetchone()
+    assert tuple(row) == ('2024-03-30', 1, '1001', 'a|1', 10, 1) #NULL skipped, as by MySQL
+
+def test_the_sqlite3_module_is_left_alone(tmp_path):
+    adapters = dict(sqlite3.adapters)
+    db = open_db(tmp_path / 'multicast.sqlite')
+    db.insert_pd(screen(('u1', '2024-03-02 10:00:00', True)), 'SCREEN')
+    assert dict(sqlite3.adapters) == adapters
+    #datetimes bound by the package are stored as SQLAlchemy stores them
+    assert db.query("SELECT `TIMESTAMP` FROM SCREEN") == [('2024-03-02 10:00:00.000000',)]
+    with db.transaction() as connection:
+        connection.exec_driver_sql("DELETE FROM SCREEN WHERE `TIMESTAMP` = ?", (pd.Timestamp('2024-03-02 10:00:00'),))
+    assert count(db, 'SCREEN') == 0
+    db.engine.dispose()
@@ -0,0 +1,61 @@
+import numpy as np
+import pandas as pd
+import pytest
+from multicastps.data.bulk_load import insert_statement, iter_row_batches, to_wallclock, write_load_file
+from conftest import open_db, screen, count
+
+
+def test_insert_statement():
+    assert insert_statement('T', ['A', 'B'], keys=('A',)) == "INSERT INTO `T` (`A`, `B`) VALUES (%s, %s)"
+    assert insert_statement('T', ['A', 'B'], on_duplicate='ignore', keys=('A',)) == "INSERT IGNORE INTO `T` (`A`, `B`) VALUES (%s, %s)"
+    assert (insert_statement('T', ['A', 'B'], on_duplicate='update', keys=('A(10)', '(CRC32(`B`))'))
+            == "INSERT INTO `T` (`A`, `B`) VALUES (%s, %s) ON DUPLICATE KEY UPDATE `B` = VALUES(`B`)")
+    #nothing to update, the row is skipped
+    assert insert_statement('T', ['A'], on_duplicate='update', keys=('A',)) == "INSERT IGNORE INTO `T` (`A`) VALUES (%s)"
+
+def test_row_batches_have_none_for_missing_values():
+    df = pd.DataFrame({'A': [1.0, np.nan, 3.0], 'B': ['x', None, 'z']})
+    assert list(iter_row_batches(df, 2)) == [[(1.0, 'x'), (None, None)], [(3.0, 'z')]]
+
+def test_aware_timestamps_are_stored_as_wall_clock():
+    df = pd.DataFrame({'T': pd.to_datetime(['2024-03-02 10:00:00']).tz_localize('Europe/Zurich')})
+    assert to_wallclock(df)['T'][0] == pd.Timestamp('2024-03-02 10:00:00')
+
+@pytest.mark.parametrize('method', ['executemany', 'to_sql'])
+def test_insert_methods_store_the_same_rows(tmp_path, method):
+    db = open_db(tmp_path / 'multicast.sqlite', insert_method=method, batch_size=2)
+    df = screen(('u1', '2024-03-02 10:00:00', True), ('u1', '2024-03-02 10:01:00', None), ('u2', '2024-03-02 10:00:00', False))
+    df['TIMESTAMP'] = df['TIMESTAMP'].dt.tz_localize('Europe/Zurich')
+    db.insert_pd(df, 'SCREEN')
+    db.insert_pd(df, 'SCREEN')
+    assert db.query("SELECT USER_ID, TIMESTAMP, LOCKSTATE FROM SCREEN ORDER BY USER_ID, TIMESTAMP") == [
+        ('u1', '2024-03-02 10:00:00.000000', 1), ('u1', '2024-03-02 10:01:00.000000', None), ('u2', '2024-03-02 10:00:00.000000', 0)]
+    summary = db.load_stats.summary()
+    assert summary[summary['table'] == 'SCREEN'][['method', 'rows', 'calls']].values.tolist() == [[method, 6, 2]]
+
+def test_tables_unknown_to_the_schema_are_created(db):
+    db.insert_pd(pd.DataFrame({'A': [1, 2]}), 'NEW_TABLE')
+    db.insert_pd(pd.DataFrame({'A': [1, 2]}), 'NEW_TABLE')
+    assert count(db, 'NEW_TABLE') == 4 #no natural key, rows are appended
+
+def test_duckdb_skips_rows_with_null_values_in_the_key(tmp_path):
+    pytest.importorskip('duckdb_engine')
+    from multicastps.data.database import MulticastDB
+    db = MulticastDB(backend='duckdb', path=str(tmp_path / 'multicast.duckdb'), coverage_cache=None)
+    df = pd.DataFrame({'USER_ID': ['u1'] * 3, 'TIMESTAMP': pd.to_datetime(['2024-03-02 10:00:00'] * 3),
+                       'BSSID': [None, None, 'aa'], 'SSID': ['a', 'b', 'c']})
+    db.insert_pd(df, 'WIFI_CONNECTED')
+    db.insert_pd(df, 'WIFI_CONNECTED')
+    assert sorted(db.query("SELECT BSSID, SSID FROM WIFI_CONNECTED"), key=str) == [('aa', 'c'), (None, 'a')]
+
+def test_load_data_file_holds_the_values_of_executemany(tmp_path):
+    #LOAD DATA reads 'True' as 0 in a TINYINT column, booleans are written as executemany sends them, 1 and 0
+    df = pd.DataFrame({'USER_ID': ['u1', 'u2', 'u3'], 'LOCKSTATE': [True, None, False],
+                       'CHARGING': pd.array([False, True, None], dtype='boolean'), 'LEVEL': [0.5, np.nan, 1.0]})
+    assert df['LOCKSTATE'].dtype == object
+    write_load_file(df, tmp_path / 'rows.tsv')
+    loaded = [[None if v == '\\N' else v for v in line.split('\t')] 
+              for line in (tmp_path / 'rows.tsv').read_text().splitlines()]
+    sent = [[None if v is None else str(int(v)) if isinstance(v, (bool, np.bool_)) else str(v) for v in row]
+            for rows in iter_row_batches(df, 10) for row in rows]
+    assert loaded == sent == [['u1', '1', '0', '0.5'], ['u2', None, '1', None], ['u3', '0', None, '1.0']]
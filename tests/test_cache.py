@@ -0,0 +1,44 @@
+import pandas as pd
+import pytest
+from conftest import open_db, screen
+from multicastps.data.cache import QueryCache, cache_key, is_read_only, normalize_sql, tables_of
+
+pytest.importorskip('pyarrow')
+
+QUERY = "SELECT USER_ID, COUNT(*) AS n FROM SCREEN GROUP BY USER_ID ORDER BY USER_ID"
+
+
+def test_queries_are_normalized():
+    assert normalize_sql("  SELECT *\n  FROM  SCREEN ;\n") == "SELECT * FROM SCREEN"
+    assert cache_key("SELECT * FROM SCREEN", {'a': 1}) == cache_key("SELECT *\nFROM SCREEN;", {'a': 1})
+    assert cache_key("SELECT * FROM SCREEN", {'a': 1}) != cache_key("SELECT * FROM SCREEN", {'a': 2})
+    assert is_read_only("  with x AS (SELECT 1) SELECT * FROM x") and not is_read_only("DELETE FROM SCREEN")
+    assert tables_of("SELECT * FROM screen JOIN EMA ON 1", ['SCREEN', 'EMA', 'CALLS']) == ['EMA', 'SCREEN']
+
+def test_results_are_cached_until_the_table_changes(tmp_path):
+    db = open_db(tmp_path / 'db.sqlite', cache=True)
+    db.insert_pd(screen(('u1', '2024-03-01 10:00:00', 1), ('u2', '2024-03-01 10:00:00', 1)), 'SCREEN')
+    first = db.query(QUERY)
+    assert db.query(QUERY) == first and [tuple(r) for r in first] == [('u1', 1), ('u2', 1)]
+    assert pd.DataFrame(db.query(QUERY)).columns.tolist() == ['USER_ID', 'n']
+    db.insert_pd(screen(('u1', '2024-03-01 11:00:00', 0)), 'SCREEN')
+    assert [tuple(r) for r in db.query(QUERY)] == [('u1', 2), ('u2', 1)]
+    assert db.cache_stats()['hits'] == 2 and db.cache_stats()['misses'] == 2
+    db.engine.dispose()
+
+def test_cached_results_outlive_the_session(tmp_path):
+    QueryCache(str(tmp_path)).put('a', QUERY, ['USER_ID', 'n'], [('u1', 1)], {'SCREEN': 1})
+    cache = QueryCache(str(tmp_path))
+    rows = cache.get('a', {'SCREEN': 1})
+    assert rows == [('u1', 1)] and pd.DataFrame(rows).columns.tolist() == ['USER_ID', 'n'] and cache.stats()['hits'] == 1
+    assert cache.get('a', {'SCREEN': 2}) is None
+    cache.clear()
+    assert QueryCache(str(tmp_path)).get('a', {'SCREEN': 1}) is None
+
+def test_least_recently_used_results_are_evicted():
+    cache = QueryCache(max_bytes=64)
+    for key in ['a', 'b', 'c']:
+        cache.put(key, 'SELECT 1', ['x'], [(1,), (2,), (3,)], {'T': 1})
+    assert cache.get('a', {'T': 1}) is None and cache.get('c', {'T': 1}) == [(1,), (2,), (3,)]
+    assert cache.get('c', {'T': 2}) is None #other watermarks
+    assert cache.stats()['bytes'] <= 64
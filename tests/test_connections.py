@@ -0,0 +1,52 @@
+import sqlite3
+import pytest
+from sqlalchemy.exc import OperationalError
+from multicastps.data import connections
+from multicastps.data.connections import PoolStats, is_transient, with_retries
+
+
+class MySQLError(Exception):
+    def __init__(self, errno, msg):
+        super().__init__(errno, msg)
+        self.errno = errno
+
+def error(orig):
+    return OperationalError('SELECT 1', {}, orig)
+
+def test_transient_errors():
+    assert is_transient(error(sqlite3.OperationalError('database is locked')))
+    assert is_transient(error(MySQLError(1213, 'Deadlock found when trying to get lock')))
+    assert is_transient(error(MySQLError(2013, 'Lost connection to MySQL server during query')))
+    assert not is_transient(error(sqlite3.OperationalError('no such table: NOPE')))
+    assert not is_transient(error(MySQLError(1146, "Table 'NOPE' doesn't exist")))
+    assert not is_transient(ValueError('database is locked'))
+
+def test_transient_errors_are_retried(monkeypatch):
+    monkeypatch.setattr(connections.time, 'sleep', lambda s: None)
+    calls, stats = [], PoolStats()
+    def locked():
+        calls.append(1)
+        if len(calls) < 3:
+            raise error(sqlite3.OperationalError('database is locked'))
+        return 'done'
+    assert with_retries(locked, retries=3, stats=stats) == 'done'
+    assert len(calls) == 3 and stats.summary()['retries'] == 2
+    calls.clear()
+    with pytest.raises(OperationalError):
+        with_retries(locked, retries=1) #still locked after the last retry
+    assert len(calls) == 2
+    def missing():
+        calls.append(1)
+        raise error(sqlite3.OperationalError('no such table: NOPE'))
+    calls.clear()
+    with pytest.raises(OperationalError):
+        with_retries(missing, retries=3)
+    assert len(calls) == 1
+
+def test_pool_statistics(db):
+    db.query("SELECT 1")
+    with db.engine.connect(), db.engine.connect():
+        assert db.pool_stats.summary()['checked_out'] == 2
+    stats = db.pool_stats.summary()
+    assert stats['checked_out'] == 0 and stats['max_checked_out'] >= 2 and stats['connects'] >= 2
+    assert stats['pool_size'] == 5 and stats['reconnects'] == 0
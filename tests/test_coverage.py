@@ -0,0 +1,53 @@
+import datetime as dt
+import numpy as np
+from multicastps.data.coverage import CoverageIndex, hour_bits
+from conftest import open_db, screen
+
+
+def days(*values):
+    return [dt.date.fromisoformat(v) for v in values]
+
+def load(db):
+    db.insert_pd(screen(('u1', '2024-03-02 10:00:00', True), ('u1', '2024-03-02 23:30:00', False),
+                        ('u1', '2024-03-03 08:00:00', True), ('u1', '2024-03-05 08:00:00', True),
+                        ('u2', '2024-03-04 12:00:00', True)), 'SCREEN')
+
+def test_hour_bits():
+    assert hour_bits([0b101]).nonzero()[1].tolist() == [0, 2]
+
+def test_windows_match_the_sensor_tables(db):
+    load(db)
+    index = db.coverage_index.refresh()
+    assert index.windows('SCREEN') == [('u1', *days('2024-03-02', '2024-03-03')), ('u1', *days('2024-03-05', '2024-03-05')),
+                                       ('u2', *days('2024-03-04', '2024-03-04'))]
+    #SQLite returns the dates of the query as text
+    assert [tuple(map(str, r)) for r in db.get_sensing_timespan('SCREEN')] == [tuple(map(str, r)) for r in index.windows('SCREEN')]
+    assert index.windows('LOCATION') == []
+
+def test_counts_and_missing_days_match_the_sensor_tables(db):
+    load(db)
+    assert db.get_count_ps_days(summary=True) == [tuple(r) for r in db.get_count_ps_days()] == [('u1', 3), ('u2', 1)]
+    missing = db.coverage_index.missing_days([('u1', dt.date(2024, 3, 2)), ('u3', None)], ['SCREEN'], length=5)
+    assert missing == [('u1', *days('2024-03-04'), 3), ('u1', *days('2024-03-06'), 5), ('u3', None, 1)]
+
+def test_hours_covered(db):
+    load(db)
+    dates, hours = db.coverage_index.refresh().hours_covered('u1', ['SCREEN'], dt.date(2024, 3, 1), dt.date(2024, 3, 2))
+    assert dates.tolist() == days('2024-03-01', '2024-03-02')
+    assert not hours[0].any() and np.nonzero(hours[1])[0].tolist() == [10, 23]
+
+def test_refresh_reads_the_days_recounted_since(db):
+    index = db.coverage_index.refresh()
+    assert index.count_days(['SCREEN']) == []
+    load(db)
+    assert index.refresh().count_days(['SCREEN']) == [('u1', 3), ('u2', 1)]
+    db.insert_pd(screen(('u1', '2024-03-04 09:00:00', True)), 'SCREEN')
+    assert index.refresh().windows('SCREEN')[0] == ('u1', *days('2024-03-02', '2024-03-05'))
+
+def test_the_index_is_kept_between_sessions(tmp_path):
+    db = open_db(tmp_path / 'multicast.sqlite', coverage_cache=str(tmp_path / 'cache'))
+    load(db)
+    windows = db.coverage_index.refresh().windows('SCREEN')
+    index = CoverageIndex(db.engine, str(tmp_path / 'cache'))
+    index._load()
+    assert index.windows('SCREEN') == windows and index.n_rows == db.coverage_index.n_rows
@@ -0,0 +1,35 @@
+import pandas as pd
+from multicastps.data.csv_load import read_csv_chunks, cast_column, INT, BOOL, STRING
+
+
+def write(path, text):
+    path.write_text(text)
+    return str(path)
+
+def test_surveys_are_merged_with_the_same_types_in_every_chunk(tmp_path):
+    old = write(tmp_path / 'old.csv', "id,submitdate,participantCode,q1,q2\n1,2024-03-02 09:05:00,MC_1001,1,a\n2,,MC_1002,,b\n")
+    new = write(tmp_path / 'new.csv', "id,participantCode,q1,q3\n3,MC_1001,2.5,x\n")
+    chunks = list(read_csv_chunks('EMA', [old, new], 2**20))
+    assert [c.columns.tolist() for c in chunks] == [['id', 'submitdate', 'participantCode', 'q1', 'q2', 'q3']] * 2
+    assert all(c.dtypes.tolist() == chunks[0].dtypes.tolist() for c in chunks)
+    df = pd.concat(chunks, ignore_index=True)
+    assert df['id'].tolist() == [1, 2, 3] and str(df['id'].dtype) == INT
+    assert df['q1'].tolist()[::2] == [1.0, 2.5] and df['q1'].isna().tolist() == [False, True, False]
+    assert pd.api.types.is_datetime64_any_dtype(df['submitdate']) and df['submitdate'].isna().tolist() == [False, True, True]
+    assert df['q3'].isna().tolist() == [True, True, False] and str(df['q3'].dtype) == STRING
+
+def test_mobilecoach_values_stay_strings(tmp_path):
+    path = write(tmp_path / 'Participant.csv', "_id,nickname,score\nObjectId(u1),007,12\n")
+    (df,) = read_csv_chunks('Participant', [path], 2**20)
+    assert df.values.tolist() == [['ObjectId(u1)', '007', '12']]
+
+def test_values_of_another_type_become_null():
+    col, n_bad = cast_column(pd.Series(['1', '2.5', 'x', None]), INT)
+    assert col.tolist()[:1] == [1] and col.isna().tolist() == [False, True, True, True] and n_bad == 2
+    col, n_bad = cast_column(pd.Series(['true', '0', 'maybe']), BOOL)
+    assert col.tolist()[:2] == [True, False] and n_bad == 1
+
+def test_empty_files_are_skipped(tmp_path):
+    path = write(tmp_path / 'Intervention.csv', "_id\n1\n")
+    empty = write(tmp_path / 'empty.csv', "")
+    assert sum(len(c) for c in read_csv_chunks('Intervention', [empty, path], 2**20)) == 1
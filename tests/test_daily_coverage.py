@@ -0,0 +1,28 @@
+from conftest import open_db, screen
+
+
+def coverage(db):
+    return db.query("""SELECT USER_ID, STREAM, DAY, N_ROWS, FIRST_TS, LAST_TS, HOURS FROM DAILY_COVERAGE
+                       ORDER BY USER_ID, STREAM, DAY""")
+
+def test_inserts_keep_the_summary_up_to_date(db):
+    db.insert_pd(screen(('u1', '2024-03-02 10:00:00', True), ('u1', '2024-03-02 12:30:00', False),
+                        ('u2', '2024-03-03 00:10:00', True)), 'SCREEN')
+    db.insert_pd(screen(('u1', '2024-03-02 10:00:00', True), ('u1', '2024-03-02 11:00:00', True)), 'SCREEN')
+    assert coverage(db) == [
+        ('u1', 'SCREEN', '2024-03-02', 3, '2024-03-02 10:00:00.000000', '2024-03-02 12:30:00.000000', (1 << 10) | (1 << 11) | (1 << 12)),
+        ('u2', 'SCREEN', '2024-03-03', 1, '2024-03-03 00:10:00.000000', '2024-03-03 00:10:00.000000', 1)]
+
+def test_rebuilding_gives_the_same_summary(db):
+    db.insert_pd(screen(('u1', '2024-03-02 10:00:00', True), ('u1', '2024-03-04 10:00:00', True)), 'SCREEN')
+    incremental = coverage(db)
+    db.rebuild_coverage(['SCREEN'])
+    assert coverage(db) == incremental
+
+def test_rebuilding_counts_rows_inserted_without_the_summary(tmp_path):
+    db = open_db(tmp_path / 'multicast.sqlite', coverage=False)
+    db.insert_pd(screen(('u1', '2024-03-02 10:00:00', True)), 'SCREEN')
+    assert coverage(db) == []
+    db.rebuild_coverage()
+    assert [r[:4] for r in coverage(db)] == [('u1', 'SCREEN', '2024-03-02', 1)]
+    assert db.get_sensing_timespan('SCREEN', exact=False, summary=True) == db.get_sensing_timespan('SCREEN', exact=False)
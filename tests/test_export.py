@@ -0,0 +1,40 @@
+import os
+import pandas as pd
+import pytest
+from conftest import screen
+
+
+def load(db):
+    db.insert_pd(screen(*[(f"u{i % 3}", f"2024-03-0{1 + i % 5} 10:00:00", bool(i % 2)) for i in range(25)]), 'SCREEN')
+
+@pytest.mark.parametrize('name', ['SCREEN.csv', 'SCREEN.csv.gz', 'SCREEN.parquet'])
+def test_tables_are_exported_chunk_by_chunk(db, tmp_path, name):
+    if name.endswith('.parquet'):
+        pytest.importorskip('pyarrow')
+    load(db)
+    path = str(tmp_path / 'out' / name)
+    assert db.export_table('SCREEN', path, chunksize=4) == 25
+    df = pd.read_parquet(path) if name.endswith('.parquet') else pd.read_csv(path)
+    assert df.columns.tolist() == ['TIMESTAMP', 'USER_ID', 'LOCKSTATE', 'DAY'] and len(df) == 25
+    assert not os.path.exists(path + '.part')
+
+def test_filters_and_empty_exports(db, tmp_path):
+    load(db)
+    path = str(tmp_path / 'SCREEN.csv')
+    assert db.export_table('SCREEN', path, columns=['USER_ID', 'TIMESTAMP'], user_ids=['u1'], start='2024-03-02',
+                           end='2024-03-04') == 4
+    assert pd.read_csv(path)['USER_ID'].tolist() == ['u1'] * 4
+    assert db.export_table('SCREEN', path, user_ids=['nobody']) == 0
+    assert pd.read_csv(path).columns.tolist() == ['TIMESTAMP', 'USER_ID', 'LOCKSTATE', 'DAY']
+
+def test_export_tables(db, tmp_path):
+    load(db)
+    assert db.export_tables(['SCREEN', 'BRIGHTNESS'], str(tmp_path), fmt='csv', workers=2) == {'SCREEN': 25, 'BRIGHTNESS': 0}
+    assert os.path.exists(tmp_path / 'SCREEN.csv.gz')
+
+def test_empty_parquet_export_keeps_the_schema(db, tmp_path):
+    pytest.importorskip('pyarrow')
+    path = str(tmp_path / 'SCREEN.parquet')
+    assert db.export_table('SCREEN', path) == 0
+    df = pd.read_parquet(path)
+    assert df.columns.tolist() == ['TIMESTAMP', 'USER_ID', 'LOCKSTATE', 'DAY'] and len(df) == 0
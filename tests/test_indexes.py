@@ -0,0 +1,41 @@
+from multicastps.data.queries_mc import INDEXES
+from conftest import screen
+
+
+def index_names(db, table):
+    return {name for (name,) in db.query(f"SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = '{table}'")}
+
+def test_sensor_tables_are_indexed_by_participant_and_day(db):
+    for table, indexes in INDEXES.items():
+        assert {f"{table}_{name}" for name in indexes} <= index_names(db, table)
+
+def test_indexes_are_dropped_and_built_again_keeping_the_natural_key(db):
+    db.drop_indexes(['SCREEN'])
+    assert index_names(db, 'SCREEN') == {'SCREEN_natural_key'}
+    db.insert_pd(screen(('u1', '2024-03-02 10:00:00', True)), 'SCREEN')
+    db.insert_pd(screen(('u1', '2024-03-02 10:00:00', True)), 'SCREEN') #still skipped
+    db.create_indexes(['SCREEN'])
+    assert index_names(db, 'SCREEN') == {'SCREEN_natural_key', 'SCREEN_user_day'}
+    assert db.query("SELECT COUNT(*) FROM SCREEN") == [(1,)]
+
+def test_day_is_the_local_date_of_the_event(db):
+    df = screen(('u1', '2024-03-02 23:30:00', True), ('u1', '2024-03-03 00:30:00', True))
+    df['TIMESTAMP'] = df['TIMESTAMP'].dt.tz_localize('Europe/Zurich')
+    db.insert_pd(df, 'SCREEN')
+    assert db.query("SELECT DAY FROM SCREEN ORDER BY TIMESTAMP") == [('2024-03-02',), ('2024-03-03',)]
+    assert db.query("SELECT COUNT(*) FROM SCREEN WHERE USER_ID = 'u1' AND DAY = '2024-03-03'") == [(1,)]
+
+def test_tables_without_day_column_are_counted_by_date(db, monkeypatch):
+    db.insert_pd(screen(('u1', '2024-03-02 10:00:00', True), ('u1', '2024-03-02 11:00:00', False),
+                        ('u1', '2024-03-03 10:00:00', True)), 'SCREEN')
+    coverage = "SELECT USER_ID, STREAM, DAY, N_ROWS, HOURS FROM DAILY_COVERAGE ORDER BY DAY"
+    summary, days = db.query(coverage), db.get_count_ps_days()
+    with db.transaction() as connection: #SCREEN as created on MySQL before DAY was declared
+        connection.exec_driver_sql("CREATE TABLE SCREEN_OLD AS SELECT `TIMESTAMP`, USER_ID, LOCKSTATE FROM SCREEN")
+        connection.exec_driver_sql("DROP TABLE SCREEN")
+        connection.exec_driver_sql("ALTER TABLE SCREEN_OLD RENAME TO SCREEN")
+    db.schema.changed('SCREEN')
+    monkeypatch.setattr(db, 'backend', 'mysql') #embedded tables always have the column
+    assert db._day('SCREEN') == "DATE(`TIMESTAMP`)" and db._day('LOCATION') == '`DAY`'
+    db.rebuild_coverage(['SCREEN'])
+    assert db.query(coverage) == summary and db.get_count_ps_days() == days == [('u1', 2)]
@@ -0,0 +1,43 @@
+import sqlite3
+import pandas as pd
+from multicastps.data.ingest import file_tasks, run_task, unread_streams, OK, EMPTY, UNREADABLE, MIN_CHUNK_ROWS, DEFAULT_BUDGET
+from conftest import phone_db
+
+
+def screen_rows(tasks):
+    return pd.concat([df_dict['SCREEN'] for dbloc, status, df_dict, seconds in map(run_task, tasks)], ignore_index=True)
+
+def test_large_files_are_read_in_rowid_chunks(tmp_path):
+    path = phone_db(tmp_path / 'p1.db', [1, 0] * 1250)
+    tasks = list(file_tasks([path], budget=1))
+    assert [task[2][:2] for task in tasks] == [(1, MIN_CHUNK_ROWS), (MIN_CHUNK_ROWS + 1, 2 * MIN_CHUNK_ROWS),
+                                               (2 * MIN_CHUNK_ROWS + 1, 2500)]
+    chunked = screen_rows(tasks)
+    pd.testing.assert_frame_equal(chunked, screen_rows(file_tasks([path], DEFAULT_BUDGET)))
+    assert len(chunked) == 2500
+
+def test_files_without_events_or_unreadable_give_one_task(tmp_path):
+    empty, broken = str(tmp_path / 'empty.db'), str(tmp_path / 'broken.db')
+    sqlite3.connect(empty).execute("CREATE TABLE other (a INTEGER)").connection.close()
+    open(broken, 'wb').write(b'not a database' * 100)
+    tasks = list(file_tasks([empty, broken]))
+    assert [(dbloc, status) for dbloc, status, detail in tasks] == [(empty, EMPTY), (broken, UNREADABLE)]
+    assert [run_task(task)[1] for task in tasks] == [EMPTY, UNREADABLE]
+
+def test_only_the_events_of_the_selected_streams_are_read(tmp_path):
+    path = phone_db(tmp_path / 'p1.db', [1, 0, 1])
+    connection = sqlite3.connect(path)
+    connection.execute("""INSERT INTO events VALUES (0, 13, '{"timestamp": 0, "brightness": 0.5}', 'd1', 'u1')""")
+    connection.commit()
+    connection.close()
+    (task,) = file_tasks([path], streams=['SCREEN'])
+    assert task[2][2] == [14]
+    dbloc, status, df_dict, seconds = run_task(task)
+    assert len(df_dict['SCREEN']) == 3 and 'BRIGHTNESS' not in df_dict
+    assert 'BRIGHTNESS' in unread_streams(path, ['SCREEN']) and 'SCREEN' not in unread_streams(path, ['SCREEN'])
+    (task,) = file_tasks([path], streams=None)
+    assert set(run_task(task)[2]) >= {'SCREEN', 'BRIGHTNESS'} and unread_streams(path, None) == set()
+
+def test_files_without_events_of_the_selected_streams_are_not_read(tmp_path):
+    path = phone_db(tmp_path / 'p1.db', [1, 0, 1])
+    assert list(file_tasks([path], streams=['SMS'])) == [(path, OK, None)] #android only
@@ -0,0 +1,32 @@
+import json
+import pandas as pd
+import pytest
+from multicastps.data.json_batch import decode_json_column, repair_json
+
+
+def test_keys_become_columns_with_the_schema_always_present():
+    series = pd.Series([b'{"a": 1, "b": "x"}', b'{"a": 2, "c": true}'], index=[10, 11])
+    df, bad = decode_json_column(series, schema=('a', 'b', 'd'))
+    assert df.index.tolist() == [10, 11] and len(bad) == 0
+    assert df['a'].tolist() == [1, 2] and df['b'].tolist()[0] == 'x' and df['d'].isna().all()
+    assert df['c'].tolist()[1] is True
+
+def test_scalar_payloads_give_one_column():
+    df, bad = decode_json_column(pd.Series(['1', '2.5']))
+    assert df.columns.tolist() == [0] and df[0].tolist() == [1, 2.5]
+
+def test_truncated_payloads_are_repaired_or_dropped():
+    assert repair_json(b'{"ssid":"abc') == '{"ssid":"abc}"}' #as the parsers repaired payloads before
+    series = pd.Series([b'{"ssid":"abc', b'{"ssid":"ok"}', b'not json'], index=[5, 6, 7])
+    df, bad = decode_json_column(series, repair=True)
+    assert bad.tolist() == [7]
+    assert df.index.tolist() == [5, 6] and df['ssid'].tolist() == ['abc}', 'ok']
+
+def test_errors_are_raised_without_repair():
+    with pytest.raises(ValueError):
+        decode_json_column(pd.Series([b'{"a": 1']))
+
+def test_same_result_as_decoding_row_by_row():
+    series = pd.Series([f'{{"lat": {i / 3}, "name": "n{i}", "n": {i}}}'.encode() for i in range(100)])
+    df, bad = decode_json_column(series)
+    pd.testing.assert_frame_equal(df, series.apply(json.loads).apply(pd.Series), check_dtype=False)
@@ -0,0 +1,74 @@
+import os
+import pytest
+from multicastps.data.ledger import IngestLedger, DONE, PARTIAL, FAILED, SKIPPED
+from multicastps.data.ingest import OK
+from multicastps.data.make_db import upload_file, RetryFile
+from conftest import screen, count
+
+
+@pytest.fixture
+def phone_file(tmp_path):
+    path = tmp_path / 'p1.db'
+    path.write_bytes(b'events')
+    return str(path)
+
+def record(db, path, status, stream_status = None):
+    ledger = IngestLedger(db)
+    with db.transaction() as connection:
+        ledger.record(connection, path, status, 1.0, stream_status)
+
+def test_unchanged_files_are_not_processed_again(db, phone_file):
+    record(db, phone_file, DONE, {'SCREEN': (DONE, 3)})
+    ledger = IngestLedger(db)
+    assert not ledger.needs_processing(phone_file, ['SCREEN'])
+    assert ledger.done_streams(phone_file) == {'SCREEN'}
+
+def test_changed_and_failed_files_are_processed_again(db, phone_file, tmp_path):
+    other = str(tmp_path / 'p2.db')
+    open(other, 'wb').write(b'other')
+    record(db, phone_file, DONE, {'SCREEN': (DONE, 3)})
+    record(db, other, FAILED)
+    with open(phone_file, 'ab') as f:
+        f.write(b' changed')
+    ledger = IngestLedger(db)
+    assert ledger.needs_processing(phone_file, ['SCREEN'])
+    assert ledger.done_streams(phone_file) == set()
+    assert ledger.needs_processing(other, ['SCREEN'])
+
+def test_skipped_streams_are_read_by_a_run_selecting_them(db, phone_file):
+    record(db, phone_file, PARTIAL, {'SCREEN': (DONE, 3), 'BRIGHTNESS': (SKIPPED, 0)})
+    ledger = IngestLedger(db)
+    assert not ledger.needs_processing(phone_file, ['SCREEN'])
+    assert ledger.needs_processing(phone_file, ['SCREEN', 'BRIGHTNESS'])
+    assert ledger.pending_streams(phone_file) == {'BRIGHTNESS'}
+
+def test_changed_contents_drop_the_earlier_stream_outcomes(db, phone_file):
+    record(db, phone_file, PARTIAL, {'SCREEN': (DONE, 3), 'BRIGHTNESS': (SKIPPED, 0)})
+    with open(phone_file, 'ab') as f:
+        f.write(b' changed')
+    record(db, phone_file, DONE, {'SCREEN': (DONE, 4)})
+    assert db.query("SELECT STREAM, STATUS FROM INGEST_LEDGER_STREAMS") == [('SCREEN', DONE)]
+
+def test_upload_file_resumes_with_the_streams_not_done(db, phone_file):
+    chunks = [(OK, {'SCREEN': screen(('u1', '2024-03-02 10:00:00', True))}, 0.1)]
+    status, not_done = upload_file(db, IngestLedger(db), phone_file, chunks, ['SCREEN'], unread={'BRIGHTNESS'})
+    assert (status, not_done) == (DONE, {'BRIGHTNESS'})
+    chunks = [(OK, {'SCREEN': screen(('u1', '2024-03-02 10:00:00', True), ('u1', '2024-03-02 10:05:00', True))}, 0.1)]
+    upload_file(db, IngestLedger(db), phone_file, chunks, ['SCREEN', 'BRIGHTNESS'], unread=set())
+    #SCREEN was done, its rows are not uploaded again
+    assert count(db, 'SCREEN') == 1
+    assert db.query("SELECT STATUS FROM INGEST_LEDGER") == [(DONE,)]
+
+def test_a_stream_failing_after_earlier_chunks_rolls_back_the_file(db, phone_file):
+    bad = screen(('u1', '2024-03-02 10:05:00', True)).assign(UNKNOWN_COLUMN=1)
+    chunks = [(OK, {'SCREEN': screen(('u1', '2024-03-02 10:00:00', True))}, 0.1), (OK, {'SCREEN': bad}, 0.1)]
+    with pytest.raises(RetryFile) as e:
+        upload_file(db, IngestLedger(db), phone_file, iter(chunks), ['SCREEN'], unread=set())
+    assert e.value.streams == {'SCREEN'}
+    assert count(db, 'SCREEN') == 0
+    assert count(db, 'INGEST_LEDGER') == 0
+    status, not_done = upload_file(db, IngestLedger(db), phone_file, iter(chunks), ['SCREEN'], failed=e.value.streams,
+                                   unread=set())
+    assert (status, not_done) == (DONE, {'SCREEN'})
+    assert db.query("SELECT STATUS FROM INGEST_LEDGER") == [(PARTIAL,)]
+    assert IngestLedger(db).needs_processing(phone_file, ['SCREEN'])
@@ -0,0 +1,64 @@
+import os
+import sqlite3
+import subprocess
+import sys
+import pandas as pd
+import pytest
+from conftest import phone_db
+
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+
+
+@pytest.fixture
+def raw(tmp_path):
+    """Directory of the exports read by make_db: the two EMA surveys, the six MobileCoach collections and the phone
+    sensing files of one participant"""
+    root = tmp_path / 'raw'
+    for sub in ['ema', 'mongo_export', 'phone/p1']:
+        os.makedirs(root / sub)
+    pd.DataFrame({'id': [1, 2], 'submitdate': ['2024-03-02 09:05:00'] * 2, 'participantCode': ['MC_1001'] * 2,
+                  'datestamp': ['2024-03-02 09:00:00', '2024-03-03 09:00:00'], 'q1': [1, 2]}
+                 ).to_csv(root / 'ema' / 'survey_old.csv', index=False)
+    pd.DataFrame({'id': [3], 'submitdate': ['2024-03-04 09:05:00'], 'datestamp': ['2024-03-04 09:00:00'],
+                  'participantCode': ['MC_1001'], 'q2': ['a']}).to_csv(root / 'ema' / 'survey_new.csv', index=False)
+    pd.DataFrame({'_id': ['ObjectId(u1)'], 'nickname': ['MC_1001_a']}
+                 ).to_csv(root / 'mongo_export' / 'Participant.csv', index=False)
+    pd.DataFrame({'participant': ['ObjectId(u1)'], 'name': ['$endOfRehaDay'], 'value': ['01.03.2024'],
+                  'formerVariableValues': ['']}).to_csv(root / 'mongo_export' / 'ParticipantVariableWithValue.csv', index=False)
+    for name in ['DialogMessage', 'DialogOption', 'Intervention', 'InterventionVariableWithValue']:
+        pd.DataFrame({'_id': ['1', '2'], 'value': ['x', 'y']}).to_csv(root / 'mongo_export' / f"{name}.csv", index=False)
+    phone_db(root / 'phone' / 'p1' / 'a.db', [1, 0, 1])
+    phone_db(root / 'phone' / 'p1' / 'b.db', [0, 1] * 20, start='2024-03-03 10:00:00')
+    return root
+
+def make_db(tmp_path, raw, *args):
+    os.makedirs(tmp_path / 'logs', exist_ok=True)
+    env = {**os.environ, 'PYTHONPATH': SRC, 'LOG_DIR': str(tmp_path / 'logs')}
+    subprocess.run([sys.executable, '-m', 'multicastps.data.make_db', '--path', str(raw), '--backend', 'sqlite',
+                    '--db-path', str(tmp_path / 'multicast.sqlite'), '--log-level', 'WARNING', *args],
+                   env=env, check=True, cwd=tmp_path, capture_output=True)
+
+def row_counts(path):
+    connection = sqlite3.connect(path)
+    tables = [t for (t,) in connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+    ret = {t: connection.execute(f'SELECT COUNT(*) FROM "{t}"').fetchone()[0] for t in tables}
+    connection.close()
+    return ret
+
+@pytest.mark.parametrize('args', [[], ['--coalesce-rows', '0'], ['--workers', '2', '--writers', '2']])
+def test_running_again_changes_no_row_count(tmp_path, raw, args):
+    make_db(tmp_path, raw, *args)
+    counts = row_counts(tmp_path / 'multicast.sqlite')
+    assert counts['SCREEN'] == 43 and counts['EMA'] == 3 and counts['Participant'] == 1
+    make_db(tmp_path, raw, *args)
+    assert row_counts(tmp_path / 'multicast.sqlite') == counts
+
+def test_loading_a_staged_import_again_changes_no_row_count(tmp_path, raw):
+    pytest.importorskip('pyarrow')
+    stage = ['--stage-dir', str(tmp_path / 'stage')]
+    make_db(tmp_path, raw, '--mode', 'stage', *stage)
+    make_db(tmp_path, raw, '--mode', 'load', *stage)
+    counts = row_counts(tmp_path / 'multicast.sqlite')
+    assert counts['SCREEN'] == 43
+    make_db(tmp_path, raw, '--mode', 'load', *stage)
+    assert row_counts(tmp_path / 'multicast.sqlite') == counts
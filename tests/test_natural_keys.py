@@ -0,0 +1,51 @@
+import pandas as pd
+from sqlalchemy import text
+from multicastps.data.backends import index_statements
+from multicastps.data.queries_mc import TABLES
+from conftest import open_db, screen, count
+
+
+def test_rows_of_the_same_second_with_other_values_are_kept(db):
+    db.insert_pd(screen(('u1', '2024-03-02 10:00:00', True), ('u1', '2024-03-02 10:00:00', False)), 'SCREEN')
+    assert count(db, 'SCREEN') == 2
+
+def test_inserting_again_adds_no_rows(db):
+    df = screen(('u1', '2024-03-02 10:00:00', True), ('u1', '2024-03-02 10:01:00', False), ('u2', '2024-03-02 10:00:00', True))
+    db.insert_pd(df, 'SCREEN')
+    db.insert_pd(df, 'SCREEN')
+    assert count(db, 'SCREEN') == 3
+
+def test_null_values_are_deduplicated(db):
+    df = pd.DataFrame({'USER_ID': ['u1', 'u1'], 'TIMESTAMP': pd.to_datetime(['2024-03-02 10:00:00'] * 2),
+                       'BSSID': [None, None], 'SSID': [None, None]})
+    db.insert_pd(df, 'WIFI_CONNECTED')
+    db.insert_pd(df, 'WIFI_CONNECTED')
+    assert count(db, 'WIFI_CONNECTED') == 1
+
+def test_update_overwrites_the_row_of_the_key(tmp_path):
+    db = open_db(tmp_path / 'multicast.sqlite', on_duplicate='update')
+    df = pd.DataFrame({'USER_ID': ['u1'], 'TIMESTAMP': pd.to_datetime(['2024-03-02 10:00:00']), 'BSSID': ['aa'],
+                       'SSID': ['old']})
+    db.insert_pd(df, 'WIFI_CONNECTED')
+    db.insert_pd(df.assign(SSID='new'), 'WIFI_CONNECTED')
+    assert db.query("SELECT SSID FROM WIFI_CONNECTED") == [('new',)]
+
+def test_add_natural_keys_deduplicates_a_table_without_key(tmp_path):
+    path = tmp_path / 'multicast.sqlite'
+    db = open_db(path)
+    with db.transaction() as connection:
+        connection.execute(text("DROP TABLE SCREEN"))
+        connection.execute(text(TABLES['SCREEN'].split('UNIQUE KEY')[0].rstrip().rstrip(',') + ')'))
+    db.engine.dispose()
+    db = open_db(path)
+    db.insert_pd(screen(('u1', '2024-03-02 10:00:00', True), ('u1', '2024-03-02 10:00:00', True),
+                        ('u1', '2024-03-02 10:00:00', False)), 'SCREEN')
+    assert count(db, 'SCREEN') == 3
+    db.add_natural_keys(['SCREEN'])
+    assert count(db, 'SCREEN') == 2
+    db.insert_pd(screen(('u1', '2024-03-02 10:00:00', True)), 'SCREEN')
+    assert count(db, 'SCREEN') == 2
+
+def test_index_statements_declare_the_natural_key():
+    statements = index_statements(TABLES['SCREEN'])
+    assert any(s.startswith('CREATE UNIQUE INDEX IF NOT EXISTS `SCREEN_natural_key`') for s in statements)
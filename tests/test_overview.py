@@ -0,0 +1,45 @@
+import pandas as pd
+
+
+def participants(*rows):
+    return pd.DataFrame({'_id': [f"ObjectId({r[0]})" for r in rows], 'nickname': [r[1] for r in rows]})
+
+def ema(*rows):
+    return pd.DataFrame({'participantCode': [r[0] for r in rows], 'datestamp': pd.to_datetime([r[1] for r in rows])})
+
+def overview(db):
+    return sorted(tuple(map(str, r)) for r in db.query("""SELECT part_code, part_code_harm, user_id, is_participant,
+                                                          start_date, end_date FROM PartOverview"""))
+
+def load(db):
+    db.insert_pd(participants(('u1', 'MC_1001_a'), ('u2', 'MC_1002'), ('t1', 'tester')), 'Participant')
+    db.insert_pd(ema(('MC_1001_a', '2024-03-01 09:00'), ('MC_1001_a', '2024-03-02 09:00'), ('MC_1001_a', '2024-03-03 09:00'),
+                     ('MC_1002', '2024-03-05 09:00')), 'EMA')
+
+def test_overview_of_the_participants(db):
+    load(db)
+    db.update_overview()
+    assert overview(db) == [('MC_1001_a', 'MC_1001', 'u1', '1', '2024-03-02', '2024-03-29'),
+                            ('MC_1002', 'MC_1002', 'u2', '1', 'None', 'None'), #a single EMA record, not started
+                            ('tester', 'None', 't1', '0', 'None', 'None')]
+
+def test_incremental_refresh_matches_a_rebuild(db):
+    load(db)
+    db.update_overview()
+    db.insert_pd(ema(('MC_1002', '2024-03-06 09:00')), 'EMA')
+    db.insert_pd(participants(('u3', 'MC_1003')), 'Participant')
+    db.update_overview()
+    incremental = overview(db)
+    assert ('MC_1002', 'MC_1002', 'u2', '1', '2024-03-06', '2024-04-02') in incremental
+    db.update_overview(force=True)
+    assert overview(db) == incremental
+
+def test_removed_participants_and_changed_records_are_refreshed(db):
+    load(db)
+    db.update_overview()
+    with db.transaction() as connection:
+        connection.exec_driver_sql("DELETE FROM Participant WHERE nickname = 'tester'")
+        connection.exec_driver_sql("DELETE FROM EMA WHERE participantCode = 'MC_1001_a' AND datestamp LIKE '2024-03-01%'")
+    db.update_overview()
+    assert overview(db) == [('MC_1001_a', 'MC_1001', 'u1', '1', '2024-03-03', '2024-03-30'),
+                            ('MC_1002', 'MC_1002', 'u2', '1', 'None', 'None')]
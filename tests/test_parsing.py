@@ -0,0 +1,48 @@
+import json
+import pandas as pd
+from multicastps.data.parsing import parse_ios_df, stream_event_ids, ParserRegistry, IOS_PARSERS
+
+T = pd.Timestamp('2024-03-02 10:00:00', tz='Europe/Zurich').timestamp()
+
+
+def events(*rows):
+    """iOS events (event_id, payload) of one participant, a second apart, as read from a phone sensing file"""
+    return pd.DataFrame({'timestamp': [T + i for i in range(len(rows))], 'event_id': [r[0] for r in rows],
+                         'data': [json.dumps(r[1]).encode() for r in rows], 'device_id': 'd1', 'user_id': 'u1'})
+
+def location(lat):
+    return {'latitude': lat, 'longitude': 8.5, 'accuracy': 5, 'altitude': 400}
+
+def test_events_are_dispatched_to_their_tables():
+    ret = parse_ios_df(events((14, {'LockState': 1}), (151, location(47.1)), (999, {'x': 1}), (151, location(47.2)),
+                              (14, {'LockState': 0})), 'p1.db')
+    assert ret['SCREEN']['LockState'].tolist() == [True, False]
+    assert ret['LOCATION'][['latitude', 'source']].values.tolist() == [[47.1, 'all'], [47.2, 'all']]
+    assert ret['DEVICE_INFO'].values.tolist() == [['u1', 'd1', 'ios']]
+    assert set(ret) == {'SCREEN', 'LOCATION', 'DEVICE_INFO'}
+
+def test_stream_event_ids():
+    assert stream_event_ids(['LOCATION', 'SCREEN'], android=False) == [14, 151, 152]
+    assert stream_event_ids(['SCREEN', 'DEVICE_INFO'], android=False) is None #built from all events
+    assert stream_event_ids(['SCREEN'], android=True) == [136]
+
+def test_registry_calls_each_handler_once_and_times_it():
+    registry = ParserRegistry()
+    calls = []
+    @registry.register(1, tables=('A',))
+    def one(dfe, ret, dbloc):
+        calls.append(dfe['x'].tolist())
+        ret['A'] = dfe
+    df = pd.DataFrame({'event_id': [1, 2, 1], 'x': [10, 20, 30]})
+    ret = registry.parse(df, dict(), 'f')
+    assert calls == [[10, 30]] and ret['A']['x'].tolist() == [10, 30]
+    assert registry.table_events() == {'A': (1,)}
+    assert registry.timing_summary()[['event_id', 'rows', 'calls']].values.tolist() == [[1, 2, 1]]
+
+def test_ios_parsers_are_registered():
+    assert {14, 151, 152, 11, 13}.issubset(IOS_PARSERS.handlers)
+
+def test_location_events_151_and_152_of_a_file_are_both_kept():
+    #the concatenation of the second location event was not assigned, only the rows of the first one were kept
+    ret = parse_ios_df(events((152, location(47.2)), (151, location(47.1)), (152, location(47.3))), 'p1.db')
+    assert sorted(ret['LOCATION'][['latitude', 'source']].values.tolist()) == [[47.1, 'all'], [47.2, 'app'], [47.3, 'app']]
@@ -0,0 +1,33 @@
+import datetime as dt
+from multicastps.data.partitions import (add_months, months_between, partition_name, partition_month, partition_clause,
+                                         partitioned_ddl, FUTURE)
+from multicastps.data.queries_mc import PARTITIONED_TABLES, NATURAL_KEYS, TIME_COLUMNS, TABLES
+
+
+def test_months():
+    assert add_months(dt.date(2024, 11, 1), 3) == dt.date(2025, 2, 1)
+    assert add_months(dt.date(2024, 1, 1), -1) == dt.date(2023, 12, 1)
+    assert months_between(dt.date(2024, 11, 15), dt.date(2025, 1, 1)) == [dt.date(2024, 11, 1), dt.date(2024, 12, 1),
+                                                                          dt.date(2025, 1, 1)]
+    assert partition_month(partition_name(dt.date(2024, 3, 1))) == dt.date(2024, 3, 1)
+    assert partition_month(FUTURE) is None
+
+def test_partition_clause():
+    clause = partition_clause('TIMESTAMP', dt.date(2024, 1, 10), dt.date(2024, 2, 1))
+    assert clause == ("PARTITION BY RANGE (UNIX_TIMESTAMP(`TIMESTAMP`)) (\n"
+                      "PARTITION p_before VALUES LESS THAN (UNIX_TIMESTAMP('2024-01-01 00:00:00')),\n"
+                      "PARTITION p202401 VALUES LESS THAN (UNIX_TIMESTAMP('2024-02-01 00:00:00')),\n"
+                      "PARTITION p202402 VALUES LESS THAN (UNIX_TIMESTAMP('2024-03-01 00:00:00')),\n"
+                      "PARTITION p_future VALUES LESS THAN MAXVALUE)")
+    ddl = partitioned_ddl(TABLES['LOCATION'], 'TIMESTAMP', dt.date(2024, 1, 1), dt.date(2024, 1, 1))
+    assert ddl.endswith("MAXVALUE);") and ddl.count(';') == 1
+
+def test_unique_keys_of_partitioned_tables_hold_the_time_column():
+    #required by MySQL for the unique keys of a partitioned table
+    for table in PARTITIONED_TABLES:
+        assert TIME_COLUMNS[table] in NATURAL_KEYS[table]
+
+def test_embedded_databases_are_not_partitioned(db):
+    db.partition_tables()
+    db.maintain_partitions(retention_months=1)
+    assert db._partitions('LOCATION') == []
@@ -0,0 +1,87 @@
+import logging
+import sqlite3
+import time
+import pytest
+from multicastps.data import pipeline
+from multicastps.data.ingest import OK, DEFAULT_BUDGET
+from multicastps.data.pipeline import pipeline_results, run_writers, PipelineStats
+from conftest import phone_db
+
+
+@pytest.fixture
+def paths(tmp_path):
+    #files of different sizes, so that readers finish them out of order
+    return [phone_db(tmp_path / f"p{i}.db", [1, 0] * (50 * (i % 3) + 1), user=f"u{i}") for i in range(8)]
+
+@pytest.mark.parametrize('readers, workers', [(1, 1), (3, 1), (3, 2)])
+def test_results_are_in_the_order_of_the_files(paths, readers, workers):
+    results = list(pipeline_results(paths, DEFAULT_BUDGET, ['SCREEN'], readers=readers, workers=workers))
+    assert [r[0] for r in results] == paths
+    assert all(status == OK for dbloc, status, df_dict, seconds in results)
+    assert [len(r[2]['SCREEN']) for r in results] == [2 * (50 * (i % 3) + 1) for i in range(8)]
+
+def test_reader_errors_are_raised_by_the_consumer(paths, monkeypatch):
+    read_task = pipeline.read_task
+    def failing(task):
+        if task[0] == paths[3]:
+            raise OSError('disk error')
+        return read_task(task)
+    monkeypatch.setattr(pipeline, 'read_task', failing)
+    seen = []
+    with pytest.raises(OSError, match='disk error'):
+        for dbloc, status, df_dict, seconds in pipeline_results(paths, DEFAULT_BUDGET, ['SCREEN'], readers=2):
+            seen.append(dbloc)
+    #raised as soon as it reaches the consumer, the files not yielded yet are processed again by the next run
+    assert seen == paths[:len(seen)] and len(seen) <= 3
+
+def test_worker_logs_are_replayed_in_file_order(tmp_path, caplog):
+    paths = [phone_db(tmp_path / f"p{i}.db", [1, 0] * (20 * i + 1), user=f"u{i}") for i in range(6)]
+    for path in paths[1::2]: #payloads that can't be repaired, logged by the parser
+        with sqlite3.connect(path) as connection:
+            connection.execute("UPDATE events SET event_data = CAST('not json' AS BLOB) WHERE rowid = 1")
+    logs = []
+    for workers in [1, 2]:
+        caplog.clear()
+        with caplog.at_level(logging.INFO, logger='make_db'):
+            results = list(pipeline_results(paths, DEFAULT_BUDGET, ['SCREEN'], readers=2, workers=workers))
+        assert [r[0] for r in results] == paths
+        logs.append([r.getMessage() for r in caplog.records if r.name == 'make_db'])
+    assert logs[0] == logs[1] and [paths[i] in m for i, m in zip([1, 3, 5], logs[0])] == [True] * 3
+
+def test_writers_get_all_chunks_of_a_file():
+    results = [(f"p{i}", j) for i in range(6) for j in range(3)]
+    written = []
+    def write(chunks):
+        written.append(list(chunks))
+    stats = PipelineStats()
+    stats.stage('write', 3)
+    run_writers(iter(results), 3, write, stats=stats)
+    assert sorted(r for chunks in written for r in chunks) == results
+    for chunks in written: #chunks of a file are consecutive and in order within a writer
+        files = [f for f, j in chunks]
+        assert [j for f, j in chunks] == [j for f in dict.fromkeys(files) for j in range(3)]
+
+def test_writer_errors_are_raised_by_the_dispatcher():
+    def write(chunks):
+        for dbloc, j in chunks:
+            if dbloc == 'p4':
+                raise ValueError('bad chunk')
+    stats = PipelineStats()
+    stats.stage('write', 2)
+    with pytest.raises(ValueError, match='bad chunk'):
+        run_writers(iter([(f"p{i}", 0) for i in range(20)]), 2, write, stats=stats)
+
+def test_files_left_out_after_a_writer_error_are_logged(caplog):
+    written = []
+    def write(chunks):
+        for dbloc, j in chunks:
+            if dbloc == 'p0':
+                time.sleep(0.1) #the dispatcher queues more files for this writer meanwhile
+                raise ValueError('bad chunk')
+            written.append(dbloc)
+    stats = PipelineStats()
+    stats.stage('write', 2)
+    with pytest.raises(ValueError, match='bad chunk'):
+        run_writers(iter([(f"p{i}", 0) for i in range(20)]), 2, write, stats=stats)
+    left_out = [r.getMessage().split(': ')[-1] for r in caplog.records if 'Not uploaded' in r.getMessage()]
+    assert left_out and not set(left_out) & set(written) and 'p0' not in left_out
@@ -0,0 +1,37 @@
+import pandas as pd
+import pytest
+from conftest import screen
+from test_overview import load
+
+
+def test_filters_are_applied_in_the_query(db):
+    db.insert_pd(screen(('u1', '2024-03-01 10:00:00', 1), ('u1', '2024-03-02 10:00:00', 0), ('u1', '2024-03-03 10:00:00', 1),
+                        ('u2', '2024-03-02 10:00:00', 1)), 'SCREEN')
+    df = db.get_stream('SCREEN', ['u1'], '2024-03-02', '2024-03-03', ['TIMESTAMP', 'LOCKSTATE'])
+    assert df.columns.tolist() == ['TIMESTAMP', 'LOCKSTATE'] and len(df) == 1
+    assert df['TIMESTAMP'].dtype == 'datetime64[us]' and df['LOCKSTATE'].dtype == 'Int64'
+    assert df['TIMESTAMP'][0] == pd.Timestamp('2024-03-02 10:00:00')
+    assert len(db.get_stream('SCREEN')) == 4
+
+def test_chunks_and_empty_results_have_the_same_types(db):
+    db.insert_pd(screen(*[('u1', f"2024-03-01 10:{m:02d}:00", m % 2) for m in range(10)]), 'SCREEN')
+    chunks = list(db.get_stream('SCREEN', chunksize=3))
+    assert [len(df) for df in chunks] == [3, 3, 3, 1]
+    empty = db.get_stream('SCREEN', ['nobody'])
+    assert len(empty) == 0 and empty.dtypes.tolist() == chunks[0].dtypes.tolist()
+
+def test_participant_codes_are_resolved(db):
+    load(db)
+    db.update_overview()
+    db.insert_pd(screen(('u1', '2024-03-01 10:00:00', 1), ('u2', '2024-03-01 10:00:00', 1)), 'SCREEN')
+    assert db.resolve_participants(['MC_1001', 'unknown']) == ['u1', 'unknown']
+    assert db.get_stream('SCREEN', ['MC_1001'])['USER_ID'].tolist() == ['u1']
+    assert db.get_stream('EMA', ['u2'])['participantCode'].tolist() == ['MC_1002']
+
+def test_invalid_filters_raise_before_reading(db):
+    with pytest.raises(ValueError):
+        db.get_stream('SCREEN', columns=['NOPE'])
+    with pytest.raises(ValueError):
+        db.get_stream('NO_TABLE')
+    with pytest.raises(ValueError):
+        db.get_stream('SCREEN', columns=['NOPE'], chunksize=10)
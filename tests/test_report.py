@@ -0,0 +1,45 @@
+import datetime as dt
+import time
+import pandas as pd
+from sqlalchemy import event
+from conftest import screen
+from test_overview import load
+
+
+def normalized(report):
+    #dates as text and missing values as None, SQLite returns the dates of raw queries as text
+    def value(v):
+        if isinstance(v, list):
+            return [value(x) for x in v]
+        if isinstance(v, dict):
+            return {k: value(x) for k, x in v.items()}
+        if isinstance(v, (dt.date, pd.Timestamp)):
+            return str(v)[:10]
+        return None if pd.isna(v) else str(v)
+    return [[value(v) for v in row] for row in report.itertuples(index=False)]
+
+def test_report_of_the_study_participants(db):
+    load(db)
+    db.insert_pd(screen(('u1', '2024-03-02 10:00:00', True), ('u1', '2024-03-03 10:00:00', True),
+                        ('u1', '2024-03-05 10:00:00', True)), 'SCREEN')
+    report = db.make_participant_report().set_index('part_code_harm')
+    assert report.index.tolist() == ['MC_1001', 'MC_1002'] #not the tester
+    row = report.loc['MC_1001']
+    assert (row['ema_count'], row['ema_missed'], row['tot_days_ps'], row['days_no_ps']) == (2, 68, 3, 25)
+    assert row['dates_no_ps_idx'][:2] == [3, 5]
+    assert row['all_windows']['SCREEN'] == {'min': ['2024-03-02', '2024-03-05'], 'max': ['2024-03-03', '2024-03-05']}
+
+def test_summary_gives_the_same_report(db):
+    load(db)
+    db.insert_pd(screen(('u1', '2024-03-02 10:00:00', True), ('u2', '2024-03-06 10:00:00', True)), 'SCREEN')
+    report = db.make_participant_report()
+    assert normalized(db.make_participant_report(summary=True)) == normalized(report)
+
+def test_concurrent_queries_give_the_same_report(db):
+    load(db)
+    db.insert_pd(screen(('u1', '2024-03-02 10:00:00', True), ('u2', '2024-03-06 10:00:00', True)), 'SCREEN')
+    report = normalized(db.make_participant_report(workers=1))
+    #queries of SQLite end in no time, connections are held a little so that those of the workers overlap
+    event.listen(db.engine, 'checkout', lambda *args: time.sleep(0.05))
+    assert normalized(db.make_participant_report(workers=8)) == report
+    assert db.pool_stats.summary()['max_checked_out'] > 1
@@ -0,0 +1,37 @@
+from sqlalchemy import text
+from multicastps.data.queries_mc import TABLES
+from multicastps.data.schema import VERSION, MANAGED_TABLES, natural_key_current
+from conftest import open_db, screen, count
+
+
+def test_a_new_database_gets_all_migrations(db):
+    assert db.query("SELECT MAX(VERSION) FROM SCHEMA_VERSION") == [(VERSION,)]
+    assert MANAGED_TABLES <= set(db.get_table_names())
+
+def test_opening_again_runs_no_migration(tmp_path):
+    open_db(tmp_path / 'multicast.sqlite').engine.dispose()
+    db = open_db(tmp_path / 'multicast.sqlite')
+    assert db.query("SELECT COUNT(*) FROM SCHEMA_VERSION") == [(VERSION,)]
+
+def test_tables_with_an_older_key_are_reported_not_rebuilt(tmp_path, caplog):
+    path = tmp_path / 'multicast.sqlite'
+    db = open_db(path)
+    with db.transaction() as connection: #SCREEN as created before the natural keys of the event values
+        connection.execute(text("DROP TABLE SCREEN"))
+        connection.execute(text(TABLES['SCREEN'].split('UNIQUE KEY')[0].rstrip().rstrip(',') + ')'))
+        connection.execute(text("DELETE FROM SCHEMA_VERSION WHERE VERSION = :version"), {'version': VERSION})
+    db.insert_pd(screen(('u1', '2024-03-02 10:00:00', True), ('u1', '2024-03-02 10:00:00', True)), 'SCREEN')
+    db.engine.dispose()
+    db = open_db(path)
+    assert db.query("SELECT MAX(VERSION) FROM SCHEMA_VERSION") == [(VERSION,)]
+    assert count(db, 'SCREEN') == 2 and '--add-keys' in caplog.text
+    db.add_natural_keys()
+    assert count(db, 'SCREEN') == 1
+    with db.engine.connect() as connection:
+        assert natural_key_current('sqlite', connection, 'SCREEN')
+
+def test_metadata_is_reflected_on_first_use(db):
+    assert 'SCREEN' not in db.schema.metadata.tables
+    assert 'LOCKSTATE' in db.schema.table('SCREEN').c
+    db.drop_indexes(['SCREEN'])
+    assert 'SCREEN' not in db.schema.metadata.tables #reflected again after a change
@@ -0,0 +1,55 @@
+import pandas as pd
+import pytest
+from multicastps.data.ingest import OK, FAILED
+from multicastps.data.ledger import DONE, SKIPPED
+from multicastps.data.staging import stage_file, staged_chunks, read_manifest, is_staged, read_table, staged_fingerprint
+from multicastps.data.ledger import fingerprint
+
+pytest.importorskip('pyarrow')
+
+
+def screen(user, times):
+    return pd.DataFrame({'timestamp': pd.to_datetime(times).tz_localize('Europe/Zurich'), 'user_id': user,
+                         'LockState': [True] * len(times)})
+
+@pytest.fixture
+def source(tmp_path):
+    path = tmp_path / 'p1.db'
+    path.write_bytes(b'events')
+    return str(path)
+
+def test_staged_chunks_are_read_back_in_order(tmp_path, source):
+    stage = str(tmp_path / 'stage')
+    chunks = [(OK, {'SCREEN': screen('u1', ['2024-03-02 10:00', '2024-03-03 10:00'])}, 1.0),
+              (OK, {'SCREEN': screen('u1', ['2024-03-03 11:00']), 'BRIGHTNESS': screen('u1', ['2024-03-03 11:00'])}, 2.0)]
+    assert stage_file(stage, source, chunks, ['SCREEN'], unread={'LOCATION'}) == OK
+    manifest = read_manifest(stage, source)
+    assert manifest['streams'] == {'SCREEN': [DONE, 3], 'BRIGHTNESS': [SKIPPED, 0], 'LOCATION': [SKIPPED, 0]}
+    assert staged_fingerprint(manifest) == fingerprint(source)
+    read = list(staged_chunks(stage, manifest, ['SCREEN']))
+    assert [seconds for status, df_dict, seconds in read] == [3.0, 0.0]
+    assert [len(df_dict['SCREEN']) for status, df_dict, seconds in read] == [2, 1]
+    pd.testing.assert_frame_equal(read[0][1]['SCREEN'].sort_values('timestamp', ignore_index=True),
+                                  chunks[0][1]['SCREEN'], check_dtype=False)
+
+def test_a_source_is_staged_until_it_changes(tmp_path, source):
+    stage = str(tmp_path / 'stage')
+    stage_file(stage, source, [(OK, {'SCREEN': screen('u1', ['2024-03-02 10:00'])}, 1.0)], ['SCREEN'], unread={'LOCATION'})
+    assert is_staged(stage, source, ['SCREEN'])
+    assert not is_staged(stage, source, ['SCREEN', 'LOCATION']) #not staged yet
+    with open(source, 'ab') as f:
+        f.write(b' changed')
+    assert not is_staged(stage, source, ['SCREEN'])
+
+def test_a_failing_source_leaves_no_file(tmp_path, source):
+    stage = str(tmp_path / 'stage')
+    chunks = [(OK, {'SCREEN': screen('u1', ['2024-03-02 10:00'])}, 1.0), (FAILED, None, 1.0)]
+    assert stage_file(stage, source, chunks, None) == FAILED
+    assert read_manifest(stage, source) is None and read_table(stage, 'SCREEN').empty
+
+def test_tables_are_read_by_participant_and_day(tmp_path, source):
+    stage = str(tmp_path / 'stage')
+    df = pd.concat([screen('u1', ['2024-03-02 10:00', '2024-03-04 10:00']), screen('u2', ['2024-03-03 10:00'])])
+    stage_file(stage, source, [(OK, {'SCREEN': df}, 1.0)], None)
+    assert len(read_table(stage, 'SCREEN')) == 3
+    assert read_table(stage, 'SCREEN', user_id='u1', start='2024-03-03')['timestamp'].dt.day.tolist() == [4]
@@ -0,0 +1,35 @@
+from multicastps.data.ledger import IngestLedger, DONE, PARTIAL, FAILED
+from multicastps.data.write_buffer import WriteBuffer
+from conftest import screen, count
+
+
+def fingerprint(name):
+    return (1, 1.0, name)
+
+def test_files_are_uploaded_together_on_flush(db):
+    buffer = WriteBuffer(db, IngestLedger(db))
+    for i in range(3):
+        buffer.add(f"p{i}.db", {'SCREEN': screen((f"u{i}", '2024-03-02 10:00:00', True))}, 0.1, ['SCREEN'],
+                   fp=fingerprint(f"p{i}"))
+    assert len(buffer) == 3 and count(db, 'SCREEN') == 0
+    assert buffer.flush() == {'p0.db': set(), 'p1.db': set(), 'p2.db': set()}
+    assert count(db, 'SCREEN') == 3
+    assert db.query("SELECT COUNT(*) FROM INGEST_LEDGER WHERE STATUS = :status", {'status': DONE}) == [(3,)]
+
+def test_a_full_buffer_flushes(db):
+    buffer = WriteBuffer(db, IngestLedger(db), max_rows=2)
+    buffer.add('p0.db', {'SCREEN': screen(('u0', '2024-03-02 10:00:00', True))}, 0.1, ['SCREEN'], fp=fingerprint('p0'))
+    flushed = buffer.add('p1.db', {'SCREEN': screen(('u1', '2024-03-02 10:00:00', True))}, 0.1, ['SCREEN'],
+                         fp=fingerprint('p1'))
+    assert set(flushed) == {'p0.db', 'p1.db'}
+    assert len(buffer) == 0 and buffer.flushes == 1
+
+def test_only_the_files_with_bad_rows_fail(db):
+    buffer = WriteBuffer(db, IngestLedger(db))
+    buffer.add('good.db', {'SCREEN': screen(('u0', '2024-03-02 10:00:00', True))}, 0.1, ['SCREEN'], fp=fingerprint('good'))
+    bad = screen(('u1', '2024-03-02 10:00:00', True)).assign(UNKNOWN_COLUMN=1)
+    buffer.add('bad.db', {'SCREEN': bad}, 0.1, ['SCREEN'], fp=fingerprint('bad'))
+    assert buffer.flush() == {'good.db': set(), 'bad.db': {'SCREEN'}}
+    assert db.query("SELECT USER_ID FROM SCREEN") == [('u0',)]
+    assert sorted(db.query("SELECT PATH, STATUS FROM INGEST_LEDGER")) == [('bad.db', PARTIAL), ('good.db', DONE)]
+    assert db.query("SELECT STATUS FROM INGEST_LEDGER_STREAMS WHERE PATH = 'bad.db'") == [(FAILED,)]